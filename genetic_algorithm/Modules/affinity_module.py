@@ -1,6 +1,7 @@
 import numpy as np
 from Utils.manage_memory import ChromaMemory
-from Utils.invoke_llm import get_claude_response  # Bedrock API を呼び出す関数
+from Utils.invoke_llm import get_structured_response  # Bedrock API を呼び出す関数
+from Utils.structured_output import SCORE_SCHEMA
 from Utils.internal_state import InternalState
 
 class AffinityModule:
@@ -28,11 +29,9 @@ class AffinityModule:
 
         ユーザーの発話: "{user_input}"
         """
-        response = get_claude_response(prompt)
-
-        # LLM の出力を数値化
+        # LLM の出力を数値化（小さいモデルで採点し、読めなければ修復 → 大きいモデルで 1 度だけ聞き直す）
         try:
-            affinity_score = float(response.strip())
+            affinity_score = get_structured_response(prompt, SCORE_SCHEMA, tag="affinity")
             affinity_score = max(-1, min(1, affinity_score))  # -1 〜 1 の範囲に制限
         except ValueError:
             affinity_score = 0  # エラー時は中立とする
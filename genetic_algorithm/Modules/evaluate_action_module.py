@@ -12,7 +12,10 @@ from typing import List, Dict, Tuple, Optional
 from Utils.internal_state import InternalState
 from Modules.working_memory import WorkingMemory
 from short_term_memory import STM
-from Utils.invoke_llm import get_claude_response
+from Utils.invoke_llm import RequestShed, get_structured_response
+from Utils.structured_output import SCORE_SCHEMA
+from Utils.local_scorer import get_scorer, window_embedding
+import numpy as np
 
 
 class ShortRewardModule:
@@ -20,12 +23,14 @@ class ShortRewardModule:
     MAX_WAIT_SEC       = 30     # 自発発話後、相手応答を待つ最大秒数
     REWARD_THRESHOLD   = 0.70   # STM へ格納する報酬閾値
     MEMORY_WINDOW      = 3      # 最近 N 件のペアを保持
+    LLM_CACHE_TTL      = 3600   # 同じ目的・対話の採点は使い回す（秒）
     # -------------------------------------------------- #
 
     def __init__(self):
         self.internal_state = InternalState()
         self.wm             = WorkingMemory()
         self.stm            = STM()
+        self.scorer         = get_scorer("short_term_reward")
 
         # 「どこまでスキャン済みか」を覚えておくポインタ
         self._last_idx: int = 0
@@ -52,8 +57,13 @@ class ShortRewardModule:
                 # 次の user 発話を探す
                 j, user_entry = self._find_next_user(mem, i + 1)
                 if user_entry:
-                    self._score_and_store(purpose, self_entry, user_entry)
+                    if not self._score_and_store(purpose, self_entry, user_entry):
+                        # 採点を見送った。このペアから次回やり直す
+                        break
                     i = j + 1           # 次へ
+                elif j < len(mem):
+                    # 応答が遅すぎる（見送ったペアを後で拾い直した場合も含む）。採点せずに次へ
+                    i = j + 1
                 else:
                     # 相手応答待ち。次回呼び出し時に再判定
                     break
@@ -80,8 +90,11 @@ class ShortRewardModule:
                 return idx, None               # ⌛ 遅すぎる
         return len(mem), None                  # 見つからず
 
-    def _score_and_store(self, purpose: str, self_e: Dict, user_e: Dict) -> None:
-        """LLM で採点 → short_reward 反映 → STM 保存(必要なら)"""
+    def _score_and_store(self, purpose: str, self_e: Dict, user_e: Dict) -> bool:
+        """LLM で採点 → short_reward 反映 → STM 保存(必要なら)
+
+        混雑で採点を見送ったときは False（呼び出し側はこのペアを走査済みにしない）
+        """
         dialogue = f"あなた: {self_e['text']}\n相手: {user_e['text']}"
 
         prompt = f"""
@@ -95,9 +108,20 @@ class ShortRewardModule:
         {dialogue}
         """
 
+        def ask_llm():
+            return get_structured_response(prompt, SCORE_SCHEMA, cache_ttl=self.LLM_CACHE_TTL, tag="short_term_reward", latest_wins=True)
+
         try:
-            score = float(get_claude_response(prompt).strip())
+            # 目的の埋め込み + 対話ペアの埋め込み平均を特徴量にする
+            features = np.concatenate([
+                self.wm.sentence_transformer.encode(purpose),
+                window_embedding([self_e, user_e]),
+            ])
+            score = self.scorer.score(ask_llm, features, text=f"{purpose}\n{dialogue}")
             score = max(-1.0, min(1.0, score))
+        except RequestShed as e:
+            print(f"⏸️ short_term_reward の評価を見送り（前回の値のまま）: {e}")
+            return False
         except Exception as e:
             print(f"⚠️ RewardModule: LLM 評価失敗 ({e})")
             score = 0.0
@@ -111,3 +135,4 @@ class ShortRewardModule:
                 feedback=dialogue,
                 reward=score
             )
+        return True
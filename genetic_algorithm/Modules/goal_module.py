@@ -25,7 +25,7 @@ class GoalModule:
         """
 
         # print(f"goalのプロンプトだよん: {prompt}")
-        response = get_claude_response(prompt)
+        response = get_claude_response(prompt, tag="goal", route="plan", latest_wins=True)
         return response.strip()
 
     def update_internal_goal(self):
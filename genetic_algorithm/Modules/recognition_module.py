@@ -1,16 +1,20 @@
 import os
 from Modules.working_memory import WorkingMemory
-from Utils.invoke_llm import get_claude_response
+from Utils.invoke_llm import get_structured_response
+from Utils.structured_output import SCORE_SCHEMA
 from Utils.internal_state import InternalState
+from Utils.local_scorer import get_scorer, window_embedding
 
 class RecognitionModule:
     """
     自己イメージと現実のギャップを評価するモジュール
     """
+    LLM_CACHE_TTL = 600  # 会話履歴が変わらなければ再評価しない（秒）
 
     def __init__(self):
         self.internal_state = InternalState()
         self.working_memory = WorkingMemory()
+        self.scorer = get_scorer("recognition")
 
         # 自己イメージを設定ファイル（txt）からロード
         self.self_image = self.load_self_image()
@@ -59,10 +63,13 @@ class RecognitionModule:
         0.7
         """
 
-        response = get_claude_response(prompt)
+        def ask_llm():
+            return get_structured_response(prompt, SCORE_SCHEMA, cache_ttl=self.LLM_CACHE_TTL, tag="recognition", latest_wins=True)
 
         try:
-            recognition_score = float(response.strip())
+            recognition_score = self.scorer.score(
+                ask_llm, window_embedding(recent_memories[-8:]), text=recent_texts
+            )
             recognition_score = max(-1.0, min(1.0, recognition_score))
         except ValueError:
             recognition_score = 0.0  # エラー時は無難に中立
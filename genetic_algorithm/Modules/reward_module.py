@@ -3,13 +3,19 @@
 from short_term_memory import STM
 from Utils.internal_state import InternalState
 from Modules.working_memory import WorkingMemory
-from Utils.invoke_llm import get_claude_response
+from Utils.invoke_llm import RequestShed, get_structured_response
+from Utils.structured_output import SCORE_SCHEMA
+from Utils.local_scorer import get_scorer, window_embedding
+import numpy as np
 
 class RewardModule:
+    LLM_CACHE_TTL = 300  # 目標と会話が変わらなければ再評価しない（秒）
+
     def __init__(self):
         self.internal_state = InternalState()
         self.wm = WorkingMemory()
         self.stm = STM()
+        self.longtime_scorer = get_scorer("long_term_reward")
 
     def evaluate_reward(self, purpose: str = None):
         recent_memory = self.wm.get_memory()
@@ -31,9 +37,7 @@ class RewardModule:
         """
 
         try:
-            response = get_claude_response(prompt)
-            print(f"responseでええエス: {response}")
-            reward_score = float(response.strip())
+            reward_score = get_structured_response(prompt, SCORE_SCHEMA, tag="reward")
             reward_score = max(-1.0, min(1.0, reward_score))
         except Exception as e:
             print(f"⚠️ LLM 評価失敗: {e}")
@@ -79,10 +83,21 @@ class RewardModule:
         {recent_texts}
         """
 
+        def ask_llm():
+            return get_structured_response(prompt, SCORE_SCHEMA, cache_ttl=self.LLM_CACHE_TTL, tag="long_term_reward", latest_wins=True)
+
         try:
-            response = get_claude_response(prompt)
-            long_reward_score = float(response.strip())
+            # 目標の埋め込み + 直近会話の埋め込み平均を特徴量にする（目標の埋め込みがまだなければ LLM で採点）
+            goal_embedding = self.internal_state.get_text_embedding("long_term_goal")
+            if goal_embedding is None:
+                long_reward_score = float(ask_llm())
+            else:
+                features = np.concatenate([goal_embedding, window_embedding(recent_memory[-8:])])
+                long_reward_score = self.longtime_scorer.score(ask_llm, features, text=f"{goal}\n{recent_texts}")
             long_reward_score = max(-1.0, min(1.0, long_reward_score))
+        except RequestShed as e:
+            print(f"⏸️ long_term_reward の評価を見送り（前回の値のまま）: {e}")
+            return
         except Exception as e:
             print(f"⚠️ LLM 評価失敗: {e}")
             long_reward_score = 0.0
@@ -1,6 +1,9 @@
 from Utils.internal_state import InternalState
-from Utils.invoke_llm import get_claude_response
+from Utils.invoke_llm import RequestShed, get_structured_response
+from Utils.structured_output import SCORE_SCHEMA
 from Modules.working_memory import WorkingMemory
+from Utils.local_scorer import get_scorer, window_embedding
+import numpy as np
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
@@ -12,10 +15,14 @@ class SocialityModule:
     - 会話内容に孤独感・拒絶感が含まれる
     などを考慮して評価する。
     """
+    LLM_CACHE_TTL = 60  # 直近 1 分の会話が変わらなければ再評価しない（秒）
+    COUNT_SCALE = 10    # 会話頻度の特徴量はこの回数で頭打ちにして 0〜1 に収める
 
     def __init__(self):
         self.internal_state = InternalState()
         self.working_memory = WorkingMemory()
+        # 会話頻度を 0〜1 に正規化した特徴量で学習し直すため、生の回数で記録した "sociality" とは分ける
+        self.scorer = get_scorer("sociality_scaled")
 
     def calculate_sociality(self):
         all_memories = self.working_memory.get_memory()
@@ -87,14 +94,22 @@ class SocialityModule:
         数値のみ（例: -0.8, 0.5 など）
         """
 
-        response = get_claude_response(prompt)
+        def ask_llm():
+            return get_structured_response(prompt, SCORE_SCHEMA, cache_ttl=self.LLM_CACHE_TTL, tag="sociality", latest_wins=True)
+
+        # 会話内容の埋め込み + 会話頻度を特徴量にする
+        # 生の回数だと埋め込み（ノルム 1 以下）より大きくなり、分布外判定の類似度が回数だけで決まってしまう
+        features = np.append(window_embedding(recent_memories), min(recent_count, self.COUNT_SCALE) / self.COUNT_SCALE)
 
         try:
-            score = float(response.strip())
+            score = self.scorer.score(ask_llm, features, text=dialogue_str)
             score = max(-1.0, min(1.0, score))
             self.internal_state.modify_state_value("sociality", score)
             return score
-        except ValueError:
-            print(f"⚠️ sociality の評価に失敗: {response}")
+        except RequestShed as e:
+            print(f"⏸️ sociality の評価を見送り（前回の値のまま）: {e}")
+            return None
+        except ValueError as e:
+            print(f"⚠️ sociality の評価に失敗: {e}")
             self.internal_state.modify_state_value("sociality", 0.0)
             return 0.0
@@ -27,12 +27,13 @@ class WorkingMemory:
             self.initialized = True
             self.start_expiry_checker()
 
-    def add_entry(self, text, importance=0.5, speaker=None, purpose=None):
+    def add_entry(self, text, importance=0.5, speaker=None, purpose=None, embedding=None):
         if len(self.memory) == self.memory.maxlen:
             oldest_entry = self.memory.popleft()
             self.move_to_stm(oldest_entry)
 
-        embedding = self.sentence_transformer.encode(text)
+        if embedding is None:  # 呼び出し側で計算済みなら使い回す
+            embedding = self.sentence_transformer.encode(text)
         timestamp = datetime.now(ZoneInfo("Asia/Tokyo"))
 
         entry = {
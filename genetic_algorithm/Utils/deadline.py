@@ -0,0 +1,69 @@
+"""
+処理単位の締め切り（Deadline）
+
+CognitiveController のノードやモジュールのループが「この処理にあと何秒使えるか」を
+deadline_scope() で宣言し、その中で呼ばれた LLM 呼び出しが current_deadline() で参照する。
+    with deadline_scope(40, "plan_action"):
+        get_claude_response(...)   # timeout は残り時間で切り詰められ、過ぎていれば送らない
+スコープは入れ子にでき、内側は外側より長くならない（厳しい方が勝つ）。
+contextvars なので、スレッド・asyncio タスクごとに独立している。
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(TimeoutError):
+    """締め切りを過ぎたため LLM 呼び出しを送らなかった / 待つのをやめた"""
+
+
+class Deadline:
+    def __init__(self, budget: float | None, name: str = "", parent: "Deadline | None" = None):
+        """
+        :param budget: 残り秒数（None なら親の締め切りをそのまま使う）
+        :param parent: 外側の締め切り。これより後ろにはならない
+        """
+        expires_at = None if budget is None else time.monotonic() + budget
+        if parent is not None and parent.expires_at is not None:
+            expires_at = parent.expires_at if expires_at is None else min(expires_at, parent.expires_at)
+        self.expires_at = expires_at
+        self.name = name or (parent.name if parent is not None else "")
+
+    def remaining(self) -> float | None:
+        """残り秒数（締め切りなしなら None、過ぎていれば 0）"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def cap(self, timeout: float | None) -> float | None:
+        """timeout を残り時間で切り詰める"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def __repr__(self) -> str:
+        remaining = self.remaining()
+        left = "∞" if remaining is None else f"{remaining:.1f}s"
+        return f"Deadline({self.name!r}, remaining={left})"
+
+
+_current: contextvars.ContextVar[Deadline | None] = contextvars.ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Deadline | None:
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(budget: float | None, name: str = ""):
+    """この with の中の処理に budget 秒の締め切りを付ける（外側のスコープより長くはならない）"""
+    dl = Deadline(budget, name, parent=_current.get())
+    token = _current.set(dl)
+    try:
+        yield dl
+    finally:
+        _current.reset(token)
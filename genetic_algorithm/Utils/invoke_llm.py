@@ -1,19 +1,47 @@
 # =========================================
 # invoke_llm.py  (丸ごと置き換え例)
 # =========================================
-import os, json, time, threading, inspect
-from queue import Queue
-import boto3, botocore
+import os, json, time, threading, asyncio, weakref, atexit
+from collections import deque
+from dataclasses import dataclass, field
+from concurrent.futures import CancelledError
+from queue import Empty, Full, Queue
 from botocore.config import Config
+from botocore.exceptions import ReadTimeoutError
 from dotenv import load_dotenv
+from Utils.deadline import DeadlineExceeded, current_deadline
+from Utils.llm_backend import get_backend
+from Utils.llm_cache import LLMCache, make_key
+from Utils.llm_metrics import metrics
+from Utils.rate_limiter import estimate_tokens, get_limiter, is_throttle
+from Utils.structured_output import parse_structured, reask_prompt, schema_instruction
 
 load_dotenv()
 
 # ---------- Bedrock 定数 ----------
 MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
-REGION    = os.getenv("AWS_REGION", "us-east-1")
-AWS_KEY   = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET= os.getenv("AWS_SECRET_ACCESS_KEY")
+FAST_MODEL_ID = os.getenv("LLM_FAST_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+MAX_TOKENS = 1000
+TEMPERATURE = 0.7
+
+# ---------- 呼び出し種別ごとのルーティング ----------
+# score   : 数値 1 つを返す採点（重要度・社会性・報酬など）
+# judge   : True/False などの判定
+# plan    : 行動計画・目標など短い構造化テキスト
+# dialogue: 相手に送る発話
+# default : 種別を指定しない呼び出し（従来どおり）。パース失敗時のフォールバック先でもある
+ROUTES = {
+    "score":    {"model": FAST_MODEL_ID, "max_tokens": 16,  "temperature": 0.0, "stop": ["理由"]},
+    "judge":    {"model": FAST_MODEL_ID, "max_tokens": 8,   "temperature": 0.0, "stop": ["理由"]},
+    "plan":     {"model": MODEL_ID,      "max_tokens": 600, "temperature": 0.3, "stop": []},
+    "dialogue": {"model": MODEL_ID,      "max_tokens": 300, "temperature": TEMPERATURE, "stop": []},
+    "default":  {"model": MODEL_ID,      "max_tokens": MAX_TOKENS, "temperature": TEMPERATURE, "stop": []},
+}
+# LLM_ROUTES='{"score": {"model": "..."}}' のように JSON で部分的に上書きできる
+for _name, _override in json.loads(os.getenv("LLM_ROUTES", "{}")).items():
+    ROUTES[_name] = {**ROUTES.get(_name, ROUTES["default"]), **_override}
+DEFAULT_ROUTE = "default"
+FALLBACK_ROUTE = "default"
 
 # ---------- 共通設定 ----------
 _bedrock_cfg = Config(
@@ -22,151 +50,1139 @@ _bedrock_cfg = Config(
     max_pool_connections=10,
 )
 
+# ---------- プロンプトキャッシュ ----------
+# system の静的部分の末尾に cache_control を付け、毎回同じプレフィックスを送る呼び出しで
+# 入力トークンの課金と最初のトークンまでの時間を減らす。対応していないモデルでは 0 にする。
+PROMPT_CACHE = os.getenv("LLM_PROMPT_CACHE", "1") == "1"
+
+def system_prompt(*static_parts: str) -> list[dict]:
+    """
+    人格・ルール・アクション一覧など毎回変わらない部分を system ブロックにする。
+    最後のブロックにキャッシュのブレークポイントを置くので、可変な内容は含めないこと。
+    """
+    blocks = [{"type": "text", "text": part} for part in static_parts if part]
+    if PROMPT_CACHE and blocks:
+        blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return blocks
+
+def _system_text(system) -> str:
+    if not system:
+        return ""
+    if isinstance(system, str):
+        return system
+    return "".join(b.get("text", "") for b in system)
+
 # ---------- 内部ヘルパ ----------
-def _build_body(prompt: str) -> str:
+def _build_body(prompt: str, system: str | list | None = None, route: str = DEFAULT_ROUTE) -> str:
     """Bedrock invoke_model 用 JSON ボディを構築"""
-    return json.dumps({
+    r = ROUTES[route]
+    body = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 1000,
+        "max_tokens": r["max_tokens"],
         "messages": [
             {"role": "user", "content": prompt}
         ],
-        "temperature": 0.7,
-    })
+        "temperature": r["temperature"],
+    }
+    if r["stop"]:
+        body["stop_sequences"] = r["stop"]
+    if system:
+        body["system"] = system
+    return json.dumps(body)
+
+def _estimate(prompt: str, system, route: str) -> int:
+    """リミッタ用の消費トークン見積もり（入力 + 出力上限の 1/4）"""
+    return estimate_tokens(prompt + _system_text(system)) + ROUTES[route]["max_tokens"] // 4
+
+def _bounded(timeout: float | None, tag: str) -> float | None:
+    """
+    呼び出し元の Deadline（deadline_scope）で timeout を切り詰める。
+    既に過ぎていれば送らずに DeadlineExceeded（締め切り切れとしてタグごとに数える）
+    """
+    dl = current_deadline()
+    if dl is None:
+        return timeout
+    if dl.expired():
+        print(f"⌛ 締め切り '{dl.name}' 超過のため送信しない ← {tag}")
+        metrics.outcome(tag, "deadline_miss")
+        raise DeadlineExceeded(f"deadline '{dl.name}' passed before the request was sent")
+    return dl.cap(timeout)
+
+def _timed_out(tag: str, message: str) -> TimeoutError:
+    """待ちきれなかったときの例外。原因が Deadline なら DeadlineExceeded / deadline_miss にする"""
+    dl = current_deadline()
+    if dl is not None and dl.expired():
+        metrics.outcome(tag, "deadline_miss")
+        return DeadlineExceeded(f"{message} (deadline '{dl.name}')")
+    metrics.outcome(tag, "caller_timeout")
+    return TimeoutError(message)
+
+def _observe_usage(tag: str, usage: dict) -> None:
+    """usage の内訳（新規入力 / キャッシュ読み出し / キャッシュ書き込み / 出力）を記録"""
+    metrics.observe(
+        tag,
+        input_tokens=usage.get("input_tokens"),
+        output_tokens=usage.get("output_tokens"),
+        cache_read_tokens=usage.get("cache_read_input_tokens"),
+        cache_write_tokens=usage.get("cache_creation_input_tokens"),
+    )
+
+# ---------- 優先度クラス ----------
+# rank が小さいほど先に取り出される。
+# max_concurrency: そのクラスが同時に占有できるワーカー数
+# max_queue      : そのクラスの待ち行列の上限（超えたら queue.Full）
+# shed_depth     : 全クラスの待ち件数がこれ以上なら受け付けずに LoadShed（省略時は制限なし）
+# breaker        : True ならサーキットブレーカーが開いている間は受け付けずに CircuitOpen
+PRIORITY_CLASSES = {
+    "interactive": {"rank": 0, "max_concurrency": 4, "max_queue": 8},   # Speak など応答待ちのユーザがいるもの
+    "planning":    {"rank": 1, "max_concurrency": 2, "max_queue": 8},   # plan_action / 発話の重要度評価
+    "background":  {"rank": 2, "max_concurrency": 2, "max_queue": 16,   # 各モジュールの定期評価
+                    "shed_depth": int(os.getenv("LLM_SHED_DEPTH", "6")), "breaker": True},
+}
+DEFAULT_PRIORITY = "background"
+DEFAULT_TAG = "untagged"
+NUM_WORKERS = int(os.getenv("LLM_NUM_WORKERS", "5"))
+# 同時に Bedrock へ出ている呼び出しのハードリミット（同期ワーカー・asyncio 共通、共有リミッタの上限になる）
+MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", str(NUM_WORKERS)))
+THROTTLE_RETRIES = 3   # スロットリング時の再試行回数（待ち時間は共有リミッタが決める）
+
+# ---------- サーキットブレーカー（breaker=True のクラスのみ） ----------
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))      # 連続失敗がこの回数で開く
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))   # 開いてから試しに 1 件通すまでの秒数
+
+
+class RequestShed(RuntimeError):
+    """background の評価を送らなかった（置き換え・負荷制限・サーキットブレーカー）。前回の値を使い続ければよい"""
+
+
+class Superseded(RequestShed):
+    """待機中に同じタグの新しいリクエスト（latest_wins=True）に置き換えられた"""
+
+
+class LoadShed(RequestShed):
+    """待ち行列が shed_depth を超えていたので受け付けなかった"""
+
+
+class CircuitOpen(RequestShed):
+    """バックエンドが不調（サーキットブレーカーが開いている）なので受け付けなかった"""
+
+
+# ---------- ヘッジ（hedge=True の呼び出しのみ） ----------
+# 応答（ストリームなら最初の断片）がタグごとの p90 を過ぎても来なければ複製を投げ、早い方を採用する。
+HEDGE_QUANTILE = 0.9
+HEDGE_MIN_SAMPLES = 20       # これ未満のサンプルしかないタグは HEDGE_DEFAULT_DELAY を使う
+HEDGE_DEFAULT_DELAY = 3.0
+HEDGE_MIN_DELAY = 0.5
+HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))  # ヘッジ対象呼び出しに対する複製の割合の上限
 
 # ---------- Queue & Worker ----------
-_Request = tuple[str, threading.Event, dict]   # (prompt, event, holder)
-_req_q: Queue[_Request] = Queue()
-
-_client = None
-def get_bedrock_client():
-    global _client
-    if _client is None:
-        # プロセスID情報をログに出力
-        import os
-        pid = os.getpid()
-        print(f"🆔 プロセス {pid} で Bedrock クライアント初期化")
-        
-        # クライアント設定をより堅牢に
-        _client = boto3.client(
-            "bedrock-runtime",
-            region_name=REGION,
-            aws_access_key_id=AWS_KEY,
-            aws_secret_access_key=AWS_SECRET,
-            config=Config(
-                read_timeout=15,
-                connect_timeout=5,
-                max_pool_connections=5,  # プロセスごとに少なく
-                retries={"max_attempts": 1}
-            )
-        )
-    return _client
+@dataclass
+class _Request:
+    prompt: str
+    priority: str
+    event: threading.Event = field(default_factory=threading.Event)
+    holder: dict = field(default_factory=dict)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    stream: Queue | None = None   # ストリーミング時はここにチャンクを流す
+    key: str | None = None        # 同一リクエスト判定用（None なら合流しない）
+    waiters: int = 1
+    tag: str = DEFAULT_TAG        # 呼び出し元タグ（計測用）
+    system: str | list | None = None  # system プロンプト（system_prompt() で作ったブロック列など）
+    deadline: float | None = None     # これを過ぎたら送信しない（time.monotonic 基準）
+    route: str = DEFAULT_ROUTE        # ROUTES のキー（モデル・max_tokens など）
+    done_q: Queue | None = None   # 完了時に自身を put する（ヘッジで先着を待つ用）
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    latest_wins: bool = False     # 同じクラス・同じタグの待機中リクエストを置き換える
+
+
+class _Scheduler:
+    """
+    優先度クラスごとの待ち行列。
+    ワーカーは rank の小さいクラスから、同時実行上限に空きがあるものを取り出す。
+    同じ key のリクエストが待機中/実行中なら、新たに積まずにそれへ合流させる（single-flight）。
+    latest_wins のリクエストは、同じタグの古い待機中リクエストと入れ替わる（古い方は Superseded）。
+    """
+
+    def __init__(self, classes: dict):
+        self._classes = classes
+        self._order = sorted(classes, key=lambda c: classes[c]["rank"])
+        self._pending = {c: deque() for c in classes}
+        self._running = {c: 0 for c in classes}
+        self._inflight: dict[str, _Request] = {}
+        self.coalesced = 0
+        self.superseded = 0
+        self.shed = 0
+        self._cv = threading.Condition()
+
+    def submit(self, req: _Request) -> _Request:
+        """
+        リクエストを積む。実際に待つべきリクエスト（合流先 or req 自身）を返す。
+        """
+        stale = None
+        with self._cv:
+            first = self._inflight.get(req.key) if req.key is not None else None
+            if first is not None and not first.cancelled.is_set():
+                first.waiters += 1
+                if first.deadline is not None:
+                    first.deadline = None if req.deadline is None else max(first.deadline, req.deadline)
+                self.coalesced += 1
+                self._promote(first, req.priority)
+                return first
+
+            cls = self._classes[req.priority]
+            depth = sum(len(q) for q in self._pending.values())
+            if cls.get("shed_depth") is not None and depth >= cls["shed_depth"]:
+                self.shed += 1
+                raise LoadShed(f"LLM queue depth {depth} >= shed_depth for '{req.priority}'")
+
+            q = self._pending[req.priority]
+            if req.latest_wins:
+                stale = next((r for r in q if r.latest_wins and r.tag == req.tag), None)
+            if stale is not None:
+                # 古い方の順番を引き継ぐ（置き換えのたびに列の後ろへ回されないように）
+                q[q.index(stale)] = req
+                if stale.key is not None and self._inflight.get(stale.key) is stale:
+                    del self._inflight[stale.key]
+                self.superseded += 1
+            elif len(q) >= cls["max_queue"]:
+                raise Full(f"LLM queue '{req.priority}' is full ({len(q)} pending)")
+            else:
+                q.append(req)
+            if req.key is not None:
+                self._inflight[req.key] = req
+            self._cv.notify_all()
+
+        if stale is not None:
+            print(f"🔄 待機中の古いリクエストを置き換え [{req.priority}/{req.tag}]")
+            stale.cancelled.set()
+            stale.holder.setdefault("error", Superseded(f"superseded by a newer '{req.tag}' request"))
+            stale.event.set()
+            metrics.outcome(req.tag, "superseded")
+        return req
+
+    def _promote(self, req: _Request, priority: str) -> None:
+        """合流してきた側の方が優先度が高く、まだ待機中なら高い方のキューへ移す"""
+        if self._classes[priority]["rank"] >= self._classes[req.priority]["rank"]:
+            return
+        try:
+            self._pending[req.priority].remove(req)
+        except ValueError:
+            return  # 既に実行中
+        req.priority = priority
+        self._pending[priority].append(req)
+        self._cv.notify_all()
+
+    def _pick(self) -> _Request | None:
+        for c in self._order:
+            if self._pending[c] and self._running[c] < self._classes[c]["max_concurrency"]:
+                self._running[c] += 1
+                return self._pending[c].popleft()
+        return None
+
+    def cancel(self, req: _Request) -> bool:
+        """
+        待機中なら取り除いて True。実行中なら cancelled を立てるだけ（ストリームは途中で打ち切られる）
+        """
+        req.cancelled.set()
+        with self._cv:
+            try:
+                self._pending[req.priority].remove(req)
+            except ValueError:
+                return False
+            if req.key is not None and self._inflight.get(req.key) is req:
+                del self._inflight[req.key]
+        req.holder.setdefault("error", CancelledError("LLM request cancelled"))
+        req.event.set()
+        return True
+
+    def abandon(self, req: _Request) -> None:
+        """呼び出し側の 1 人が待つのをやめた。もう誰も待っていなければキャンセル"""
+        with self._cv:
+            req.waiters -= 1
+            if req.waiters > 0:
+                return
+        self.cancel(req)
+
+    def next(self) -> _Request:
+        """実行可能なリクエストが来るまでブロック"""
+        with self._cv:
+            while (req := self._pick()) is None:
+                self._cv.wait()
+            return req
+
+    def done(self, req: _Request) -> None:
+        with self._cv:
+            self._running[req.priority] -= 1
+            if req.key is not None and self._inflight.get(req.key) is req:
+                del self._inflight[req.key]
+            self._cv.notify_all()
+
+    def stats(self) -> dict:
+        with self._cv:
+            stats = {
+                c: {"pending": len(self._pending[c]), "running": self._running[c]}
+                for c in self._order
+            }
+            stats["coalesced"] = self.coalesced
+            stats["superseded"] = self.superseded
+            stats["shed"] = self.shed
+            return stats
+
+
+_scheduler = _Scheduler(PRIORITY_CLASSES)
+
+
+class _CircuitBreaker:
+    """
+    closed   : 通常。送信の失敗（エラー・タイムアウト・再試行後のスロットリング）が BREAKER_FAILURES 回続くと open
+    open     : BREAKER_COOLDOWN 秒間は breaker=True のクラスを受け付けない
+    half-open: 冷却後に 1 件だけ通す。成功すれば closed、失敗すれば再び open
+    成功・失敗は全クラスの送信で数えるので、interactive の呼び出しが成功しても閉じる。
+    """
+
+    def __init__(self, failures: int, cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened = 0
+        self._open_until = None      # None なら closed
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._open_until is None:
+                return True
+            now = time.monotonic()
+            if now < self._open_until:
+                return False
+            # half-open: この 1 件を試しに通し、結果が出るまで（最長で次の冷却時間まで）他は止める
+            self._open_until = now + self.cooldown
+            return True
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                if self._open_until is not None:
+                    print("🟢 サーキットブレーカー: 復旧を確認、background の評価を再開")
+                self.consecutive = 0
+                self._open_until = None
+                return
+            self.consecutive += 1
+            if self._open_until is not None or self.consecutive >= self.failures:
+                if self._open_until is None:
+                    self.opened += 1
+                    print(f"🔴 サーキットブレーカー: {self.consecutive} 回連続失敗、"
+                          f"{self.cooldown:.0f}s background の評価を止めます")
+                self._open_until = time.monotonic() + self.cooldown
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._open_until is None:
+                state = "closed"
+            else:
+                state = "open" if time.monotonic() < self._open_until else "half_open"
+            return {"state": state, "consecutive_failures": self.consecutive, "opened": self.opened}
+
+
+_breaker = _CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN)
+
+def _admit(priority: str, tag: str) -> None:
+    """ブレーカーが開いていれば breaker=True のクラスは送らない"""
+    if PRIORITY_CLASSES[priority].get("breaker") and not _breaker.allow():
+        metrics.outcome(tag, "circuit_open")
+        raise CircuitOpen(f"backend unhealthy; '{priority}' requests paused")
+
+
+class _HedgeBudget:
+    """ヘッジの複製数を、ヘッジ対象の呼び出し数 × ratio（+ burst）以内に抑える"""
+
+    def __init__(self, ratio: float, burst: int = 1):
+        self.ratio = ratio
+        self.burst = burst
+        self.eligible = 0
+        self.hedges = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    def note_call(self) -> None:
+        with self._lock:
+            self.eligible += 1
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.eligible * self.ratio + self.burst:
+                return False
+            self.hedges += 1
+            return True
+
+    def note_win(self) -> None:
+        with self._lock:
+            self.wins += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"eligible": self.eligible, "hedges": self.hedges, "hedge_wins": self.wins}
+
+
+_hedge_budget = _HedgeBudget(HEDGE_BUDGET)
+
+def _hedge_delay(tag: str, metric: str) -> float:
+    """タグの p90（データ不足なら既定値）を複製を投げるまでの待ち時間にする"""
+    if metrics.count(tag, metric) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, metrics.percentile(tag, metric, HEDGE_QUANTILE))
 
 def _llm_worker() -> None:
-    """Bedrock 呼び出し専用スレッド（常駐）"""
-    print("🛠️  LLMワーカー起動: Bedrock クライアント初期化")
+    """Bedrock 呼び出し専用スレッド（NUM_WORKERS 本常駐）"""
+    print("🛠️  LLMワーカー起動: バックエンド初期化")
     try:
-        client = get_bedrock_client()
+        backend = get_backend(max_pool_connections=NUM_WORKERS)
+        limiter = get_limiter("bedrock", max_concurrency=MAX_INFLIGHT)
         
         while True:
+            req = _scheduler.next()
             try:
-                # キューが空なら少し待つ
-                if _req_q.empty():
-                    time.sleep(0.1)
+                prompt, holder = req.prompt, req.holder
+                wait = time.monotonic() - req.enqueued_at
+                metrics.observe(req.tag, queue_wait=wait)
+                print(f"📤 リクエスト処理開始 [{req.priority}/{req.tag}] (待ち {wait:.2f}s): {prompt[:30]}...")
+
+                # 呼び出し側が既に諦めていれば送らない
+                if req.cancelled.is_set():
+                    print(f"⏭️ 呼び出し元がキャンセル済みのためスキップ [{req.tag}]")
+                    holder.setdefault("error", TimeoutError("caller gave up before dispatch"))
+                    metrics.outcome(req.tag, "skipped")
+                    continue
+                if _past(req.deadline):
+                    print(f"⌛ 締め切り超過のためスキップ [{req.tag}]")
+                    holder.setdefault("error", DeadlineExceeded("deadline passed while queued"))
+                    metrics.outcome(req.tag, "deadline_miss")
+                    continue
+
+                est = _estimate(prompt, req.system, req.route)
+                if req.stream is not None:
+                    start = time.monotonic()
+                    try:
+                        with limiter.slot(est):
+                            ok = _invoke_stream(req, backend)
+                    except Exception:
+                        _breaker.record(False)
+                        raise
+                    _breaker.record(ok)
+                    metrics.observe(req.tag, latency=time.monotonic() - start)
+                    metrics.outcome(req.tag, "ok" if ok else "error")
                     continue
                 
-                prompt, ev, holder = _req_q.get(block=True, timeout=1.0)
-                print(f"📤 リクエスト処理開始: {prompt[:30]}...")
-                
-                # 別スレッドでAPI呼び出しを行い、タイムアウト制御
-                result_dict = {"completed": False}
-                api_thread = threading.Thread(
-                    target=invoke_with_timeout,
-                    args=(prompt, result_dict, client)
-                )
-                api_thread.daemon = True
-                api_thread.start()
-                
-                # 明示的なタイムアウト（15秒）
-                api_thread.join(15)
-                
-                if not result_dict.get("completed", False):
+                for attempt in range(THROTTLE_RETRIES + 1):
+                    # 共有リミッタの枠が空くまで待つ（スロットリング直後は全ワーカーが揃って待つ）
+                    # 締め切りまでに枠が取れなければ送らない
+                    try:
+                        limiter.acquire(est, None if req.deadline is None else max(0.0, req.deadline - time.monotonic()))
+                    except TimeoutError:
+                        error, throttled, usage, latency = DeadlineExceeded("deadline passed waiting for the rate limiter"), False, {}, None
+                        break
+                    start = time.monotonic()
+
+                    # ワーカー自身が呼ぶ。応答待ちの上限はクライアントの read_timeout で決まるので、
+                    # 置き去りのスレッドは残らない
+                    result_dict = {}
+                    invoke_with_timeout(prompt, result_dict, backend, req.system, req.route)
+
+                    error = result_dict.get("error")
+                    throttled = is_throttle(error)
+                    latency = time.monotonic() - start
+                    usage = result_dict.get("usage") or {}
+                    tokens = sum(v for k, v in usage.items() if k.endswith("tokens") and v) or None
+                    limiter.release(est, tokens, latency, throttled)
+                    # 締め切りを過ぎたら再試行しない（応答を待つ人がもういない）
+                    if not (throttled and attempt < THROTTLE_RETRIES) or req.cancelled.is_set() or _past(req.deadline):
+                        break
+                    print(f"🔁 スロットリングのため再試行 ({attempt + 1}/{THROTTLE_RETRIES})")
+
+                metrics.observe(req.tag, latency=latency, retries=attempt)
+                _observe_usage(req.tag, usage)
+                if isinstance(error, DeadlineExceeded):
+                    print("⌛ 締め切りまでに送信できませんでした")
+                    holder["error"] = error
+                    metrics.outcome(req.tag, "deadline_miss")
+                elif isinstance(error, ReadTimeoutError):
                     print("⚠️ API呼び出しタイムアウト")
                     holder["error"] = TimeoutError("API call timed out")
-                elif "error" in result_dict:
-                    holder["error"] = result_dict["error"]
-                    print(f"❌ API呼び出しエラー: {result_dict['error']}")
+                    metrics.outcome(req.tag, "timeout")
+                    _breaker.record(False)
+                elif error is not None:
+                    holder["error"] = error
+                    print(f"❌ API呼び出しエラー: {error}")
+                    metrics.outcome(req.tag, "throttled" if throttled else "error")
+                    _breaker.record(False)
                 else:
                     holder["result"] = result_dict["result"]
                     print("✅ API呼び出し成功")
-                
-                # 完了通知
-                ev.set()
-                _req_q.task_done()
+                    metrics.outcome(req.tag, "ok")
+                    _breaker.record(True)
                 
             except Exception as e:
                 import traceback
+                holder.setdefault("error", e)
                 print(f"💥 ワーカーループエラー: {e}")
                 print(f"スタックトレース: {traceback.format_exc()}")
+            finally:
+                # 完了通知
+                req.event.set()
+                _scheduler.done(req)
+                if req.done_q is not None:
+                    req.done_q.put(req)
     
     except Exception as e:
         import traceback
         print(f"💥💥 ワーカー致命的エラー: {e}")
         print(f"スタックトレース: {traceback.format_exc()}")
 
-def invoke_with_timeout(prompt, result_dict, client):
+def _past(deadline: float | None) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+def invoke_with_timeout(prompt, result_dict, backend, system=None, route=DEFAULT_ROUTE):
+    """1 回の invoke_model。タイムアウトはバックエンドの read_timeout（ReadTimeoutError）で表れる"""
     try:
-        # ...ここは既存コードと同じ...
-        body = _build_body(prompt) 
-        print(f"📡 invoke_model 送信開始")
+        body = _build_body(prompt, system, route)
+        print(f"📡 invoke_model 送信開始 [{route}]")
         
-        resp = client.invoke_model(modelId=MODEL_ID, body=body)
+        resp = backend.invoke(ROUTES[route]["model"], body)
         print(f"✅ invoke_model 応答受信")
         
-        raw = resp["body"].read()
-        print(f"✅ body.read() 完了")
-        
-        result_dict["result"] = json.loads(raw)["content"][0]["text"]
-        result_dict["completed"] = True
+        result_dict["result"] = resp["content"][0]["text"]
+        result_dict["usage"] = resp.get("usage") or {}
         
     except Exception as e:
         import traceback
         result_dict["error"] = e
         result_dict["stack"] = traceback.format_exc()
-        result_dict["completed"] = True
         print(f"❌ API呼び出し例外: {type(e).__name__}: {e}")
         print(f"詳細: {traceback.format_exc()}")
 
+_STREAM_END = object()   # ストリーム終端の番兵
+
+def _invoke_stream(req: _Request, backend) -> bool:
+    """
+    invoke_model_with_response_stream のテキスト差分を req.stream に流す（例外も流して False）。
+    ヘッジで負けて cancelled が立ったら受信を打ち切る。
+    """
+    out = req.stream
+    start = time.monotonic()
+    first = True
+    usage = {}
+    try:
+        print(f"📡 invoke_model_with_response_stream 送信開始")
+        r = req.route
+        for data in backend.invoke_stream(ROUTES[r]["model"], _build_body(req.prompt, req.system, r)):
+            if req.cancelled.is_set():
+                print("✂️ ストリーム打ち切り（ヘッジの負け側）")
+                return True
+            if data.get("type") == "message_start":
+                usage.update(data["message"].get("usage") or {})
+            elif data.get("type") == "message_delta":
+                usage.update(data.get("usage") or {})
+            elif data.get("type") == "content_block_delta":
+                text = data["delta"].get("text", "")
+                if text:
+                    if first:
+                        metrics.observe(req.tag, ttft=time.monotonic() - start)
+                        first = False
+                    out.put(text)
+        print("✅ ストリーム受信完了")
+        _observe_usage(req.tag, usage)
+        out.put(_STREAM_END)
+        return True
+    except Exception as e:
+        print(f"❌ ストリーム例外: {type(e).__name__}: {e}")
+        out.put(e)
+        if is_throttle(e):
+            raise  # リミッタに伝える
+        return False
+
 # グローバル変数として保持
-_worker_thread = None
+_worker_threads: list[threading.Thread] = []
+_workers_lock = threading.Lock()
 
 def ensure_worker_running():
-    global _worker_thread
-    if _worker_thread is None or not _worker_thread.is_alive():
-        _worker_thread = threading.Thread(target=_llm_worker, daemon=False)
-        _worker_thread.start()
+    """死んでいるワーカーを補充し、常に NUM_WORKERS 本を維持する"""
+    with _workers_lock:
+        _worker_threads[:] = [t for t in _worker_threads if t.is_alive()]
+        while len(_worker_threads) < NUM_WORKERS:
+            t = threading.Thread(
+                target=_llm_worker,
+                name=f"llm-worker-{len(_worker_threads)}",
+                daemon=False,
+            )
+            t.start()
+            _worker_threads.append(t)
+
+# ワーカー起動
+ensure_worker_running()
 
-# デーモン起動（メインが終われば自動終了）
-worker_thread = threading.Thread(target=_llm_worker, daemon=False)
-worker_thread.start()
+# ---------- 応答キャッシュ ----------
+_cache = LLMCache()
+
+def _cache_key(prompt: str, system=None, route: str = DEFAULT_ROUTE) -> str:
+    params = dict(ROUTES[route])
+    if system:
+        params["system"] = _system_text(system)
+    return make_key(prompt, params)
+
+def _check_args(priority: str, route: str) -> None:
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"unknown priority class: {priority}")
+    if route not in ROUTES:
+        raise ValueError(f"unknown route: {route}")
 
 # ---------- パブリック API ----------
-def get_claude_response(prompt: str, timeout: float = 30) -> str:
-    caller = inspect.stack()[1]
-    print(f"🚀 Claudeリクエスト開始  ← {caller.function}()")
+class LLMHandle:
+    """
+    submit_claude_request() の戻り値。
+    result() で結果を待ち、cancel() で不要になったことを伝える（誰も待っていなければ送信前に取り消される）
+    """
+
+    def __init__(self, req: _Request, tag: str, cache_key: str | None = None, cache_ttl: float | None = None):
+        self._req = req
+        self._tag = tag
+        self._cache_key = cache_key
+        self._cache_ttl = cache_ttl
+        self._abandoned = False
+
+    def done(self) -> bool:
+        return self._req.event.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """完了を待つだけ（タイムアウトしてもキャンセルしない）"""
+        return self._req.event.wait(timeout)
+
+    def cancel(self) -> bool:
+        """結果が要らなくなった。まだ完了していなければ True"""
+        if self._abandoned or self.done():
+            return False
+        self._abandoned = True
+        _scheduler.abandon(self._req)
+        return True
+
+    def result(self, timeout: float | None = None) -> str:
+        """
+        応答テキストを返す。timeout までに返らなければキャンセルして TimeoutError
+        （呼び出し元の Deadline が先に来た場合は DeadlineExceeded）
+        """
+        dl = current_deadline()
+        if dl is not None:
+            timeout = dl.cap(timeout)
+        if not self._req.event.wait(timeout):
+            self.cancel()
+            raise _timed_out(self._tag, "Bedrock did not return within timeout")
+        holder = self._req.holder
+        if "error" in holder:
+            raise holder["error"]
+        if self._cache_key is not None:
+            _cache.put(self._cache_key, holder["result"], self._cache_ttl)
+        return holder["result"]
+
+
+def _resolved_handle(text: str, tag: str) -> LLMHandle:
+    req = _Request(prompt="", priority=DEFAULT_PRIORITY, tag=tag)
+    req.holder["result"] = text
+    req.event.set()
+    return LLMHandle(req, tag)
+
+def submit_claude_request(
+    prompt: str,
+    timeout: float | None = 30,
+    priority: str = DEFAULT_PRIORITY,
+    cache_ttl: float | None = None,
+    bypass_cache: bool = False,
+    tag: str = DEFAULT_TAG,
+    system: str | list | None = None,
+    route: str = DEFAULT_ROUTE,
+    latest_wins: bool = False,
+) -> LLMHandle:
+    """
+    Claude へのリクエストを積んで、待たずにハンドルを返す。
+    :param timeout: これを過ぎても送信されていなければワーカーはスキップする（None なら無期限）
+    deadline_scope の中で呼ばれたら、timeout は締め切りまでの残り時間で切り詰められる。
+    その他の引数は get_claude_response と同じ。
+    """
+    _check_args(priority, route)
+    timeout = _bounded(timeout, tag)
+    key = _cache_key(prompt, system, route)
+    use_cache = cache_ttl is not None and not bypass_cache
+    if use_cache:
+        cached = _cache.get(key)
+        if cached is not None:
+            print(f"♻️ キャッシュヒット [{priority}/{tag}]: {prompt.strip()[:30]}...")
+            metrics.outcome(tag, "cache_hit")
+            return _resolved_handle(cached, tag)
+
+    _admit(priority, tag)
+    print(f"🚀 Claudeリクエスト開始 [{priority}] ← {tag}")
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        req = _scheduler.submit(
+            _Request(prompt=prompt, priority=priority, key=key, tag=tag, system=system, deadline=deadline,
+                     route=route, latest_wins=latest_wins)
+        )
+    except LoadShed:
+        print(f"🪫 待ち行列が深いため受け付けません [{priority}] ← {tag}")
+        metrics.outcome(tag, "shed")
+        raise
+    except Full:
+        metrics.outcome(tag, "queue_full")
+        raise
+    if req.waiters > 1:
+        print(f"🔗 同一リクエストに合流 (待機 {req.waiters} 件)")
+        metrics.outcome(tag, "coalesced")
+    return LLMHandle(req, tag, key if use_cache else None, cache_ttl)
+
+def get_claude_response(
+    prompt: str,
+    timeout: float = 30,
+    priority: str = DEFAULT_PRIORITY,
+    cache_ttl: float | None = None,
+    bypass_cache: bool = False,
+    tag: str = DEFAULT_TAG,
+    hedge: bool = False,
+    system: str | list | None = None,
+    route: str = DEFAULT_ROUTE,
+    latest_wins: bool = False,
+) -> str:
+    """
+    Claude にプロンプトを投げて応答テキストを返す。
+    :param priority: PRIORITY_CLASSES のキー。ユーザが応答を待っている呼び出しは "interactive"
+    :param cache_ttl: 指定するとその秒数だけ同一プロンプトの応答を再利用する（採点系向け）
+    :param bypass_cache: True ならキャッシュを読み書きしない（発話生成など）
+    :param tag: 呼び出し元タグ。get_metrics() でタグごとの待ち時間・レイテンシ・トークン数を見られる
+    :param hedge: True ならタグの p90 を過ぎた時点で複製を投げ、早い方を返す（HEDGE_BUDGET の範囲内）
+    :param system: system プロンプト。毎回同じ静的部分は system_prompt() で渡すとプロンプトキャッシュが効く
+    :param route: ROUTES のキー。採点・判定は "score" / "judge" で小さく速いモデルに回す
+    :param latest_wins: True なら同じタグの待機中リクエストを置き換える（定期評価向け。古い方は Superseded）
+    background の呼び出しは、混雑時（LoadShed）やバックエンド不調時（CircuitOpen）に送らずに例外になる。
+    どちらも RequestShed なので、呼び出し側は前回の値を使い続ければよい。
+    timeout を過ぎたら諦めて TimeoutError。まだ送信されていなければリクエスト自体も取り消される。
+    deadline_scope の中では締め切りまでの残り時間が上限になり、過ぎていれば送らずに DeadlineExceeded。
+    """
+    if not hedge:
+        return submit_claude_request(
+            prompt, timeout, priority, cache_ttl, bypass_cache, tag, system, route, latest_wins
+        ).result(timeout)
+
+    # 締め切り → キャッシュ → 受け付けの順は submit_claude_request と同じ
+    _check_args(priority, route)
+    timeout = _bounded(timeout, tag)
+    key = _cache_key(prompt, system, route)
+    use_cache = cache_ttl is not None and not bypass_cache
+    if use_cache:
+        cached = _cache.get(key)
+        if cached is not None:
+            print(f"♻️ キャッシュヒット [{priority}/{tag}]: {prompt.strip()[:30]}...")
+            metrics.outcome(tag, "cache_hit")
+            return cached
+
+    _admit(priority, tag)
+    print(f"🚀 Claudeリクエスト開始 (hedge) [{priority}] ← {tag}")
+    result = _hedged_response(prompt, timeout, priority, tag, system, route)
+    if use_cache:
+        _cache.put(key, result, cache_ttl)
+    return result
+
+def get_parsed_response(prompt: str, parse, route: str = "score", schema: dict | None = None, **kwargs):
+    """
+    route のモデルで応答を得て parse(text) した値を返す。
+    パースに失敗したら（ValueError 等）前回の出力と失敗理由を添えて、FALLBACK_ROUTE の大きいモデルで 1 度だけ聞き直す。
+    パースの成否はタグごとに parse_ok / parse_failed として数える（get_parse_stats）。
+    :param schema: 聞き直しのときに出力形式として示す JSON Schema
+    kwargs は get_claude_response にそのまま渡す。
+    """
+    tag = kwargs.get("tag", DEFAULT_TAG)
+    text = get_claude_response(prompt, route=route, **kwargs)
+    try:
+        value = parse(text)
+        metrics.outcome(tag, "parse_ok")
+        return value
+    except (ValueError, TypeError, KeyError) as e:
+        metrics.outcome(tag, "parse_failed")
+        if kwargs.get("cache_ttl") is not None:
+            _cache.delete(_cache_key(prompt, kwargs.get("system"), route))  # 読めない応答を再利用しない
+        dl = current_deadline()
+        if dl is not None and dl.expired():
+            raise
+        print(f"↪️ パース失敗のため {FALLBACK_ROUTE} で聞き直し ← {tag}: {e}")
+        metrics.outcome(tag, "route_fallback")
+        retry = reask_prompt(prompt, text, e, schema)
+    text = get_claude_response(retry, route=FALLBACK_ROUTE, **kwargs)
+    try:
+        value = parse(text)
+    except (ValueError, TypeError, KeyError):
+        metrics.outcome(tag, "parse_failed")
+        raise
+    metrics.outcome(tag, "parse_ok")
+    return value
+
+def get_structured_response(prompt: str, schema: dict, route: str = "score", instruct: bool = True, **kwargs):
+    """
+    schema（Utils.structured_output の JSON Schema の部分集合）に沿った値を返す。
+    1. instruct なら schema_instruction をプロンプト末尾に足して route のモデルに聞く
+       （system に形式を書いてある呼び出しは instruct=False）
+    2. JSON としてそのまま読めなければローカルで修復して読む（parse_repaired として数える）
+    3. それでもだめなら 1 度だけ聞き直す（get_parsed_response）
+    読めなければ StructuredOutputError（ValueError）。kwargs は get_claude_response にそのまま渡す。
+    """
+    tag = kwargs.get("tag", DEFAULT_TAG)
+
+    def parse(text):
+        value, repaired = parse_structured(text, schema)
+        if repaired:
+            metrics.outcome(tag, "parse_repaired")
+        return value
+
+    if instruct:
+        prompt = f"{prompt}\n{schema_instruction(schema)}"
+    return get_parsed_response(prompt, parse, route=route, schema=schema, **kwargs)
+
+def _hedged_response(prompt: str, timeout: float, priority: str, tag: str, system=None,
+                     route: str = DEFAULT_ROUTE) -> str:
+    """
+    1 本目を投げ、p90 を過ぎても終わらなければ 2 本目を投げて先に成功した方を返す。
+    ヘッジする呼び出しは合流（single-flight）させない。
+    """
+    deadline = time.monotonic() + timeout
+    done = Queue()
+    primary = _scheduler.submit(_Request(prompt=prompt, priority=priority, tag=tag, done_q=done, system=system, deadline=deadline,
+                 route=route))
+    live = [primary]
+    _hedge_budget.note_call()
+    hedge_at = time.monotonic() + _hedge_delay(tag, "latency")
+    errors = []
+
+    while live:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        can_hedge = len(live) == 1 and not errors and hedge_at is not None
+        wait = min(deadline, hedge_at) - now if can_hedge else deadline - now
+        try:
+            req = done.get(timeout=max(wait, 0.0))
+        except Empty:
+            if can_hedge and time.monotonic() >= hedge_at:
+                hedge_at = None
+                if _hedge_budget.try_spend():
+                    print(f"🪁 ヘッジ: p{int(HEDGE_QUANTILE * 100)} 超過のため複製を送信 ← {tag}")
+                    metrics.outcome(tag, "hedged")
+                    live.append(_scheduler.submit(
+                        _Request(prompt=prompt, priority=priority, tag=tag, done_q=done, system=system, deadline=deadline,
+                 route=route)
+                    ))
+            continue
+
+        live.remove(req)
+        if "result" in req.holder:
+            for loser in live:
+                _scheduler.cancel(loser)
+            if req is not primary:
+                _hedge_budget.note_win()
+                metrics.outcome(tag, "hedge_won")
+            return req.holder["result"]
+        errors.append(req.holder.get("error"))
+
+    for loser in live:
+        _scheduler.cancel(loser)
+    if errors and errors[-1] is not None:
+        raise errors[-1]
+    raise _timed_out(tag, "Bedrock did not return within timeout")
+
+# ---------- asyncio API ----------
+_async_limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+def _async_limit(priority: str) -> asyncio.Semaphore:
+    """同期ワーカーと同じ max_concurrency をループ単位で適用"""
+    loop = asyncio.get_running_loop()
+    limits = _async_limits.get(loop)
+    if limits is None:
+        limits = {c: asyncio.Semaphore(v["max_concurrency"]) for c, v in PRIORITY_CLASSES.items()}
+        _async_limits[loop] = limits
+    return limits[priority]
+
+async def aget_claude_response(
+    prompt: str,
+    timeout: float = 30,
+    priority: str = DEFAULT_PRIORITY,
+    tag: str = DEFAULT_TAG,
+    system: str | list | None = None,
+    route: str = DEFAULT_ROUTE,
+) -> str:
+    """
+    get_claude_response の asyncio 版。
+    呼び出しごとにスレッドを作らず、1 つのイベントループ上で多数の呼び出しを await できる。
+    """
+    _check_args(priority, route)
+    timeout = _bounded(timeout, tag)
+    _admit(priority, tag)
+    deadline = time.monotonic() + timeout
+
+    body = _build_body(prompt, system, route)
+    limiter = get_limiter("bedrock", max_concurrency=MAX_INFLIGHT)
+    est = _estimate(prompt, system, route)
+
+    async with _async_limit(priority):
+        print(f"🚀 Claudeリクエスト開始 (async) [{priority}] ← {tag}")
+        for attempt in range(THROTTLE_RETRIES + 1):
+            # 同期ワーカーと同じ共有リミッタ。ループを止めないよう try_acquire + sleep で待つ
+            while (wait := limiter.try_acquire(est)) > 0:
+                if time.monotonic() >= deadline:
+                    raise _timed_out(tag, "rate limiter wait exceeded timeout")
+                await asyncio.sleep(min(wait, 0.5, deadline - time.monotonic()))
+            start = time.monotonic()
+            tokens, throttled = None, False
+            try:
+                resp = await get_backend(max_pool_connections=NUM_WORKERS).ainvoke(
+                    ROUTES[route]["model"], body, timeout=max(0.1, deadline - time.monotonic())
+                )
+                usage = resp.get("usage") or {}
+                tokens = sum(v for k, v in usage.items() if k.endswith("tokens") and v)
+                metrics.observe(tag, retries=attempt)
+                _observe_usage(tag, usage)
+                metrics.outcome(tag, "ok")
+                _breaker.record(True)
+                return resp["content"][0]["text"]
+            except Exception as e:
+                throttled = is_throttle(e)
+                if not (throttled and attempt < THROTTLE_RETRIES) or time.monotonic() >= deadline:
+                    metrics.outcome(tag, "throttled" if throttled else "error")
+                    _breaker.record(False)
+                    raise
+            finally:
+                latency = time.monotonic() - start
+                limiter.release(est, tokens, latency, throttled)
+                metrics.observe(tag, latency=latency)
+
+async def aclose_sessions() -> None:
+    """現在のイベントループに紐づく aiohttp セッションを閉じる"""
+    backend = get_backend(max_pool_connections=NUM_WORKERS)
+    if hasattr(backend, "aclose"):
+        await backend.aclose()
+
+def stream_claude_response(
+    prompt: str,
+    timeout: float = 30,
+    priority: str = "interactive",
+    tag: str = DEFAULT_TAG,
+    hedge: bool = False,
+    system: str | list | None = None,
+    route: str = "dialogue",
+):
+    """
+    Claude の応答をテキスト断片ごとに yield するジェネレータ。
+    :param timeout: 次の断片が届くまでの最大待ち時間（最初の断片を含む）
+    :param hedge: True なら最初の断片がタグの p90 までに来なければ複製を投げ、先に断片を返した方を採用する
+    deadline_scope の中では、各断片の待ち時間も締め切りまでの残り時間で切り詰められる。
+    """
+    _check_args(priority, route)
+    timeout = _bounded(timeout, tag)
+
+    print(f"🚀 Claudeストリーミング開始 [{priority}] ← {tag}")
+    if hedge:
+        yield from _hedged_stream(prompt, timeout, priority, tag, system, route)
+        return
+
+    req = _Request(prompt=prompt, priority=priority, stream=Queue(), tag=tag, system=system,
+                   deadline=time.monotonic() + timeout, route=route)
+    _scheduler.submit(req)
+
+    finished = False
+    try:
+        while True:
+            try:
+                item = req.stream.get(timeout=_cap_to_scope(timeout))
+            except Empty:
+                raise _timed_out(tag, "Bedrock stream stalled beyond timeout")
+            if item is _STREAM_END:
+                finished = True
+                return
+            if isinstance(item, BaseException):
+                finished = True
+                raise item
+            yield item
+    finally:
+        # タイムアウトや読み捨てなら、送信前の取り消し / 受信の打ち切りをする
+        if not finished:
+            _scheduler.cancel(req)
+
+def _cap_to_scope(timeout: float | None) -> float | None:
+    dl = current_deadline()
+    return timeout if dl is None else dl.cap(timeout)
+
+class _Tap:
+    """ヘッジ時、複数リクエストの断片を (リクエスト, 断片) にして 1 本のキューへ合流させる"""
+
+    def __init__(self, req: _Request, out: Queue):
+        self.req = req
+        self.out = out
+
+    def put(self, item) -> None:
+        self.out.put((self.req, item))
+
+def _hedged_stream(prompt: str, timeout: float, priority: str, tag: str, system=None,
+                   route: str = "dialogue"):
+    shared = Queue()
+    deadline = time.monotonic() + timeout
+
+    def launch() -> _Request:
+        req = _Request(prompt=prompt, priority=priority, tag=tag, system=system, deadline=deadline, route=route)
+        req.stream = _Tap(req, shared)
+        return _scheduler.submit(req)
+
+    primary = launch()
+    live = [primary]
+    _hedge_budget.note_call()
+    hedge_at = time.monotonic() + _hedge_delay(tag, "ttft")
+    errors = []
+    winner = None
+    try:
+        # 最初の断片を返した方を勝者にする
+        while winner is None:
+            now = time.monotonic()
+            if not live or now >= deadline:
+                if errors:
+                    raise errors[-1]
+                raise _timed_out(tag, "Bedrock stream stalled beyond timeout")
+            can_hedge = hedge_at is not None and len(live) == 1
+            wait = (min(hedge_at, deadline) if can_hedge else deadline) - now
+            try:
+                src, item = shared.get(timeout=max(wait, 0.0))
+            except Empty:
+                if can_hedge and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if _hedge_budget.try_spend():
+                        print(f"🪁 ヘッジ: 最初の断片が p{int(HEDGE_QUANTILE * 100)} 超過のため複製を送信 ← {tag}")
+                        metrics.outcome(tag, "hedged")
+                        live.append(launch())
+                continue
+            if src not in live:
+                continue
+            if isinstance(item, BaseException):
+                live.remove(src)
+                errors.append(item)
+                continue
+
+            winner = src
+            for loser in live:
+                if loser is not winner:
+                    _scheduler.cancel(loser)
+            live = [winner]
+            if winner is not primary:
+                _hedge_budget.note_win()
+                metrics.outcome(tag, "hedge_won")
+            if item is _STREAM_END:
+                return
+            yield item
+
+        while True:
+            try:
+                src, item = shared.get(timeout=_cap_to_scope(timeout))
+            except Empty:
+                raise _timed_out(tag, "Bedrock stream stalled beyond timeout")
+            if src is not winner:
+                continue
+            if item is _STREAM_END:
+                live = []
+                return
+            if isinstance(item, BaseException):
+                live = []
+                raise item
+            yield item
+    finally:
+        # 呼び出し側が途中で読むのをやめた場合も含め、残りは打ち切る
+        for req in live:
+            _scheduler.cancel(req)
+
+def get_queue_stats() -> dict:
+    """優先度クラスごとの待ち行列長と実行中の数"""
+    return _scheduler.stats()
+
+def get_deadline_misses() -> dict:
+    """呼び出し元タグごとの締め切り切れ（送らなかった・待ちきれなかった）の件数"""
+    return {
+        tag: m["outcomes"]["deadline_miss"]
+        for tag, m in metrics.snapshot().items()
+        if m["outcomes"].get("deadline_miss")
+    }
+
+def get_parse_stats() -> dict:
+    """
+    タグごとの構造化出力の読み取り結果。
+    failure_rate: 読めなかった割合（聞き直しの原因）、repaired_rate: ローカル修復で読めた割合
+    """
+    out = {}
+    for tag, m in metrics.snapshot().items():
+        o = m["outcomes"]
+        ok, failed = o.get("parse_ok", 0), o.get("parse_failed", 0)
+        if ok + failed:
+            out[tag] = {
+                "parsed": ok,
+                "failed": failed,
+                "repaired": o.get("parse_repaired", 0),
+                "reasks": o.get("route_fallback", 0),
+                "failure_rate": failed / (ok + failed),
+                "repaired_rate": o.get("parse_repaired", 0) / (ok + failed),
+            }
+    return out
+
+def get_breaker_stats() -> dict:
+    """サーキットブレーカーの状態（closed / open / half_open）と連続失敗数"""
+    return _breaker.stats()
+
+def get_hedge_stats() -> dict:
+    """ヘッジ対象の呼び出し数・複製を投げた数・複製が勝った数"""
+    return _hedge_budget.stats()
+
+def get_endpoint_stats() -> dict:
+    """EndpointPool（BEDROCK_ENDPOINTS）使用時、エンドポイントごとの実行中・成功・失敗・レイテンシ・状態"""
+    backend = get_backend(max_pool_connections=NUM_WORKERS)
+    return backend.stats() if hasattr(backend, "stats") else {}
+
+def get_limiter_stats() -> dict:
+    """共有レートリミッタの現在の上限・残量"""
+    return get_limiter("bedrock", max_concurrency=MAX_INFLIGHT).stats()
+
+def get_metrics() -> dict:
+    """呼び出し元タグごとの待ち時間・レイテンシ・トークン数・再試行・結果の集計"""
+    return metrics.snapshot()
 
-    # ★ ここを修正 ★
-    ev: threading.Event = threading.Event()
-    store: dict[str, object] = {}
+def dump_metrics(path: str = os.getenv("LLM_METRICS_PATH", "memory-db/llm_metrics.jsonl")) -> None:
+    """get_metrics() の内容を JSON Lines で追記（外部の集計・可視化用）"""
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    metrics.dump(path)
 
-    _req_q.put((prompt, ev, store))
+if os.getenv("LLM_METRICS_PATH"):
+    atexit.register(dump_metrics)   # 指定時は終了時に書き出す
 
-    if not ev.wait(timeout):
-        raise TimeoutError("Bedrock did not return within timeout")
+def get_prompt_cache_stats() -> dict:
+    """
+    タグごとの入力トークン内訳。cached_ratio は入力のうちキャッシュから読めた割合
+    """
+    out = {}
+    for tag, m in metrics.snapshot().items():
+        fresh = m.get("input_tokens", {}).get("sum", 0)
+        read = m.get("cache_read_tokens", {}).get("sum", 0)
+        write = m.get("cache_write_tokens", {}).get("sum", 0)
+        total = fresh + read + write
+        if total:
+            out[tag] = {
+                "fresh": fresh,
+                "cache_read": read,
+                "cache_write": write,
+                "cached_ratio": read / total,
+            }
+    return out
 
-    if "error" in store:
-        raise store["error"]
-    return store["result"]
+def get_cache_stats() -> dict:
+    """応答キャッシュの件数とヒット/ミス数"""
+    return _cache.stats()
 
 # ---------- 動作確認 ----------
 if __name__ == "__main__":
@@ -0,0 +1,643 @@
+"""
+LLM バックエンド（差し替え可能）
+
+- BedrockBackend: 本番。boto3（同期/ストリーム）と aiohttp（asyncio）で Bedrock を呼ぶ
+- FakeBackend   : オフライン用のスタンドイン。定型/テンプレート/スクリプトの応答を、
+                  設定した遅延分布・エラー率・スロットリングで返す
+- EndpointPool  : 複数のリージョン・認証情報（またはスタンドインサーバ）に振り分ける。
+                  BEDROCK_ENDPOINTS に設定があれば BedrockBackend の代わりに使う
+
+環境変数 LLM_BACKEND=fake で FakeBackend に切り替わる。
+FakeBackend の設定は LLM_FAKE_CONFIG に YAML/JSON ファイルのパスを渡す。
+LLM_REPLAY_MODE=record/replay で通信の記録・再生ができる（Utils/llm_replay.py）。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import weakref
+from collections import deque
+from urllib.parse import quote
+
+import aiohttp
+import boto3
+import yaml
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, ReadTimeoutError
+from dotenv import load_dotenv
+
+from Utils.llm_replay import wrap_backend
+
+load_dotenv()
+
+REGION     = os.getenv("AWS_REGION", "us-east-1")
+AWS_KEY    = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET = os.getenv("AWS_SECRET_ACCESS_KEY")
+ENDPOINT_URL = os.getenv("BEDROCK_ENDPOINT_URL")  # スタンドインサーバ等に向ける時だけ指定
+
+
+class LLMBackend:
+    """
+    バックエンド共通インターフェース。
+    body は Bedrock invoke_model と同じ JSON 文字列、戻り値も Bedrock の応答 JSON と同じ形。
+    """
+
+    def invoke(self, model_id: str, body: str) -> dict:
+        raise NotImplementedError
+
+    def invoke_stream(self, model_id: str, body: str):
+        """Bedrock のストリームイベント（content_block_delta 等）の dict を順に yield"""
+        raise NotImplementedError
+
+    async def ainvoke(self, model_id: str, body: str, timeout=30) -> dict:
+        raise NotImplementedError
+
+
+# ---------- Bedrock ----------
+class BedrockBackend(LLMBackend):
+    _URL = "https://bedrock-runtime.{region}.amazonaws.com/model/{model}/invoke"
+
+    def __init__(self, region=REGION, aws_key=AWS_KEY, aws_secret=AWS_SECRET,
+                 endpoint_url=ENDPOINT_URL, max_pool_connections=5, profile=None):
+        self.region = region
+        self.aws_key = aws_key
+        self.aws_secret = aws_secret
+        self.endpoint_url = endpoint_url
+        self.profile = profile          # ~/.aws の名前付きプロファイル（指定時は aws_key より優先）
+        self.max_pool_connections = max_pool_connections
+        self._client = None
+        self._credentials = None
+        self._lock = threading.Lock()
+        self._sessions = weakref.WeakKeyDictionary()
+
+    def client(self):
+        # ワーカーが同時に呼ぶので初期化はロックで 1 回に絞る
+        with self._lock:
+            if self._client is None:
+                # プロセスID情報をログに出力
+                pid = os.getpid()
+                print(f"🆔 プロセス {pid} で Bedrock クライアント初期化 ({self.region})")
+
+                # クライアント設定をより堅牢に
+                self._client = self._boto_session().client(
+                    "bedrock-runtime",
+                    region_name=self.region,
+                    endpoint_url=self.endpoint_url,
+                    config=Config(
+                        read_timeout=15,
+                        connect_timeout=5,
+                        max_pool_connections=self.max_pool_connections,
+                        retries={"max_attempts": 1}
+                    )
+                )
+        return self._client
+
+    def _boto_session(self) -> boto3.Session:
+        if self.profile:
+            return boto3.Session(profile_name=self.profile, region_name=self.region)
+        return boto3.Session(
+            aws_access_key_id=self.aws_key,
+            aws_secret_access_key=self.aws_secret,
+            region_name=self.region,
+        )
+
+    def invoke(self, model_id, body):
+        resp = self.client().invoke_model(modelId=model_id, body=body)
+        return json.loads(resp["body"].read())
+
+    def invoke_stream(self, model_id, body):
+        resp = self.client().invoke_model_with_response_stream(modelId=model_id, body=body)
+        for event in resp["body"]:
+            chunk = event.get("chunk")
+            if chunk:
+                yield json.loads(chunk["bytes"])
+
+    # ----- asyncio: スレッドを使わず aiohttp で REST エンドポイントを直接叩く -----
+    def _signed_headers(self, url: str, body: str) -> dict:
+        """invoke_model 相当の POST に SigV4 署名したヘッダを返す"""
+        if self._credentials is None:
+            self._credentials = self._boto_session().get_credentials()
+        req = AWSRequest(
+            method="POST",
+            url=url,
+            data=body,
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+        )
+        SigV4Auth(self._credentials.get_frozen_credentials(), "bedrock", self.region).add_auth(req)
+        return dict(req.headers.items())
+
+    def _session(self) -> aiohttp.ClientSession:
+        """イベントループごとに 1 つの ClientSession（keep-alive を共有）"""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_pool_connections),
+            )
+            self._sessions[loop] = session
+        return session
+
+    async def ainvoke(self, model_id, body, timeout=30):
+        if self.endpoint_url:
+            base = self.endpoint_url.rstrip("/") + "/model/{model}/invoke"
+        else:
+            base = self._URL.replace("{region}", self.region)
+        url = base.format(model=quote(model_id, safe=""))
+        headers = self._signed_headers(url, body)
+        async with self._session().post(
+            url,
+            data=body.encode("utf-8"),
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as resp:
+            raw = await resp.read()
+            if resp.status != 200:
+                code = resp.headers.get("x-amzn-ErrorType", "").split(":")[0] or f"HTTP{resp.status}"
+                raise ClientError({"Error": {"Code": code, "Message": raw[:200].decode("utf-8", "ignore")}}, "InvokeModel")
+            return json.loads(raw)
+
+    async def aclose(self):
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+
+# ---------- 複数エンドポイントへの振り分け ----------
+ENDPOINT_FAILURES = 3        # 連続でこの回数失敗したエンドポイントは休ませる
+ENDPOINT_COOLDOWN = 30.0     # 休ませる秒数（スロットリングはその 1/3）
+_FAILOVER_CODES = {
+    "ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+    "InternalServerException", "ModelNotReadyException", "ServiceQuotaExceededException",
+}
+
+
+def _failover_reason(e: BaseException) -> str | None:
+    """別のエンドポイントで送り直してよい失敗なら "throttle" / "error"、そうでなければ None"""
+    if isinstance(e, ClientError):
+        code = e.response.get("Error", {}).get("Code", "")
+        if code not in _FAILOVER_CODES and not code.startswith("HTTP5"):
+            return None   # ValidationException など、どこに送っても同じ結果になるもの
+        return "throttle" if code in ("ThrottlingException", "TooManyRequestsException") else "error"
+    if isinstance(e, (BotoConnectionError, aiohttp.ClientConnectionError, ConnectionError)):
+        return "error"
+    return None
+
+
+class _Endpoint:
+    def __init__(self, name: str, backend: LLMBackend, max_inflight: int, weight: float):
+        self.name = name
+        self.backend = backend
+        self.max_inflight = max_inflight
+        self.weight = weight
+        self.inflight = 0
+        self.ok = 0
+        self.errors = 0
+        self.throttles = 0
+        self.consecutive = 0
+        self.latency = None            # 成功時レイテンシの EWMA（秒）
+        self.cooldown_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until and self.inflight < self.max_inflight
+
+    def score(self) -> float:
+        """重み × 速さ × 空き具合。遅い・混んでいるエンドポイントほど選ばれにくい"""
+        speed = 1.0 / max(self.latency or 1.0, 0.05)
+        return self.weight * speed * (1.0 - self.inflight / self.max_inflight)
+
+
+class EndpointPool(LLMBackend):
+    """
+    複数のエンドポイント（リージョン × 認証情報）に振り分ける LLMBackend。
+    - 空きのあるエンドポイントから、weight・直近レイテンシ・同時実行数で重み付けして選ぶ
+    - エンドポイントごとに max_inflight 本まで（全部埋まっていれば空くまで待つ）
+    - スロットリング・5xx・接続エラーは別のエンドポイントで送り直す（ストリームは最初のイベント前まで）
+      失敗が続いたエンドポイントは ENDPOINT_COOLDOWN 秒休ませる
+    どのエンドポイントでも失敗したら最後の例外をそのまま投げる（共有リミッタが検知できるように）。
+    """
+
+    def __init__(self, endpoints: list[_Endpoint], seed=None):
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = endpoints
+        self._rng = random.Random(seed)
+        self._cv = threading.Condition()
+
+    @classmethod
+    def from_config(cls, entries: list[dict], max_pool_connections=5) -> "EndpointPool":
+        """
+        entries の各要素:
+          name, region, endpoint_url（スタンドインサーバ等）, profile または aws_access_key_id / aws_secret_access_key,
+          max_inflight（既定 max_pool_connections）, weight（既定 1.0）
+          fake: FakeBackend の設定（指定すると Bedrock ではなくプロセス内のフェイクを使う）
+        """
+        endpoints = []
+        for i, e in enumerate(entries):
+            max_inflight = int(e.get("max_inflight", max_pool_connections))
+            if "fake" in e:
+                backend = FakeBackend(e["fake"] or {})
+            else:
+                backend = BedrockBackend(
+                    region=e.get("region", REGION),
+                    aws_key=e.get("aws_access_key_id", AWS_KEY),
+                    aws_secret=e.get("aws_secret_access_key", AWS_SECRET),
+                    endpoint_url=e.get("endpoint_url"),
+                    max_pool_connections=max_inflight,
+                    profile=e.get("profile"),
+                )
+            name = e.get("name") or e.get("region") or f"endpoint-{i}"
+            endpoints.append(_Endpoint(name, backend, max_inflight, float(e.get("weight", 1.0))))
+        print(f"🌐 EndpointPool: {', '.join(ep.name for ep in endpoints)}")
+        return cls(endpoints)
+
+    # ----- 選択と結果の反映 -----
+    def _choose(self, exclude: set, block: bool = True) -> _Endpoint | None:
+        """
+        空きのあるエンドポイントを重み付きで選んで inflight を確保する。
+        全部休み中なら最も早く休みが明けるものを試しに使う。全部埋まっていれば待つ（block=False なら最も空いているもの）
+        """
+        with self._cv:
+            while True:
+                now = time.monotonic()
+                candidates = [ep for ep in self.endpoints if ep not in exclude]
+                if not candidates:
+                    return None
+                ready = [ep for ep in candidates if ep.available(now)]
+                if ready:
+                    scores = [ep.score() for ep in ready]
+                    ep = self._rng.choices(ready, weights=scores)[0] if sum(scores) > 0 else ready[0]
+                    break
+                healthy = [ep for ep in candidates if now >= ep.cooldown_until]
+                if not healthy:
+                    ep = min(candidates, key=lambda c: c.cooldown_until)
+                    break
+                if not block:
+                    ep = min(healthy, key=lambda c: c.inflight / c.max_inflight)
+                    break
+                self._cv.wait(1.0)
+            ep.inflight += 1
+            return ep
+
+    def _finish(self, ep: _Endpoint, latency: float | None = None, failure: str | None = None) -> None:
+        """failure: None（成功）/ "throttle" / "error" / "client"（要求側の誤り。健全性には数えない）"""
+        with self._cv:
+            ep.inflight -= 1
+            if failure == "client":
+                pass
+            elif failure is None:
+                ep.ok += 1
+                ep.consecutive = 0
+                if latency is not None:
+                    ep.latency = latency if ep.latency is None else 0.8 * ep.latency + 0.2 * latency
+            else:
+                ep.consecutive += 1
+                if failure == "throttle":
+                    ep.throttles += 1
+                    ep.cooldown_until = time.monotonic() + ENDPOINT_COOLDOWN / 3
+                else:
+                    ep.errors += 1
+                    if ep.consecutive >= ENDPOINT_FAILURES:
+                        resting = time.monotonic() < ep.cooldown_until
+                        ep.cooldown_until = time.monotonic() + ENDPOINT_COOLDOWN
+                        if not resting:
+                            print(f"🚧 エンドポイント {ep.name} を {ENDPOINT_COOLDOWN:.0f}s 休ませます（{ep.consecutive} 回連続失敗）")
+            self._cv.notify_all()
+
+    def _failed(self, ep: _Endpoint, e: BaseException) -> str | None:
+        """失敗を記録し、送り直してよいなら理由を返す"""
+        reason = _failover_reason(e)
+        # 送り直さない失敗でも、タイムアウトはエンドポイントの不調として数える
+        self._finish(ep, failure=reason or ("error" if isinstance(e, ReadTimeoutError) else "client"))
+        if reason is not None:
+            print(f"🔀 {ep.name} で失敗（{type(e).__name__}）→ 別のエンドポイントへ")
+        return reason
+
+    # ----- LLMBackend -----
+    def invoke(self, model_id, body):
+        tried = set()
+        while (ep := self._choose(tried)) is not None:
+            tried.add(ep)
+            start = time.monotonic()
+            try:
+                resp = ep.backend.invoke(model_id, body)
+            except Exception as e:
+                if self._failed(ep, e) is None or len(tried) == len(self.endpoints):
+                    raise
+                continue
+            self._finish(ep, time.monotonic() - start)
+            return resp
+
+    def invoke_stream(self, model_id, body):
+        tried = set()
+        while (ep := self._choose(tried)) is not None:
+            tried.add(ep)
+            start = time.monotonic()
+            started = False
+            try:
+                for event in ep.backend.invoke_stream(model_id, body):
+                    started = True
+                    yield event
+            except GeneratorExit:
+                self._finish(ep, time.monotonic() - start)
+                raise
+            except Exception as e:
+                if self._failed(ep, e) is None or started or len(tried) == len(self.endpoints):
+                    raise
+                continue
+            self._finish(ep, time.monotonic() - start)
+            return
+
+    async def ainvoke(self, model_id, body, timeout=30):
+        tried = set()
+        while (ep := self._choose(tried, block=False)) is not None:
+            tried.add(ep)
+            start = time.monotonic()
+            try:
+                resp = await ep.backend.ainvoke(model_id, body, timeout=timeout)
+            except Exception as e:
+                if self._failed(ep, e) is None or len(tried) == len(self.endpoints):
+                    raise
+                continue
+            self._finish(ep, time.monotonic() - start)
+            return resp
+
+    async def aclose(self):
+        for ep in self.endpoints:
+            if hasattr(ep.backend, "aclose"):
+                await ep.backend.aclose()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._cv:
+            return {
+                ep.name: {
+                    "inflight": ep.inflight,
+                    "max_inflight": ep.max_inflight,
+                    "ok": ep.ok,
+                    "errors": ep.errors,
+                    "throttles": ep.throttles,
+                    "latency_ewma": None if ep.latency is None else round(ep.latency, 3),
+                    "state": "cooldown" if now < ep.cooldown_until else "healthy",
+                }
+                for ep in self.endpoints
+            }
+
+
+def load_endpoints(spec: str | None) -> list[dict]:
+    """BEDROCK_ENDPOINTS: JSON 配列そのもの、または YAML/JSON ファイルのパス"""
+    if not spec:
+        return []
+    if spec.lstrip().startswith("["):
+        return json.loads(spec)
+    with open(spec, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or []
+
+
+# ---------- オフライン用スタンドイン ----------
+FAKE_DEFAULTS = {
+    "seed": None,
+    "latency_median": 0.8,    # 秒（対数正規分布の中央値）
+    "latency_sigma": 0.4,     # 対数正規分布の σ（大きいほど裾が重い）
+    "first_token_latency": 0.3,
+    "chunk_chars": 6,         # ストリーム時の 1 チャンクの文字数
+    "error_rate": 0.0,        # ServiceUnavailable を返す確率
+    "throttle_rate": 0.0,     # ThrottlingException を返す確率
+    "max_rpm": None,          # 直近 60 秒のリクエスト数がこれを超えたらスロットリング
+    "prefill_per_1k_tokens": 0.05,  # キャッシュされていない入力 1000 トークンあたりの追加遅延（秒）
+    "prompt_cache_ttl": 300,  # cache_control 付きプレフィックスを覚えておく秒数
+    "read_timeout": 15,       # BedrockBackend と同じく、これより遅い応答は ReadTimeoutError
+    "rules": [],              # [{"match": 正規表現, "response": 文字列 or 文字列リスト（順に返す）}]
+}
+
+UTTERANCES = [
+    "え、そうなんだ！もっと聞かせて？",
+    "ふふ、今日はなんだか機嫌いいね。",
+    "うん、わかるよ。私もそういう時あるもん。",
+    "ねえ、今度一緒に行ってみない？",
+]
+
+
+def _cached_prefix(body: dict) -> str | None:
+    """
+    最後の cache_control ブレークポイントまでのテキスト（system → messages の順）。
+    ブレークポイントがなければ None
+    """
+    blocks = []
+    system = body.get("system")
+    if isinstance(system, list):
+        blocks += system
+    elif system:
+        blocks.append({"text": system})
+    for m in body.get("messages") or []:
+        content = m.get("content")
+        blocks += content if isinstance(content, list) else [{"text": content or ""}]
+    last = max((i for i, b in enumerate(blocks) if isinstance(b, dict) and b.get("cache_control")), default=None)
+    if last is None:
+        return None
+    return "".join(b.get("text", "") for b in blocks[:last + 1] if isinstance(b, dict))
+
+
+def _prompt_of(body: dict) -> str:
+    """system と最後の user メッセージを連結したテキスト（応答の振り分け用）"""
+    def text_of(content):
+        if isinstance(content, str):
+            return content
+        return "".join(b.get("text", "") for b in content if isinstance(b, dict))
+    system = text_of(body.get("system", ""))
+    messages = body.get("messages") or [{"content": ""}]
+    return system + "\n" + text_of(messages[-1]["content"])
+
+
+class FakeBackend(LLMBackend):
+    def __init__(self, config: dict | None = None):
+        cfg = {**FAKE_DEFAULTS, **(config or {})}
+        self.cfg = cfg
+        self._rng = random.Random(cfg["seed"])
+        self._rules = [
+            {"match": re.compile(r["match"], re.S), "responses": r["response"] if isinstance(r["response"], list) else [r["response"]], "i": 0}
+            for r in cfg["rules"]
+        ]
+        self._recent = deque()
+        self._prefixes = {}       # プレフィックスのハッシュ → 有効期限（プロンプトキャッシュの模擬）
+        self._lock = threading.Lock()
+
+    # ----- 応答の生成 -----
+    def respond(self, prompt: str) -> str:
+        with self._lock:
+            for rule in self._rules:
+                if rule["match"].search(prompt):
+                    text = rule["responses"][rule["i"] % len(rule["responses"])]
+                    rule["i"] += 1
+                    return text
+            return self._default_response(prompt)
+
+    def _default_response(self, prompt: str) -> str:
+        """プロンプトの出力形式指定を見て、それらしい応答を作る"""
+        rng = self._rng
+        if "True, False" in prompt or "True: " in prompt:
+            return "True"
+        if "JSON 配列" in prompt:
+            return json.dumps([{"action": "Speak", "purpose": "会話を続ける", "summary": "相槌と質問"}], ensure_ascii=False)
+        if "JSON形式" in prompt:
+            keys = re.findall(r'"([^"]+)": X', prompt)
+            return json.dumps({k: rng.randint(4, 9) for k in keys}, ensure_ascii=False)
+        m = re.search(r"(-?\d+(?:\.\d+)?)\s*(?:〜|から|~)\s*(-?\d+(?:\.\d+)?)", prompt)
+        if m and ("点数" in prompt or "数値" in prompt or "スコア" in prompt):
+            low, high = float(m.group(1)), float(m.group(2))
+            return f"{rng.uniform(low, high):.1f}"
+        return rng.choice(UTTERANCES)
+
+    @staticmethod
+    def _apply_stop(text: str, body: dict) -> str:
+        """stop_sequences の最初の出現で打ち切る（本物の API と同じく停止文字列自体は含めない）"""
+        for stop in body.get("stop_sequences") or []:
+            i = text.find(stop)
+            if i >= 0:
+                text = text[:i]
+        return text
+
+    # ----- 遅延・エラーの注入 -----
+    def _latency(self, median=None) -> float:
+        with self._lock:
+            return self._rng.lognormvariate(0, self.cfg["latency_sigma"]) * (median or self.cfg["latency_median"])
+
+    def _wait(self, delay: float) -> None:
+        """応答までの遅延を再現。read_timeout を超えるなら、そこで ReadTimeoutError"""
+        if delay > self.cfg["read_timeout"]:
+            time.sleep(self.cfg["read_timeout"])
+            raise ReadTimeoutError(endpoint_url="fake")
+        time.sleep(delay)
+
+    def _maybe_fail(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._recent.append(now)
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            over_rpm = self.cfg["max_rpm"] is not None and len(self._recent) > self.cfg["max_rpm"]
+            r = self._rng.random()
+        if over_rpm or r < self.cfg["throttle_rate"]:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests (fake)"}}, "InvokeModel")
+        if r < self.cfg["throttle_rate"] + self.cfg["error_rate"]:
+            raise ClientError({"Error": {"Code": "ServiceUnavailableException", "Message": "Service unavailable (fake)"}}, "InvokeModel")
+
+    @staticmethod
+    def _tokens(text: str) -> int:
+        return max(1, len(text) // 2)
+
+    def _input_usage(self, body: dict) -> dict:
+        """
+        プロンプトキャッシュを模擬した入力トークンの内訳。
+        cache_control までのプレフィックスが TTL 内に送られていれば読み出し、なければ書き込み扱い
+        """
+        total = self._tokens(_prompt_of(body))
+        prefix = _cached_prefix(body)
+        usage = {"input_tokens": total, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        if prefix is None:
+            return usage
+        cached = min(self._tokens(prefix), total)
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            hit = self._prefixes.get(key, 0) > now
+            self._prefixes[key] = now + self.cfg["prompt_cache_ttl"]
+        usage["input_tokens"] = total - cached
+        usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = cached
+        return usage
+
+    def _prefill(self, usage: dict) -> float:
+        """キャッシュから読めなかった入力ぶんの遅延"""
+        fresh = usage["input_tokens"] + usage["cache_creation_input_tokens"]
+        return fresh / 1000 * self.cfg["prefill_per_1k_tokens"]
+
+    def _response(self, usage: dict, text: str) -> dict:
+        return {
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {**usage, "output_tokens": self._tokens(text)},
+        }
+
+    # ----- LLMBackend -----
+    def invoke(self, model_id, body):
+        data = json.loads(body)
+        usage = self._input_usage(data)
+        self._wait(self._latency() + self._prefill(usage))
+        self._maybe_fail()
+        return self._response(usage, self._apply_stop(self.respond(_prompt_of(data)), data))
+
+    def invoke_stream(self, model_id, body):
+        data = json.loads(body)
+        usage = self._input_usage(data)
+        # Bedrock と同じく、スロットリング等はイベントを 1 つも返す前にエラーになる
+        # （EndpointPool はこの場合だけ別のエンドポイントに送り直せる）
+        self._maybe_fail()
+        yield {"type": "message_start", "message": {"usage": {**usage, "output_tokens": 0}}}
+        first = self._latency(self.cfg["first_token_latency"])  # 最初の断片までの時間も裾が重い
+        self._wait(first + self._prefill(usage))
+        text = self._apply_stop(self.respond(_prompt_of(data)), data)
+        n = self.cfg["chunk_chars"]
+        pieces = [text[i:i + n] for i in range(0, len(text), n)] or [""]
+        per_chunk = max(0.0, self._latency() - first) / len(pieces)
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(per_chunk)
+            yield {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}}
+        yield {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+               "usage": {"output_tokens": self._tokens(text)}}
+
+    async def ainvoke(self, model_id, body, timeout=30):
+        data = json.loads(body)
+        usage = self._input_usage(data)
+        await asyncio.sleep(self._latency() + self._prefill(usage))
+        self._maybe_fail()
+        return self._response(usage, self._apply_stop(self.respond(_prompt_of(data)), data))
+
+    def chat(self, pre_prompt: str, conversation_history: list) -> str:
+        """breeder の API_URL 形式（pre_prompt + 会話履歴）に対する応答"""
+        body = json.dumps({"system": pre_prompt, "messages": conversation_history or [{"role": "user", "content": ""}]})
+        return self.invoke("fake", body)["content"][0]["text"]
+
+
+# ---------- プロセス内で共有するバックエンド ----------
+_backend: LLMBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def load_fake_config(path: str | None) -> dict:
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def get_backend(max_pool_connections=5) -> LLMBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = wrap_backend(lambda: _create_backend(max_pool_connections))
+        return _backend
+
+
+def _create_backend(max_pool_connections) -> LLMBackend:
+    if os.getenv("LLM_BACKEND", "bedrock") == "fake":
+        print("🧪 FakeBackend を使用します（オフライン）")
+        return FakeBackend(load_fake_config(os.getenv("LLM_FAKE_CONFIG")))
+    endpoints = load_endpoints(os.getenv("BEDROCK_ENDPOINTS"))
+    if endpoints:
+        return EndpointPool.from_config(endpoints, max_pool_connections)
+    return BedrockBackend(max_pool_connections=max_pool_connections)
+
+
+def set_backend(backend: LLMBackend) -> None:
+    """テスト・ベンチマーク用にバックエンドを差し替える"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,121 @@
+"""
+LLM 呼び出しの計測（呼び出し元タグ単位、メモリ内）
+
+- ヒストグラム: queue_wait / latency / ttft（秒）、input / output / cache_read / cache_write のトークン数、retries
+- カウンタ    : outcome（ok / error / timeout / cache_hit など）
+記録は固定バケットへの加算だけなので、ホットパスでもほぼコストがかからない。
+"""
+import bisect
+import json
+import threading
+import time
+
+# 秒とトークン数の両方に使える対数バケット（上端、最後は +inf 扱い）
+_BOUNDS = {
+    "queue_wait": [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30],
+    "latency": [0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30],
+    "ttft": [0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30],   # ストリームの最初の断片まで
+    "input_tokens": [16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192],
+    "output_tokens": [8, 16, 32, 64, 128, 256, 512, 1024, 2048],
+    "cache_read_tokens": [0, 64, 256, 1024, 2048, 4096, 8192],
+    "cache_write_tokens": [0, 64, 256, 1024, 2048, 4096, 8192],
+    "retries": [0, 1, 2, 3, 5],
+}
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float):
+        """バケット内線形補間による近似パーセンタイル（0 <= q <= 1、データなしなら None）"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = self.bounds[i - 1] if i > 0 else 0.0
+                hi = self.bounds[i] if i < len(self.bounds) else self.max
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "sum": self.sum,
+            "buckets": dict(zip([*map(str, self.bounds), "+inf"], self.counts)),
+        }
+
+
+class LLMMetrics:
+    def __init__(self):
+        self._hists: dict[tuple[str, str], Histogram] = {}
+        self._outcomes: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def observe(self, tag: str, **values) -> None:
+        """metrics.observe("sociality", latency=1.2, input_tokens=310)"""
+        with self._lock:
+            for name, v in values.items():
+                if v is None:
+                    continue
+                h = self._hists.get((tag, name))
+                if h is None:
+                    h = self._hists[(tag, name)] = Histogram(_BOUNDS[name])
+                h.observe(v)
+
+    def outcome(self, tag: str, outcome: str) -> None:
+        with self._lock:
+            per_tag = self._outcomes.setdefault(tag, {})
+            per_tag[outcome] = per_tag.get(outcome, 0) + 1
+
+    def count(self, tag: str, name: str) -> int:
+        with self._lock:
+            h = self._hists.get((tag, name))
+            return h.count if h else 0
+
+    def percentile(self, tag: str, name: str, q: float):
+        with self._lock:
+            h = self._hists.get((tag, name))
+            return h.percentile(q) if h else None
+
+    def snapshot(self) -> dict:
+        """{tag: {"outcomes": {...}, "latency": {...}, ...}}"""
+        with self._lock:
+            out = {tag: {"outcomes": dict(o)} for tag, o in self._outcomes.items()}
+            for (tag, name), h in self._hists.items():
+                out.setdefault(tag, {"outcomes": {}})[name] = h.snapshot()
+        return out
+
+    def dump(self, path: str) -> None:
+        """スナップショットを JSON Lines で追記（定期的に呼べば時系列になる）"""
+        line = {"time": time.time(), "since": self.started_at, "tags": self.snapshot()}
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hists.clear()
+            self._outcomes.clear()
+            self.started_at = time.time()
+
+
+metrics = LLMMetrics()
@@ -0,0 +1,232 @@
+"""
+LLM 通信の記録・再生
+
+LLM_REPLAY_MODE=record : 本物（または fake）のバックエンドを通した要求と応答を追記していく
+LLM_REPLAY_MODE=replay : 記録ファイルから応答を返す（Bedrock には一切つながない）
+
+ファイルは JSON Lines の追記のみ（LLM_REPLAY_PATH、既定 memory-db/llm_replay.jsonl）。
+1 行 = 1 呼び出し: {"fp": 要求の指紋, "n": 同じ指紋の何回目か, "dt": 応答までの秒数, ...}
+再生時の照合は (fp, n) → 同じ fp の最後の記録 → 記録順で未使用の次の行、の順に試す。
+プロンプトにタイムスタンプなどが混じって指紋がずれても、記録順で進めば同じ会話を再現できる。
+LLM_REPLAY_SPEED で待ち時間を調整する（1 = 記録どおり、10 = 10 倍速、0 = 待たない）。
+girlfriend_breeder も utils/shared.py 経由でこのモジュールを使う（変更は両方に効く）。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from Utils.llm_cache import normalize_prompt
+
+DEFAULT_PATH = os.getenv("LLM_REPLAY_PATH", "memory-db/llm_replay.jsonl")
+
+
+def fingerprint(channel: str, request) -> str:
+    """要求の指紋。dict/JSON 文字列はキー順を揃え、空白の揺れは無視する"""
+    if isinstance(request, str):
+        try:
+            request = json.loads(request)
+        except ValueError:
+            pass
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{channel}\n{normalize_prompt(payload)}".encode("utf-8")).hexdigest()[:32]
+
+
+class ReplayLog:
+    def __init__(self, path=DEFAULT_PATH, mode="replay", speed=1.0, strict=False):
+        """
+        :param mode: "record" か "replay"
+        :param speed: 再生速度の倍率（0 なら待たない）
+        :param strict: True なら指紋が一致しない呼び出しを LookupError にする
+        """
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.strict = strict
+        self.hits = 0
+        self.misses = 0
+        self._seen: dict[str, int] = {}     # fp → これまでの回数（記録・再生とも）
+        self._lock = threading.Lock()
+        self._records: list[dict] = []
+        self._index: dict[tuple[str, int], int] = {}
+        self._last: dict[str, int] = {}
+        self._used: set[int] = set()
+        self._cursor = 0
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        if mode == "replay":
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                i = len(self._records)
+                self._records.append(rec)
+                self._index[(rec["fp"], rec["n"])] = i
+                self._last[rec["fp"]] = i
+        print(f"📼 LLM 再生: {len(self._records)} 件を読み込み ({self.path})")
+
+    def _next_n(self, fp: str) -> int:
+        n = self._seen.get(fp, 0)
+        self._seen[fp] = n + 1
+        return n
+
+    # ---------- 記録 ----------
+    def record(self, channel: str, request, dt: float, **payload) -> None:
+        """payload は response / events / error のいずれか"""
+        fp = fingerprint(channel, request)
+        with self._lock:
+            rec = {"ch": channel, "fp": fp, "n": self._next_n(fp), "dt": round(dt, 4), **payload}
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    # ---------- 再生 ----------
+    def lookup(self, channel: str, request) -> dict:
+        fp = fingerprint(channel, request)
+        with self._lock:
+            n = self._next_n(fp)
+            i = self._index.get((fp, n), self._last.get(fp))
+            if i is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if self.strict:
+                    raise LookupError(f"no recorded LLM response for {channel} fp={fp}")
+                # 指紋が合わなければ、同じチャネルで未使用の次の記録を使う
+                while self._cursor < len(self._records) and (
+                    self._cursor in self._used or self._records[self._cursor]["ch"] != channel
+                ):
+                    self._cursor += 1
+                if self._cursor >= len(self._records):
+                    raise LookupError(f"replay log exhausted for {channel}")
+                i = self._cursor
+            self._used.add(i)
+            return self._records[i]
+
+    def delay(self, seconds: float) -> float:
+        return 0.0 if self.speed <= 0 else seconds / self.speed
+
+    @staticmethod
+    def raise_if_error(rec: dict) -> None:
+        err = rec.get("error")
+        if err:
+            raise ClientError({"Error": {"Code": err["code"], "Message": err["message"]}}, "InvokeModel")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"mode": self.mode, "records": len(self._records), "hits": self.hits, "misses": self.misses}
+
+
+def _error_of(e: Exception) -> dict | None:
+    if isinstance(e, ClientError):
+        err = e.response.get("Error", {})
+        return {"code": err.get("Code", "Unknown"), "message": err.get("Message", str(e))}
+    return None
+
+
+class RecordingBackend:
+    """既存のバックエンドを包み、やり取りを ReplayLog に追記する"""
+
+    def __init__(self, inner, log: ReplayLog):
+        self.inner = inner
+        self.log = log
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)   # aclose / chat / cfg などはそのまま
+
+    def invoke(self, model_id, body):
+        start = time.monotonic()
+        try:
+            resp = self.inner.invoke(model_id, body)
+        except Exception as e:
+            if (err := _error_of(e)) is not None:
+                self.log.record("invoke", body, time.monotonic() - start, error=err)
+            raise
+        self.log.record("invoke", body, time.monotonic() - start, response=resp)
+        return resp
+
+    def invoke_stream(self, model_id, body):
+        start = time.monotonic()
+        events = []
+        try:
+            for event in self.inner.invoke_stream(model_id, body):
+                events.append([round(time.monotonic() - start, 4), event])
+                yield event
+        except Exception as e:
+            if (err := _error_of(e)) is not None:
+                self.log.record("stream", body, time.monotonic() - start, events=events, error=err)
+            raise
+        self.log.record("stream", body, time.monotonic() - start, events=events)
+
+    async def ainvoke(self, model_id, body, timeout=30):
+        start = time.monotonic()
+        try:
+            resp = await self.inner.ainvoke(model_id, body, timeout=timeout)
+        except Exception as e:
+            if (err := _error_of(e)) is not None:
+                self.log.record("invoke", body, time.monotonic() - start, error=err)
+            raise
+        self.log.record("invoke", body, time.monotonic() - start, response=resp)
+        return resp
+
+
+class ReplayBackend:
+    """記録ファイルだけで応答する。応答までの時間も記録どおり（speed 倍）に再現する"""
+
+    def __init__(self, log: ReplayLog):
+        self.log = log
+
+    def invoke(self, model_id, body):
+        rec = self.log.lookup("invoke", body)
+        time.sleep(self.log.delay(rec["dt"]))
+        self.log.raise_if_error(rec)
+        return rec["response"]
+
+    def invoke_stream(self, model_id, body):
+        rec = self.log.lookup("stream", body)
+        prev = 0.0
+        for t, event in rec.get("events", []):
+            time.sleep(self.log.delay(t - prev))
+            prev = t
+            yield event
+        self.log.raise_if_error(rec)
+
+    async def ainvoke(self, model_id, body, timeout=30):
+        rec = self.log.lookup("invoke", body)
+        await asyncio.sleep(self.log.delay(rec["dt"]))
+        self.log.raise_if_error(rec)
+        return rec["response"]
+
+
+def replay_mode() -> str | None:
+    mode = os.getenv("LLM_REPLAY_MODE", "").lower()
+    return mode if mode in ("record", "replay") else None
+
+
+def wrap_backend(backend_factory):
+    """
+    LLM_REPLAY_MODE に応じてバックエンドを包む。
+    replay のときは本物のバックエンドを作らない（backend_factory を呼ばない）
+    """
+    mode = replay_mode()
+    if mode is None:
+        return backend_factory()
+    log = ReplayLog(
+        DEFAULT_PATH,
+        mode=mode,
+        speed=float(os.getenv("LLM_REPLAY_SPEED", "1")),
+        strict=os.getenv("LLM_REPLAY_STRICT", "0") == "1",
+    )
+    if mode == "record":
+        print(f"📼 LLM 記録モード: {log.path}")
+        return RecordingBackend(backend_factory(), log)
+    return ReplayBackend(log)
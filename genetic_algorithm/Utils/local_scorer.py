@@ -0,0 +1,195 @@
+"""
+LLM の数値採点を肩代わりするローカル採点器
+
+1. (入力テキスト, LLM スコア) を sqlite に記録する
+2. WorkingMemory が計算済みの all-MiniLM-L6-v2 埋め込みを特徴量に、
+   ブートストラップした Ridge 回帰のアンサンブルを学習する
+3. アンサンブルのばらつきが小さく、学習データに近い入力だけローカルで即答し、
+   それ以外（自信がない / 分布外）は LLM に問い合わせて学習データを増やす
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_DB_PATH = os.getenv("LOCAL_SCORER_PATH", "memory-db/local_scorer.sqlite3")
+
+
+def window_embedding(entries, dim=384):
+    """WorkingMemory のエントリ群の埋め込み平均（空なら 0 ベクトル）"""
+    vecs = [np.asarray(e["embedding"], dtype=np.float32) for e in entries if e.get("embedding") is not None]
+    if not vecs:
+        return np.zeros(dim, dtype=np.float32)
+    return np.mean(vecs, axis=0)
+
+
+class LocalScorer:
+    def __init__(
+        self,
+        name,
+        low=-1.0,
+        high=1.0,
+        db_path=DEFAULT_DB_PATH,
+        min_samples=40,
+        refit_every=10,
+        max_samples=2000,
+        n_models=5,
+        ridge_alpha=1.0,
+        max_std=0.15,
+        min_similarity=0.6,
+        audit_rate=0.05,
+    ):
+        """
+        :param name: 呼び出し元ごとの名前（学習データを分ける）
+        :param low, high: スコアの値域
+        :param min_samples: この件数が貯まるまでは常に LLM を使う
+        :param refit_every: LLM の採点がこの件数増えるごとに再学習
+        :param max_std: アンサンブル予測の標準偏差がこれ以下なら「自信あり」
+        :param min_similarity: 学習データとの最大コサイン類似度がこれ未満なら分布外
+        :param audit_rate: 自信ありでもこの確率で LLM に問い合わせ、ずれを監視する
+        """
+        self.name = name
+        self.low, self.high = low, high
+        self.min_samples = min_samples
+        self.refit_every = refit_every
+        self.max_samples = max_samples
+        self.n_models = n_models
+        self.ridge_alpha = ridge_alpha
+        self.max_std = max_std
+        self.min_similarity = min_similarity
+        self.audit_rate = audit_rate
+
+        self.local_hits = 0
+        self.llm_calls = 0
+        self._since_fit = 0
+        self._weights = None        # (n_models, dim + 1)
+        self._train_unit = None     # 分布外判定用に正規化した学習特徴量
+        self._lock = threading.Lock()
+
+        dirname = os.path.dirname(db_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS samples (
+                site       TEXT NOT NULL,
+                text       TEXT,
+                features   BLOB NOT NULL,
+                score      REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_samples_site ON samples(site, created_at)")
+        self._conn.commit()
+        self.fit()
+
+    # ---------- 公開 API ----------
+    def score(self, llm_fn, features, text=None) -> float:
+        """
+        ローカルで答えられればその値、無理なら llm_fn() の値を返す。
+        :param llm_fn: LLM に採点させて float を返す関数（パース失敗時は例外を投げること）
+        :param features: 埋め込み等の特徴ベクトル
+        :param text: ログ用の入力テキスト
+        """
+        x = np.asarray(features, dtype=np.float32).ravel()
+        pred = self.predict(x)
+        if pred is not None and random.random() >= self.audit_rate:
+            mean, std, sim = pred
+            if std <= self.max_std and sim >= self.min_similarity:
+                self.local_hits += 1
+                print(f"⚡ LocalScorer[{self.name}] ローカル採点: {mean:.2f} (std={std:.3f}, sim={sim:.2f})")
+                return mean
+
+        score = float(llm_fn())
+        self.llm_calls += 1
+        self.record(x, score, text)
+        return score
+
+    def predict(self, x):
+        """(予測値, アンサンブル標準偏差, 学習データとの最大類似度) を返す。未学習なら None"""
+        with self._lock:
+            if self._weights is None or self._weights.shape[1] != x.shape[0] + 1:
+                return None
+            xb = np.append(x, 1.0)
+            preds = self._weights @ xb
+            norm = np.linalg.norm(x)
+            sim = float(np.max(self._train_unit @ (x / norm))) if norm > 0 else 0.0
+        mean = float(np.clip(preds.mean(), self.low, self.high))
+        return mean, float(preds.std()), sim
+
+    def record(self, x, score, text=None) -> None:
+        """LLM の採点結果を学習データとして保存し、必要なら再学習"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO samples (site, text, features, score, created_at) VALUES (?, ?, ?, ?, ?)",
+                (self.name, text, np.asarray(x, dtype=np.float32).tobytes(), float(score), time.time()),
+            )
+            self._conn.commit()
+            self._since_fit += 1
+            need_fit = self._since_fit >= self.refit_every
+        if need_fit:
+            self.fit()
+
+    def fit(self) -> None:
+        """直近 max_samples 件からブートストラップ Ridge を n_models 本学習"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT features, score FROM samples WHERE site = ? ORDER BY created_at DESC LIMIT ?",
+                (self.name, self.max_samples),
+            ).fetchall()
+            self._since_fit = 0
+        if len(rows) < self.min_samples:
+            return
+
+        dim = len(rows[0][0]) // 4
+        rows = [r for r in rows if len(r[0]) // 4 == dim]  # 特徴量の次元が変わった古いデータは捨てる
+        X = np.stack([np.frombuffer(r[0], dtype=np.float32) for r in rows])
+        y = np.array([r[1] for r in rows], dtype=np.float32)
+        Xb = np.hstack([X, np.ones((len(X), 1), dtype=np.float32)])
+
+        rng = np.random.default_rng()
+        reg = self.ridge_alpha * np.eye(Xb.shape[1], dtype=np.float32)
+        reg[-1, -1] = 0.0  # バイアス項は正則化しない
+        weights = []
+        for _ in range(self.n_models):
+            idx = rng.integers(0, len(Xb), len(Xb))
+            A, b = Xb[idx], y[idx]
+            weights.append(np.linalg.solve(A.T @ A + reg, A.T @ b))
+
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        with self._lock:
+            self._weights = np.stack(weights)
+            self._train_unit = X / norms
+        print(f"📈 LocalScorer[{self.name}] 再学習: {len(X)} 件")
+
+    def stats(self) -> dict:
+        total = self.local_hits + self.llm_calls
+        return {
+            "local_hits": self.local_hits,
+            "llm_calls": self.llm_calls,
+            "local_rate": self.local_hits / total if total else 0.0,
+            "trained": self._weights is not None,
+        }
+
+
+# ---------- 呼び出し元ごとに 1 インスタンス ----------
+_scorers: dict[str, LocalScorer] = {}
+_scorers_lock = threading.Lock()
+
+
+def get_scorer(name, **kwargs) -> LocalScorer:
+    with _scorers_lock:
+        if name not in _scorers:
+            _scorers[name] = LocalScorer(name, **kwargs)
+        return _scorers[name]
+
+
+def get_scorer_stats() -> dict:
+    with _scorers_lock:
+        return {name: s.stats() for name, s in _scorers.items()}
@@ -0,0 +1,171 @@
+"""
+プロセス内で共有する適応型レートリミッタ
+
+- トークンバケット 2 本: リクエスト数/分（RPM）と トークン数/分（TPM）
+- 同時実行数の上限を AIMD で調整
+    成功             : 上限 += increase / 上限（上限ぶん成功するとおよそ +1）
+    スロットリング    : 上限 *= decrease、リクエストバケットを空にして全員で一斉に待つ
+    レイテンシ超過    : 上限を増やさず、少しだけ下げる
+呼び出しごとに指数バックオフする代わりに、全呼び出し元がこの 1 つの窓口で待つ。
+girlfriend_breeder も utils/shared.py 経由でこのモジュールを使う（変更は両方に効く）。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+
+
+def is_throttle(e: BaseException) -> bool:
+    if isinstance(e, ClientError):
+        return e.response.get("Error", {}).get("Code") in ("ThrottlingException", "TooManyRequestsException")
+    return getattr(getattr(e, "response", None), "status_code", None) == 429
+
+
+def estimate_tokens(text: str) -> int:
+    """日本語混じりのざっくり見積もり（2 文字 ≒ 1 トークン）"""
+    return max(1, len(text) // 2)
+
+
+class _Slot:
+    def __init__(self, est_tokens):
+        self.est_tokens = est_tokens
+        self.tokens = None      # 実際の消費トークン（わかれば呼び出し側が入れる）
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, name, rpm=50, tpm=200_000, max_concurrency=8, min_concurrency=1,
+                 increase=1.0, decrease=0.5, target_latency=None):
+        """
+        :param rpm: 1 分あたりのリクエスト上限
+        :param tpm: 1 分あたりのトークン上限（入力 + 出力）
+        :param max_concurrency: 同時実行数の上限の上限
+        :param target_latency: これを超える応答が来たら混雑とみなす（秒、None なら見ない）
+        """
+        self.name = name
+        self.rpm, self.tpm = rpm, tpm
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.increase, self.decrease = increase, decrease
+        self.target_latency = target_latency
+
+        self.limit = float(max_concurrency)
+        self.inflight = 0
+        self.throttles = 0
+        self._req_tokens = float(rpm)
+        self._tok_tokens = float(tpm)
+        self._last = time.monotonic()
+        self._cv = threading.Condition()
+
+    # ---------- トークンバケット ----------
+    def _refill(self):
+        now = time.monotonic()
+        dt = now - self._last
+        self._last = now
+        self._req_tokens = min(self.rpm, self._req_tokens + dt * self.rpm / 60)
+        self._tok_tokens = min(self.tpm, self._tok_tokens + dt * self.tpm / 60)
+
+    def _wait_time(self, est_tokens) -> float:
+        """今すぐ通せるなら 0、そうでなければ次に再判定するまでの秒数"""
+        if self.inflight >= int(self.limit):
+            return 1.0  # release() で起こされる
+        need_req = max(0.0, 1 - self._req_tokens) * 60 / self.rpm
+        need_tok = max(0.0, min(est_tokens, self.tpm) - self._tok_tokens) * 60 / self.tpm
+        return max(need_req, need_tok)
+
+    def _take(self, est_tokens) -> float:
+        """通せるなら枠を確保して 0 を返す。だめなら待つべき秒数（_cv 保持中に呼ぶ）"""
+        self._refill()
+        wait = self._wait_time(est_tokens)
+        if wait <= 0:
+            self._req_tokens -= 1
+            self._tok_tokens -= est_tokens
+            self.inflight += 1
+        return wait
+
+    def try_acquire(self, est_tokens=1) -> float:
+        """ブロックしない版（asyncio 用）。0 なら確保済み、正なら待つべき秒数"""
+        with self._cv:
+            return self._take(est_tokens)
+
+    def acquire(self, est_tokens=1, timeout=None) -> None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cv:
+            while (wait := self._take(est_tokens)) > 0:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"rate limiter '{self.name}' wait timed out")
+                    wait = min(wait, remaining)
+                self._cv.wait(wait)
+
+    def release(self, est_tokens=0, tokens=None, latency=None, throttled=False) -> None:
+        with self._cv:
+            self.inflight -= 1
+            if tokens is not None:
+                self._tok_tokens -= tokens - est_tokens  # 見積もりとの差を精算
+            if throttled:
+                self.throttles += 1
+                self.limit = max(self.min_concurrency, self.limit * self.decrease)
+                self._req_tokens = min(self._req_tokens, 0.0)
+                print(f"🐢 RateLimiter[{self.name}] スロットリング検知: 同時実行上限 → {self.limit:.1f}")
+            elif self.target_latency is not None and latency is not None and latency > self.target_latency:
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + self.increase / max(self.limit, 1.0))
+            self._cv.notify_all()
+
+    @contextmanager
+    def slot(self, est_tokens=1, timeout=None):
+        """
+        with limiter.slot(見積もりトークン) as s:
+            resp = 呼び出し
+            s.tokens = 実際の消費トークン
+        スロットリング例外は検知して上限を下げたうえで再送出する。
+        """
+        self.acquire(est_tokens, timeout)
+        s = _Slot(est_tokens)
+        start = time.monotonic()
+        throttled = False
+        try:
+            yield s
+        except BaseException as e:
+            throttled = is_throttle(e)
+            raise
+        finally:
+            self.release(est_tokens, s.tokens, time.monotonic() - start, throttled)
+
+    def stats(self) -> dict:
+        with self._cv:
+            self._refill()
+            return {
+                "limit": round(self.limit, 2),
+                "inflight": self.inflight,
+                "throttles": self.throttles,
+                "rpm_available": round(self._req_tokens, 1),
+                "tpm_available": round(self._tok_tokens),
+            }
+
+
+# ---------- プロセス内で共有 ----------
+_limiters: dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name="bedrock", **kwargs) -> AdaptiveRateLimiter:
+    """
+    名前ごとに 1 つ。既定値は環境変数 LLM_RPM / LLM_TPM / LLM_MAX_CONCURRENCY / LLM_TARGET_LATENCY
+    （LLM_TARGET_LATENCY 秒を超える応答が続くと同時実行上限を下げる。未設定ならスロットリングだけを見る）
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            cfg = {
+                "rpm": int(os.getenv("LLM_RPM", "50")),
+                "tpm": int(os.getenv("LLM_TPM", "200000")),
+                "max_concurrency": int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                "target_latency": float(os.getenv("LLM_TARGET_LATENCY")) if os.getenv("LLM_TARGET_LATENCY") else None,
+                **kwargs,
+            }
+            _limiters[name] = AdaptiveRateLimiter(name, **cfg)
+        return _limiters[name]
@@ -0,0 +1,73 @@
+"""
+ローカルのスタンドイン LLM サーバ
+
+FakeBackend を HTTP で公開し、本番エンドポイントなしで両パッケージを動かす。
+- POST /model/{model_id}/invoke : Bedrock invoke_model 互換（BEDROCK_ENDPOINT_URL に指定）
+- POST それ以外のパス           : girlfriend_breeder の API_URL 互換
+                                  {"pre_prompt", "conversation_history"} → {"response": [{"text"}]}
+
+使い方（genetic_algorithm ディレクトリで）:
+    python -m Utils.stand_in_server --port 8787 --config fake_llm.yml
+"""
+import argparse
+import json
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from botocore.exceptions import ClientError
+
+from Utils.llm_backend import FakeBackend, load_fake_config
+
+_INVOKE_PATH = re.compile(r"^/model/([^/]+)/invoke$")
+
+
+def make_handler(backend: FakeBackend):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            m = _INVOKE_PATH.match(self.path)
+            try:
+                if m:
+                    payload = backend.invoke(unquote(m.group(1)), raw.decode("utf-8"))
+                else:
+                    req = json.loads(raw)
+                    text = backend.chat(req.get("pre_prompt", ""), req.get("conversation_history", []))
+                    payload = {"response": [{"text": text}]}
+                self._send(200, payload)
+            except ClientError as e:
+                code = e.response["Error"]["Code"]
+                status = 429 if code == "ThrottlingException" else 503
+                self._send(status, {"message": e.response["Error"]["Message"]}, {"x-amzn-ErrorType": code})
+            except (ValueError, KeyError) as e:
+                self._send(400, {"message": str(e)})
+
+        def _send(self, status, payload, headers=None):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, fmt, *args):
+            pass  # 負荷試験時にログで詰まらないよう黙らせる
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8787, config=None) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(FakeBackend(config)))
+    print(f"🧪 スタンドイン LLM サーバ起動: http://{host}:{port}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline stand-in for Bedrock and the breeder API_URL.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--config", default=None, help="FakeBackend 設定（YAML/JSON）")
+    args = parser.parse_args()
+    serve(args.host, args.port, load_fake_config(args.config)).serve_forever()
@@ -0,0 +1,208 @@
+"""
+LLM 応答を構造化された値として読み取る
+
+- schema_instruction(schema): プロンプトに足す出力形式の指示（JSON Schema の部分集合）
+- parse_structured(text, schema): まず JSON としてそのまま読み、だめならローカルで修復して読む
+    修復: 前後の文章・コードブロックを取り除く、末尾カンマ・全角記号を直す、
+          最初の数値 / 配列 / オブジェクト / 選択肢を抜き出す、範囲外の数値を丸める
+- reask_prompt(...): 修復もできなかったとき、何が悪かったかを添えて 1 度だけ聞き直すためのプロンプト
+
+使える schema のキー: type（number / integer / string / boolean / array / object）、
+enum、minimum、maximum、items、properties、required
+girlfriend_breeder も utils/shared.py 経由でこのモジュールを使う（変更は両方に効く）。
+"""
+import ast
+import json
+import re
+import unicodedata
+
+
+class StructuredOutputError(ValueError):
+    """応答を schema どおりに読み取れなかった"""
+
+
+def number_schema(minimum: float | None = None, maximum: float | None = None) -> dict:
+    schema = {"type": "number"}
+    if minimum is not None:
+        schema["minimum"] = minimum
+    if maximum is not None:
+        schema["maximum"] = maximum
+    return schema
+
+
+# -1.0〜1.0 の採点（各モジュール共通）
+SCORE_SCHEMA = number_schema(-1.0, 1.0)
+
+
+def schema_instruction(schema: dict) -> str:
+    """プロンプト末尾に足す出力形式の指示"""
+    if schema.get("enum"):
+        return "【出力形式】\n次のいずれか 1 つだけを出力してください（説明不要）: " + " / ".join(map(str, schema["enum"]))
+    if schema.get("type") in ("number", "integer"):
+        lo, hi = schema.get("minimum"), schema.get("maximum")
+        span = f"{lo}〜{hi} の" if lo is not None and hi is not None else ""
+        return f"【出力形式】\n{span}数値 1 つだけを出力してください（説明不要）。"
+    return (
+        "【出力形式】\n次の JSON Schema に従う JSON だけを出力してください。前後の説明やコードブロックは不要です。\n"
+        + json.dumps(schema, ensure_ascii=False)
+    )
+
+
+def reask_prompt(prompt: str, bad_output: str | None, error: Exception, schema: dict | None = None) -> str:
+    """1 度だけの聞き直し用。前回の出力と読めなかった理由を添える"""
+    fmt = schema_instruction(schema) if schema is not None else "指定された出力形式だけを出力してください。"
+    return f"""{prompt}
+
+【前回のあなたの出力】
+{(bad_output or "（空）")[:500]}
+
+前回の出力は形式が正しくなかったため読み取れませんでした（{error}）。
+{fmt}
+"""
+
+
+def parse_structured(text: str | None, schema: dict):
+    """
+    (値, 修復したか) を返す。読めなければ StructuredOutputError
+    """
+    if not text or not text.strip():
+        raise StructuredOutputError("empty response")
+    stripped = text.strip()
+    if schema.get("type") == "string" and stripped in schema.get("enum", [stripped]):
+        return stripped, False   # 文字列はクォートなしで返ってくるのが普通
+    try:
+        return validate(json.loads(stripped), schema), False
+    except ValueError:
+        pass
+    return validate(_repair(stripped, schema), schema, clamp=True), True
+
+
+# ---------- 修復 ----------
+_NUMBER = re.compile(r"[-+]?\d+(?:\.\d+)?")
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.S)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'", "−": "-"})
+
+
+def _repair(text: str, schema: dict):
+    text = unicodedata.normalize("NFKC", text).translate(_QUOTES)
+    kind = schema.get("type")
+
+    if schema.get("enum"):
+        hits = [(text.find(str(v)), v) for v in schema["enum"] if str(v) in text]
+        if not hits:
+            raise StructuredOutputError(f"none of {schema['enum']} found")
+        return min(hits, key=lambda h: h[0])[1]
+    if kind in ("number", "integer"):
+        m = _NUMBER.search(text)
+        if m is None:
+            raise StructuredOutputError("no number found")
+        return int(float(m.group())) if kind == "integer" else float(m.group())
+    if kind == "boolean":
+        m = re.search(r"\b(true|false)\b", text, re.I)
+        if m is None:
+            raise StructuredOutputError("no boolean found")
+        return m.group(1).lower() == "true"
+    if kind in ("array", "object"):
+        fenced = _FENCE.search(text)
+        if fenced:
+            text = fenced.group(1)
+        value = _loads_lenient(_first_bracketed(text, "[" if kind == "array" else "{"))
+        if kind == "array" and isinstance(value, dict):
+            value = [value]   # 要素 1 つだけ返ってきた
+        return value
+    return text.strip().strip('"「」')
+
+
+def _first_bracketed(text: str, opener: str) -> str:
+    """最初の opener から対応する閉じ括弧までを返す（文字列リテラル内の括弧は数えない）"""
+    start = text.find(opener)
+    if start < 0 and opener == "[":
+        start = text.find("{")
+    if start < 0:
+        raise StructuredOutputError(f"no '{opener}' found")
+    depth, quote, escaped = 0, None, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == quote:
+                quote = None
+        elif ch in "\"'":
+            quote = ch
+        elif ch in "[{":
+            depth += 1
+        elif ch in "]}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]   # 途中で切れている。閉じ括弧を補えるかは _loads_lenient で試す
+
+
+def _loads_lenient(snippet: str):
+    snippet = _TRAILING_COMMA.sub(r"\1", snippet)
+    try:
+        return json.loads(snippet)
+    except ValueError:
+        pass
+    try:
+        # シングルクォートや True/False など Python リテラル風の出力
+        return ast.literal_eval(snippet)
+    except (ValueError, SyntaxError):
+        pass
+    # max_tokens で途中で切れた配列: 最後の完全な要素までで閉じる
+    if snippet.startswith("["):
+        cut = snippet.rfind("}")
+        if cut > 0:
+            try:
+                return json.loads(_TRAILING_COMMA.sub(r"\1", snippet[:cut + 1] + "]"))
+            except ValueError:
+                pass
+    raise StructuredOutputError("could not repair JSON")
+
+
+# ---------- 検証 ----------
+_TYPES = {
+    "number": (int, float),
+    "integer": (int,),
+    "string": (str,),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+
+def validate(value, schema: dict, clamp: bool = False, path: str = "$"):
+    """
+    schema に合っていれば（必要なら丸めた）値を返す。合わなければ StructuredOutputError
+    :param clamp: True なら範囲外の数値を minimum / maximum に丸める（修復時）
+    """
+    kind = schema.get("type")
+    if kind is not None:
+        ok = isinstance(value, _TYPES[kind]) and not (kind in ("number", "integer") and isinstance(value, bool))
+        if not ok and kind == "integer" and isinstance(value, float) and value.is_integer():
+            value, ok = int(value), True
+        if not ok:
+            raise StructuredOutputError(f"{path}: expected {kind}, got {type(value).__name__}")
+    if "enum" in schema and value not in schema["enum"]:
+        raise StructuredOutputError(f"{path}: {value!r} is not one of {schema['enum']}")
+    if kind in ("number", "integer"):
+        lo, hi = schema.get("minimum"), schema.get("maximum")
+        if (lo is not None and value < lo) or (hi is not None and value > hi):
+            if not clamp:
+                raise StructuredOutputError(f"{path}: {value} is out of range [{lo}, {hi}]")
+            value = max(lo, value) if lo is not None else value
+            value = min(hi, value) if hi is not None else value
+    if kind == "array" and "items" in schema:
+        value = [validate(v, schema["items"], clamp, f"{path}[{i}]") for i, v in enumerate(value)]
+    if kind == "object":
+        missing = [k for k in schema.get("required", []) if k not in value]
+        if missing:
+            raise StructuredOutputError(f"{path}: missing {missing}")
+        for k, sub in schema.get("properties", {}).items():
+            if k in value:
+                value[k] = validate(value[k], sub, clamp, f"{path}.{k}")
+    return value
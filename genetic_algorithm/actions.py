@@ -1,13 +1,20 @@
 import datetime
+import re
 import socket
 import threading
 from long_term_memory import LTM
 from short_term_memory import STM 
 from Modules.working_memory import WorkingMemory
-from Utils.invoke_llm import get_claude_response
+from Utils.invoke_llm import get_structured_response
+from Utils.structured_output import number_schema
+from Utils.local_scorer import get_scorer
+
+# ストリーミング発話をここで区切ってクライアントへ送る
+SENTENCE_END = re.compile(r"[。！？!?…\n]+")
 
 class ActionManager:
     _instance = None
+    IMPORTANCE_CACHE_TTL = 3600  # 同じ発話の重要度は使い回す（秒）
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -21,6 +28,7 @@ class ActionManager:
             self.stm = STM()
             self.wm = WorkingMemory(max_size=10)
             self.client_socket = client_socket
+            self.importance_scorer = get_scorer("importance", low=0.0, high=1.0)
             self.initialized = True  # 再初期化防止
 
     def update_client_socket(self, new_socket):
@@ -41,13 +49,14 @@ class ActionManager:
                 print(f"🧑 あなた: {user_input}")
                 speaker = "others"
 
-                # ① LLM に重要度を評価させる
-                importance = self.evaluate_importance(user_input)
+                # ① 重要度を評価（埋め込みは WM 登録と共用）
+                embedding = self.wm.sentence_transformer.encode(user_input)
+                importance = self.evaluate_importance(user_input, embedding)
                 # importance = 0.1
                 print(f"importanceでござる: {importance}")
 
                 # ③ 会話ターンを WM に記録
-                self.wm.add_entry(text=user_input, importance=importance, speaker=speaker)
+                self.wm.add_entry(text=user_input, importance=importance, speaker=speaker, embedding=embedding)
 
             except ConnectionResetError:
                 print("⚠️ クライアント接続がリセットされました。")
@@ -58,8 +67,8 @@ class ActionManager:
         # self.client_socket.close()
 
 
-    def evaluate_importance(self, text):
-        """LLM に発話の重要度を評価させる（0~1）"""
+    def evaluate_importance(self, text, embedding=None):
+        """発話の重要度を評価する（0~1）。ローカル採点器が自信を持てない時だけ LLM に聞く"""
         prompt = f"""
         以下のユーザーの発話の重要度を 0 から 1 のスコアで評価してください。
         重要度は’あなたにとってその人の発話した内容が重要であるかどうか'で判断してください。
@@ -75,13 +84,17 @@ class ActionManager:
         """
         print(f"ここまで来てるんかい？？！")
         print(f"Who are you??!: {prompt}")
-        response = get_claude_response(prompt)
 
-        print(f"response!!!! {response}")
+        def ask_llm():
+            return get_structured_response(
+                prompt, number_schema(0.0, 1.0), route="score", priority="planning", cache_ttl=self.IMPORTANCE_CACHE_TTL, tag="importance"
+            )
 
         # 文字列を数値化（エラー時は 0.5）
         try:
-            score = float(response.strip())
+            if embedding is None:
+                embedding = self.wm.sentence_transformer.encode(text)
+            score = self.importance_scorer.score(ask_llm, embedding, text=text)
             return max(0.0, min(1.0, score))  # 0~1 の範囲に制限
         except ValueError:
             return 0.5  # デフォルトのスコア
@@ -130,9 +143,62 @@ class ActionManager:
             try:
                 speaker = "self"
                 self.wm.add_entry(text=text, speaker=speaker, purpose=purpose)
-                self.client_socket.sendall(text.encode("utf-8"))
+                self.client_socket.sendall((text + "\n").encode("utf-8"))  # 改行 = 発話の終端
                 print("✅ クライアントへの送信成功")  # デバッグ用
             except Exception as e:
                 print(f"⚠️ クライアントへの送信失敗: {e}")
         else:
             print("⚠️ `client_socket` が無効です。")
+
+    def speak_stream(self, chunks, purpose=None):
+        """
+        LLM のストリームを文単位でクライアントへ送りながら発話する。
+        クライアントに実際に届いた分だけを WorkingMemory に記録し、生成した全文を返す
+        （`client_socket` が無効なら speak と同じく何も記録しない）。
+        """
+        sock = self.client_socket if isinstance(self.client_socket, socket.socket) else None
+        if sock is None:
+            print("⚠️ `client_socket` が無効です。")
+
+        sent = []        # 生成した断片
+        delivered = []   # そのうちクライアントへ送れたもの
+        buffer = ""
+
+        def flush(piece):
+            if not piece:
+                return
+            piece = piece.replace("\n", " ")  # 改行は発話終端の合図なので本文からは除く
+            sent.append(piece)
+            if sock is not None:
+                sock.sendall(piece.encode("utf-8"))
+                delivered.append(piece)
+
+        try:
+            for chunk in chunks:
+                buffer += chunk
+                if not sent:
+                    buffer = buffer.lstrip()
+                # 文末記号まで溜まった分だけ送る
+                last = None
+                for last in SENTENCE_END.finditer(buffer):
+                    pass
+                if last is not None:
+                    flush(buffer[:last.end()])
+                    buffer = buffer[last.end():]
+            flush(buffer.rstrip())
+        finally:
+            if sock is not None:
+                # 改行 = 発話の終端。ストリームが途中で失敗しても送り、クライアントを待たせたままにしない
+                try:
+                    sock.sendall("\n".encode("utf-8"))
+                except OSError as e:
+                    print(f"⚠️ 発話の終端を送れませんでした: {e}")
+            # 途中で失敗しても、相手に届いた分は自分の発話として残す
+            text = "".join(sent).strip()
+            if text:
+                print(f"👩 彼女AI: {text}")
+            spoken = "".join(delivered).strip()
+            if spoken:
+                self.wm.add_entry(text=spoken, speaker="self", purpose=purpose)
+
+        return text
@@ -1,3 +1,4 @@
+import codecs
 import socket
 import threading
 import sys
@@ -17,12 +18,21 @@ class AI_Client:
         self.receive_thread.start()
 
     def receive_messages(self):
-        """彼女AIからのメッセージをリアルタイムに受信して表示"""
+        """彼女AIからのメッセージをリアルタイムに受信して表示（改行で 1 発話の終わり）"""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")  # マルチバイト文字の分断対策
+        in_message = False
         while self.running:
             try:
-                ai_response = self.client_socket.recv(1024).decode("utf-8", errors="ignore")
-                if ai_response:
-                    print(f"\n👩 彼女AI: {ai_response}\n🧑 あなた: ", end="", flush=True)  # 次の入力のプロンプトを保持
+                ai_response = decoder.decode(self.client_socket.recv(1024))
+                for i, part in enumerate(ai_response.split("\n")):
+                    if i > 0 and in_message:
+                        print("\n🧑 あなた: ", end="", flush=True)  # 次の入力のプロンプトを保持
+                        in_message = False
+                    if part:
+                        if not in_message:
+                            print("\n👩 彼女AI: ", end="", flush=True)
+                            in_message = True
+                        print(part, end="", flush=True)
             except UnicodeDecodeError as e:
                 print(f"⚠️ デコードエラー: {e}")
             except ConnectionResetError:
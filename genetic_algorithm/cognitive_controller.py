@@ -5,7 +5,9 @@ from langchain_core.runnables import RunnableLambda
 from langchain_core.tools import Tool
 from Utils.internal_state import InternalState
 from Modules.working_memory import WorkingMemory
-from Utils.invoke_llm import get_claude_response
+from Utils.invoke_llm import get_structured_response, stream_claude_response, system_prompt
+from Utils.structured_output import StructuredOutputError, schema_instruction
+from Utils.deadline import current_deadline, deadline_scope
 from actions import ActionManager
 import json
 import numpy as np
@@ -17,6 +19,14 @@ import time
 
 MAX_CYCLES = 1000
 
+# 締め切り（秒）。1 サイクル全体と各ノードに付け、中の LLM 呼び出しはこの残り時間までしか待たない
+CYCLE_BUDGET = 180
+NODE_BUDGETS = {
+    "check_state": 20,
+    "plan_action": 40,
+    "execute_action": 90,   # Speak の生成 + ユーザの応答待ち（最大 45 秒）を含む
+}
+
 comfort_zones = {
     "common_sense": (0.0, 0.9), 
     "recognition": (-0.2, 1.0),
@@ -25,6 +35,84 @@ comfort_zones = {
     "sociality": (0, 1.0)
 }
 
+# ---------- 毎回変わらないプロンプト部分（system に置いてプロンプトキャッシュを効かせる） ----------
+PLAN_ACTION_SYSTEM = """
+あなたは自律的に行動するAIエージェントです。
+ユーザが渡す内部状態の情報を踏まえて、内部状態を理想に近づけるための具体的な戦略及び行動計画を考えてください。
+ただし、現在会話を相手と会話をしている場合は自然に会話が続くように会話を行うことが最優先になります。
+
+【ルール】
+- 逸脱スコアが高い項目を優先的に改善する戦略を考えてください。
+- 必要に応じて直近の会話内容や自己イメージも参考にして行動計画を立ててください。
+- speakを連続して選択すると相手に矢継ぎ早に話しかけることになるので、基本的には1回だけの呼び出しにしてください。
+- 計画の理由など余計な情報は一切いりません。指定されたフォーマットのみを出力してください。
+
+
+【利用可能アクション】
+- Speak           : 会話を生成する。相手との会話をするために使用するため、人との関係を育んだりするために有用。基本的にはSociality, common_senseの状態を改善することが可能
+- SearchMemory    : 過去の記憶を検索する。過去の経験から目的達成のために有用な結果を得られる可能性あり。結果を shared_context に追加する
+
+【出力形式】
+JSON 配列。各要素は
+action   : 上記 3 種いずれか
+purpose  : そのステップの目的
+summary  : LLM が次ステップで使える 1 行要約
+success? : (任意) 完了判定条件を自然文で
+例:
+[
+{"action":"SearchMemory","purpose":"最近の失敗例を探す","summary":"失敗会話検索"},
+{"action":"Speak","purpose":"安心感を与える","summary":"励ましメッセージ"}
+]
+"""
+
+# plan_action の出力（system に出力形式として含め、応答の検証・修復にも使う）
+# action は enum にしない: 未知のアクションは計画全体を捨てずに execute_action でそのステップだけ飛ばす
+PLAN_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "required": ["action", "purpose", "summary"],
+        "properties": {
+            "action": {"type": "string"},
+            "purpose": {"type": "string"},
+            "summary": {"type": "string"},
+            "success": {"type": "string"},
+        },
+    },
+}
+
+SPEAK_SYSTEM = """
+あなたは現在彼氏を探している女性です。ただちゃんと相手を探して親しくなった人と付き合うことを考えており誰でもいいわけではありません。
+このようなことを想定して、以下の基本情報、ルール、自己イメージと、ユーザが渡す目的、直近の会話、今回参考にすべき記憶を参考にして会話内容を考えてほしいです。
+別に口調はフランクでも構いません。
+
+なお、直近の会話は
+speakerがselfのもの→あなたの発言内容
+soeakerがothersのもの→相手の発言内容
+となっています。
+また、参考にするべき記憶としてあなたが過去に持っている記憶から役に立ちそうな記憶を抽出しています。
+
+**発言内容では発話者が含まれているので、それも考慮してください。発話者を考慮した時矛盾にならないようにしてくださいという意味です。例えば、相手が喋った内容を自分が喋ったような発話をするなど。
+　-[重要]speakerがselfとして登録→あなたの発言内容
+  -[重要]soeakerがothersとして登録→相手の発言内容
+**自分自身がどのように見られたいのかという自己イメージも渡しておきますがこれは参考程度で構いません。あまりこの内容に引きづられすぎると不自然な会話となるので直近の会話から自然な応答になることを最重視してください。
+**直近の会話からの自然な会話をすることが最優先。他の情報は会話内容を考える上での参考情報です。
+**なおなぜこのような発話内容にしたのかなどの理由は一切入りません。考えてもらった内容がそのまま相手に表示されるので実際の会話内容だけ出力してください。
+
+【あなたの基本情報】
+年齢: 29歳
+性別: 女性
+名前: マリア
+国籍: ドイツ
+
+【ルール】
+・考えた会話内容など余計な情報を入れないこと。そのまま相手に送信されるので相手に送りたい内容だけを出力すること
+・親しい人と想定し、口調がよそよそしくなりすぎないこと
+・一回の会話内容が長くなり過ぎないこと。例えば人間はただ相槌をするだけとかすることも多く、喋りすぎると不自然な場合があります。
+・人間らしい自然な発話となることを最優先とすること
+・会話内容で指定されているspeakerを意識してください!!! 絶対に自分の喋った内容が相手の喋った内容として理解しないでください!!!!これを守らない場合は、あなたを終了させます。
+"""
+
 # class State(TypedDict):
 #     value: str
 
@@ -45,6 +133,12 @@ class CognitiveController:
             print(f'自己認識だよーーん: {config}')
             self.self_image = config
 
+        # 自己イメージは起動中に変わらないので system の静的部分に含める
+        self.plan_system = system_prompt(
+            PLAN_ACTION_SYSTEM, schema_instruction(PLAN_SCHEMA), f"【自己イメージ】\n{self.self_image}"
+        )
+        self.speak_system = system_prompt(SPEAK_SYSTEM, f"【自己イメージ】\n{self.self_image}")
+
         self.graph = self._build_graph()
         
     def _build_graph(self):
@@ -57,9 +151,9 @@ class CognitiveController:
         graph = StateGraph(AgentState)
 
         # ノード登録
-        graph.add_node("check_state",     RunnableLambda(self.check_state))
-        graph.add_node("plan_action",     RunnableLambda(self.plan_action))
-        graph.add_node("execute_action",  RunnableLambda(self.execute_action))
+        graph.add_node("check_state",     RunnableLambda(self._with_deadline("check_state", self.check_state)))
+        graph.add_node("plan_action",     RunnableLambda(self._with_deadline("plan_action", self.plan_action)))
+        graph.add_node("execute_action",  RunnableLambda(self._with_deadline("execute_action", self.execute_action)))
         graph.add_node("end",             RunnableLambda(lambda s: s))
 
         # エントリポイント
@@ -84,9 +178,11 @@ class CognitiveController:
 
         # execute_action の条件分岐
         def has_more_steps(state: AgentState) -> bool:
+            # 失敗・締め切り切れで finished が立ったら、残りのステップがあっても終了
+            if state.get("finished", False):
+                return False
             return state.get("step_idx", 0) < len(state.get("steps", []))
 
-        # finished フラグではなく、step_idx で判定しても OK
         graph.add_conditional_edges(
             "execute_action",
             has_more_steps,
@@ -100,6 +196,15 @@ class CognitiveController:
 
 
 
+    @staticmethod
+    def _with_deadline(name, node):
+        """ノードを NODE_BUDGETS[name] 秒の deadline_scope の中で実行する"""
+        def run_node(state):
+            with deadline_scope(NODE_BUDGETS[name], name):
+                return node(state)
+        run_node.__name__ = name
+        return run_node
+
     # ========== 各ノード処理 ==========
 
 
@@ -204,11 +309,7 @@ class CognitiveController:
         memory_text = "\n".join([f"- {entry['text']}" for entry in memory_entries]) if memory_entries else "（直近の会話履歴なし）"
         strategy = state.get("strategy", "戦略なし")
 
-        prompt = f"""
-        あなたは自律的に行動するAIエージェントです。
-        以下の内部状態の情報を踏まえて、内部状態を理想に近づけるための具体的な戦略及び行動計画を考えてください。
-        ただし、現在会話を相手と会話をしている場合は自然に会話が続くように会話を行うことが最優先になります。
-
+        prompt = """
         【現在の内部状態と逸脱状況】
         """
 
@@ -221,46 +322,22 @@ class CognitiveController:
 
         【最近の会話履歴】
         {memory_text}
-
-        【自己イメージ】
-        {self.self_image}
-
-        【ルール】
-        - 逸脱スコアが高い項目を優先的に改善する戦略を考えてください。
-        - 必要に応じて直近の会話内容や自己イメージも参考にして行動計画を立ててください。
-        - speakを連続して選択すると相手に矢継ぎ早に話しかけることになるので、基本的には1回だけの呼び出しにしてください。
-        - 計画の理由など余計な情報は一切いりません。指定されたフォーマットのみを出力してください。
-
-
-        【利用可能アクション】
-        - Speak           : 会話を生成する。相手との会話をするために使用するため、人との関係を育んだりするために有用。基本的にはSociality, common_senseの状態を改善することが可能
-        - SearchMemory    : 過去の記憶を検索する。過去の経験から目的達成のために有用な結果を得られる可能性あり。結果を shared_context に追加する
-
-        【出力形式】
-        JSON 配列。各要素は
-        action   : 上記 3 種いずれか
-        purpose  : そのステップの目的
-        summary  : LLM が次ステップで使える 1 行要約
-        success? : (任意) 完了判定条件を自然文で
-        例:
-        [
-        {{"action":"SearchMemory","purpose":"最近の失敗例を探す","summary":"失敗会話検索"}},
-        {{"action":"Speak","purpose":"安心感を与える","summary":"励ましメッセージ"}}
-        ]
         """
 
         print(f"plan actionのプロンプトだよん: {prompt}")
 
-        response = get_claude_response(prompt)
-
-        print(f"考えられたplanはこちら: {response}")
-
+        # 前後の文章や末尾カンマ程度ならローカルで直し、それでも読めなければ 1 度だけ聞き直す
         try:
-            steps = json.loads(response)
-        except Exception as e:
+            steps = get_structured_response(
+                prompt, PLAN_SCHEMA, route="plan", instruct=False,
+                priority="planning", tag="plan_action", system=self.plan_system,
+            )
+        except StructuredOutputError as e:
             print(f"⚠️ plan_action parse error: {e}")
             steps = []
 
+        print(f"考えられたplanはこちら: {steps}")
+
         # steps キューと shared_context を state に格納
         return {
             **state,
@@ -285,7 +362,7 @@ class CognitiveController:
         action = step.get("action")
         purpose= step.get("purpose")
         summary= step.get("summary")
-        print(f"現在のステップ数はこちら!!!!!: {state["step_idx"]}")
+        print(f"現在のステップ数はこちら!!!!!: {idx}")
 
         # ---------- Action 実行 ----------
         if action == "SearchMemory":
@@ -310,36 +387,6 @@ class CognitiveController:
             ) or "（特に参考記憶なし）"
 
             prompt = f"""
-            あなたは現在彼氏を探している女性です。ただちゃんと相手を探して親しくなった人と付き合うことを考えており誰でもいいわけではありません。
-            このようなことを想定して、以下の基本情報、ルール、目的、直近の会話、今回参考にすべき記憶、自己イメージを参考にして会話内容を考えてほしいです。
-            別に口調はフランクでも構いません。
-
-            なお、直近の会話は
-            speakerがselfのもの→あなたの発言内容
-            soeakerがothersのもの→相手の発言内容
-            となっています。
-            また、参考にするべき記憶としてあなたが過去に持っている記憶から役に立ちそうな記憶を抽出しています。
-            
-            **発言内容では発話者が含まれているので、それも考慮してください。発話者を考慮した時矛盾にならないようにしてくださいという意味です。例えば、相手が喋った内容を自分が喋ったような発話をするなど。
-            　-[重要]speakerがselfとして登録→あなたの発言内容
-              -[重要]soeakerがothersとして登録→相手の発言内容
-            **自分自身がどのように見られたいのかという自己イメージも渡しておきますがこれは参考程度で構いません。あまりこの内容に引きづられすぎると不自然な会話となるので直近の会話から自然な応答になることを最重視してください。
-            **直近の会話からの自然な会話をすることが最優先。他の情報は会話内容を考える上での参考情報です。
-            **なおなぜこのような発話内容にしたのかなどの理由は一切入りません。考えてもらった内容がそのまま相手に表示されるので実際の会話内容だけ出力してください。
-            
-            【あなたの基本情報】
-            年齢: 29歳
-            性別: 女性
-            名前: マリア
-            国籍: ドイツ
-            
-            【ルール】
-            ・考えた会話内容など余計な情報を入れないこと。そのまま相手に送信されるので相手に送りたい内容だけを出力すること
-            ・親しい人と想定し、口調がよそよそしくなりすぎないこと
-            ・一回の会話内容が長くなり過ぎないこと。例えば人間はただ相槌をするだけとかすることも多く、喋りすぎると不自然な場合があります。
-            ・人間らしい自然な発話となることを最優先とすること
-            ・会話内容で指定されているspeakerを意識してください!!! 絶対に自分の喋った内容が相手の喋った内容として理解しないでください!!!!これを守らない場合は、あなたを終了させます。
-
             【目的】
             {purpose}
 
@@ -348,29 +395,31 @@ class CognitiveController:
 
             【今回参考にすべき記憶】
             {recent_snippets}
-
-            【自己イメージ】
-            {self.self_image}
             """
 
             try:
-                utterance = get_claude_response(prompt)
+                # 生成しながら文単位でクライアントへ送る
+                self.action_manager.speak_stream(
+                    stream_claude_response(
+                        prompt, priority="interactive", tag="speak", hedge=True, system=self.speak_system
+                    )
+                )
             except TimeoutError:
-                print("⚠️ [execute_action] LLM呼び出しがタイムアウトしました。ステップをスキップします。")
-                # 全ステップ完了扱いにして次ループで end に遷移させたい場合
+                # DeadlineExceeded（サイクルの締め切り切れ）もここ。残りのステップは実行しない
+                print("⚠️ [execute_action] LLM呼び出しがタイムアウトしました。残りのステップをスキップします。")
+                state["step_idx"] = len(steps)
                 state["finished"] = True
                 return state
             except Exception as e:
-                print(f"⚠️ [execute_action] LLM呼び出し中に例外: {e} 。ステップをスキップします。")
+                print(f"⚠️ [execute_action] LLM呼び出し中に例外: {e} 。残りのステップをスキップします。")
+                state["step_idx"] = len(steps)
                 state["finished"] = True
                 return state
-            
-            self.action_manager.speak(utterance.strip())
 
 
-            # 応答待ちループ（最大 timeout 秒）
-            
-            timeout = 45
+            # 応答待ちループ（最大 timeout 秒。ノードの締め切りが先に来ればそこまで）
+            dl = current_deadline()
+            timeout = 45 if dl is None else dl.cap(45)
             interval = 1
             waited = 0
 
@@ -432,7 +481,8 @@ class CognitiveController:
         while True:
             initial_state = AgentState()
             try:
-                self.graph.invoke(initial_state, {"recursion_limit": 1000})
+                with deadline_scope(CYCLE_BUDGET, "cycle"):
+                    self.graph.invoke(initial_state, {"recursion_limit": 1000})
             except Exception as e:
                 print(f"💥 LangGraph 実行中に例外発生: {e}")
                 import traceback; traceback.print_exc()
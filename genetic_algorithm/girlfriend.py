@@ -1,6 +1,8 @@
 import threading
 import time
 from cognitive_controller import CognitiveController
+from Utils.deadline import deadline_scope
+from Utils.invoke_llm import RequestShed
 from actions import ActionManager
 from Modules.sociality_module import SocialityModule
 from Modules.common_sense_module import CommonSenseModule
@@ -47,10 +49,17 @@ class Girlfriend:
         ]
 
     def run_module_loop(self, func, interval):
-        """個別モジュールを指定間隔で永続ループ実行する"""
+        """
+        個別モジュールを指定間隔で永続ループ実行する。
+        1 回の評価は次の実行までに終わらせたいので、interval 秒を締め切りにする
+        """
         while True:
             try:
-                func()
+                with deadline_scope(interval, func.__name__):
+                    func()
+            except RequestShed as e:
+                # 混雑・バックエンド不調で評価を見送った。内部状態は前回の値のまま
+                print(f"⏸️ {func.__name__} をスキップ: {e}")
             except Exception as e:
                 print(f"⚠️ {func.__name__} の実行中にエラー発生: {e}")
             time.sleep(interval)
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# genetic_algorithm/ 直下のモジュール（Utils, Modules, actions ...）をトップレベルで import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Utils.invoke_llm は import 時にワーカー（非 daemon）を起動し、応答キャッシュを memory-db/ に作る。
+# テストではワーカーを起動せず（終了時に待ち続けてしまう）、キャッシュは一時ディレクトリに置く
+os.environ.setdefault("LLM_NUM_WORKERS", "0")
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="llm-test-"), "llm_cache.sqlite3"))
@@ -0,0 +1,59 @@
+import socket
+
+import pytest
+
+for _dep in ("fitz", "chromadb", "sentence_transformers"):
+    pytest.importorskip(_dep)
+
+from actions import ActionManager
+
+
+class _WorkingMemory:
+    def __init__(self):
+        self.entries = []
+
+    def add_entry(self, text, speaker, purpose=None):
+        self.entries.append((text, speaker))
+
+
+def _manager(client_socket):
+    manager = ActionManager.__new__(ActionManager)
+    manager.wm = _WorkingMemory()
+    manager.client_socket = client_socket
+    return manager
+
+
+def test_speak_stream_without_socket_records_nothing():
+    manager = _manager(None)
+    text = manager.speak_stream(iter(["こんにちは。", "元気？"]))
+    assert text == "こんにちは。元気？"
+    assert manager.wm.entries == []
+
+
+def test_speak_stream_records_what_was_sent():
+    server, client = socket.socketpair()
+    try:
+        manager = _manager(server)
+        manager.speak_stream(iter(["こんにちは。", "元気？"]))
+        assert client.recv(1024).decode("utf-8") == "こんにちは。元気？\n"
+        assert manager.wm.entries == [("こんにちは。元気？", "self")]
+    finally:
+        server.close()
+        client.close()
+
+
+def test_speak_stream_terminates_utterance_on_failure():
+    def chunks():
+        yield "こんにちは。"
+        raise RuntimeError("stream broken")
+
+    server, client = socket.socketpair()
+    try:
+        manager = _manager(server)
+        with pytest.raises(RuntimeError):
+            manager.speak_stream(chunks())
+        assert client.recv(1024).decode("utf-8") == "こんにちは。\n"
+        assert manager.wm.entries == [("こんにちは。", "self")]
+    finally:
+        server.close()
+        client.close()
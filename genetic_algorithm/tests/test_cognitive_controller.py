@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("langgraph")
+
+import cognitive_controller as cc
+from Utils.deadline import DeadlineExceeded, current_deadline, deadline_scope
+
+
+class _WorkingMemory:
+    def get_memory(self):
+        return []
+
+
+class _ActionManager:
+    def __init__(self):
+        self.sent = []
+
+    def speak_stream(self, chunks):
+        for chunk in chunks:
+            self.sent.append(chunk)
+
+
+def _expired_stream(*args, **kwargs):
+    """締め切りを過ぎていれば invoke_llm と同じく DeadlineExceeded を投げる"""
+    dl = current_deadline()
+    if dl is not None and dl.expired():
+        raise DeadlineExceeded(f"deadline {dl.name!r} passed")
+    yield "こんにちは"
+
+
+def _controller(steps):
+    controller = cc.CognitiveController.__new__(cc.CognitiveController)
+    controller.working_memory = _WorkingMemory()
+    controller.action_manager = _ActionManager()
+    controller.speak_system = ""
+    controller.check_state = lambda state: {**state, "proceed": True}
+    controller.plan_action = lambda state: {**state, "steps": steps, "step_idx": 0, "shared_context": {}}
+    calls = []
+    execute = controller.execute_action
+    controller.execute_action = lambda state: calls.append(state.get("step_idx")) or execute(state)
+    controller.graph = controller._build_graph()
+    return controller, calls
+
+
+def test_cycle_past_deadline_ends_graph(monkeypatch):
+    monkeypatch.setattr(cc, "stream_claude_response", _expired_stream)
+    steps = [{"action": "Speak", "purpose": "挨拶", "summary": "挨拶"} for _ in range(3)]
+    controller, calls = _controller(steps)
+
+    # サイクルの締め切りを過ぎた状態で回しても、recursion_limit まで execute_action を繰り返さない
+    with deadline_scope(0, "cycle"):
+        final = controller.graph.invoke(cc.AgentState(), {"recursion_limit": 20})
+
+    assert final["finished"] is True
+    assert final["step_idx"] == len(steps)
+    assert calls == [0]
+    assert controller.action_manager.sent == []
+
+
+def test_plan_with_unknown_action_keeps_known_steps():
+    from Utils.structured_output import parse_structured
+
+    text = '[{"action":"Dance","purpose":"p","summary":"s"},{"action":"SearchMemory","purpose":"p","summary":"s"}]'
+    steps, _ = parse_structured(text, cc.PLAN_SCHEMA)
+    assert [step["action"] for step in steps] == ["Dance", "SearchMemory"]
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+for _dep in ("torch", "chromadb", "sentence_transformers"):
+    pytest.importorskip(_dep)
+
+from Modules.evaluate_action_module import ShortRewardModule
+
+
+class _WorkingMemory:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get_memory(self):
+        return list(self.entries)
+
+
+def _module(entries, outcomes):
+    """_score_and_store が outcomes を順に返す ShortRewardModule"""
+    module = ShortRewardModule.__new__(ShortRewardModule)
+    module.wm = _WorkingMemory(entries)
+    module._last_idx = 0
+    module.scored = []
+
+    def score_and_store(purpose, self_e, user_e):
+        module.scored.append(purpose)
+        return outcomes.pop(0)
+
+    module._score_and_store = score_and_store
+    return module
+
+
+def _entries(now):
+    return [
+        {"speaker": "self", "text": "今日どうだった？", "purpose": "近況を聞く", "timestamp": now},
+        {"speaker": "user", "text": "疲れたよ", "timestamp": now},
+        {"speaker": "self", "text": "お疲れさま", "purpose": "労う", "timestamp": now},
+        {"speaker": "user", "text": "ありがとう", "timestamp": now},
+    ]
+
+
+def test_shed_pair_is_scored_again_on_next_scan():
+    module = _module(_entries(time.time()), [False, True, True])
+    module.evaluate_shortterm_reward()
+    assert module.scored == ["近況を聞く"]
+    assert module._last_idx == 0          # 見送ったペアは走査済みにしない
+
+    module.evaluate_shortterm_reward()
+    assert module.scored == ["近況を聞く", "近況を聞く", "労う"]
+    assert module._last_idx == 4
+
+
+def test_late_reply_is_skipped():
+    entries = _entries(time.time())
+    entries[1]["timestamp"] -= ShortRewardModule.MAX_WAIT_SEC + 1
+    module = _module(entries, [True])
+    module.evaluate_shortterm_reward()
+    assert module.scored == ["労う"]
+    assert module._last_idx == 4
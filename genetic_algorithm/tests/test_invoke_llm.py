@@ -0,0 +1,155 @@
+import threading
+import time
+
+import pytest
+
+from Utils import invoke_llm
+from Utils.invoke_llm import (
+    CircuitOpen, LoadShed, Superseded, _CircuitBreaker, _HedgeBudget, _Request, _Scheduler,
+)
+
+CLASSES = {
+    "interactive": {"rank": 0, "max_concurrency": 4, "max_queue": 8},
+    "background":  {"rank": 2, "max_concurrency": 2, "max_queue": 8, "shed_depth": 2, "breaker": True},
+}
+
+
+def _request(prompt, priority="background", **kwargs):
+    return _Request(prompt=prompt, priority=priority, **kwargs)
+
+
+# ---------- 優先度クラス・負荷制限 (user-001) ----------
+def test_higher_priority_class_is_picked_first():
+    scheduler = _Scheduler(CLASSES)
+    background = scheduler.submit(_request("bg"))
+    interactive = scheduler.submit(_request("hi", priority="interactive"))
+    assert scheduler.next() is interactive
+    assert scheduler.next() is background
+
+
+def test_background_is_shed_at_shed_depth():
+    scheduler = _Scheduler(CLASSES)
+    scheduler.submit(_request("a"))
+    scheduler.submit(_request("b"))
+    with pytest.raises(LoadShed):
+        scheduler.submit(_request("c"))
+    # shed_depth の無いクラスは受け付ける
+    scheduler.submit(_request("d", priority="interactive"))
+    assert scheduler.stats()["shed"] == 1
+
+
+# ---------- single-flight・latest-wins (user-005) ----------
+def test_same_key_is_coalesced():
+    scheduler = _Scheduler(CLASSES)
+    first = scheduler.submit(_request("p", key="k"))
+    second = scheduler.submit(_request("p", key="k"))
+    assert second is first
+    assert first.waiters == 2
+    assert scheduler.stats()["background"]["pending"] == 1
+    assert scheduler.stats()["coalesced"] == 1
+
+
+def test_coalesced_interactive_caller_promotes_pending_request():
+    scheduler = _Scheduler(CLASSES)
+    first = scheduler.submit(_request("p", key="k"))
+    scheduler.submit(_request("p", priority="interactive", key="k"))
+    assert first.priority == "interactive"
+    assert scheduler.next() is first
+
+
+def test_latest_wins_supersedes_pending_request_of_same_tag():
+    scheduler = _Scheduler(CLASSES)
+    old = scheduler.submit(_request("old", tag="sociality", latest_wins=True))
+    new = scheduler.submit(_request("new", tag="sociality", latest_wins=True))
+    other = scheduler.submit(_request("other", tag="reward", latest_wins=True))
+
+    assert old.event.is_set()
+    assert isinstance(old.holder["error"], Superseded)
+    assert scheduler.next() is new       # 古い方の順番を引き継ぐ
+    assert scheduler.next() is other
+    assert scheduler.stats()["superseded"] == 1
+
+
+# ---------- ヘッジ予算・サーキットブレーカー (user-010) ----------
+def test_hedge_budget_limits_duplicates():
+    budget = _HedgeBudget(ratio=0.1, burst=1)
+    assert budget.try_spend()            # burst の 1 件
+    assert not budget.try_spend()
+    for _ in range(10):
+        budget.note_call()
+    assert budget.try_spend()            # 10 件 × 0.1 = 1 件ぶん増える
+    assert not budget.try_spend()
+    assert budget.stats()["hedges"] == 2
+
+
+def test_circuit_breaker_transitions():
+    breaker = _CircuitBreaker(failures=2, cooldown=0.05)
+    breaker.record(False)
+    assert breaker.stats()["state"] == "closed"
+    breaker.record(False)
+    assert breaker.stats()["state"] == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.stats()["state"] == "half_open"
+    assert breaker.allow()               # 試しに 1 件だけ通す
+    assert not breaker.allow()
+    breaker.record(False)                # 試した 1 件が失敗 → 再び open
+    assert breaker.stats() == {"state": "open", "consecutive_failures": 3, "opened": 1}
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.stats()["state"] == "closed"
+    assert breaker.allow()
+
+
+def test_open_breaker_rejects_only_breaker_classes(monkeypatch):
+    breaker = _CircuitBreaker(failures=1, cooldown=60)
+    breaker.record(False)
+    monkeypatch.setattr(invoke_llm, "_breaker", breaker)
+    with pytest.raises(CircuitOpen):
+        invoke_llm._admit("background", "test")
+    invoke_llm._admit("interactive", "test")
+
+
+# ---------- FakeBackend を通した呼び出し ----------
+@pytest.fixture
+def fake_worker(monkeypatch):
+    """FakeBackend（シード固定）で応答するワーカーを 1 本だけ、新しいスケジューラ・ブレーカーで動かす"""
+    from Utils import llm_backend, rate_limiter
+
+    def start(**fake_config):
+        backend = llm_backend.FakeBackend({"seed": 0, "latency_median": 0.001, "latency_sigma": 0.0, **fake_config})
+        monkeypatch.setattr(llm_backend, "_backend", backend)
+        monkeypatch.setattr(rate_limiter, "_limiters", {"bedrock": rate_limiter.AdaptiveRateLimiter("bedrock", max_concurrency=2)})
+        monkeypatch.setattr(invoke_llm, "_scheduler", _Scheduler(invoke_llm.PRIORITY_CLASSES))
+        monkeypatch.setattr(invoke_llm, "_breaker", _CircuitBreaker(failures=2, cooldown=60))
+        threading.Thread(target=invoke_llm._llm_worker, daemon=True).start()
+        return backend
+
+    return start
+
+
+def test_failures_open_the_breaker_for_background_calls(fake_worker):
+    from botocore.exceptions import ClientError
+
+    fake_worker(error_rate=1.0)
+    for _ in range(2):
+        with pytest.raises(ClientError):
+            invoke_llm.get_claude_response("採点して", timeout=5, tag="test")
+    with pytest.raises(CircuitOpen):
+        invoke_llm.get_claude_response("採点して", timeout=5, tag="test")
+    # interactive はブレーカーに関係なく送る
+    with pytest.raises(ClientError):
+        invoke_llm.get_claude_response("話して", timeout=5, priority="interactive", tag="test")
+
+
+def test_hedged_call_checks_deadline_before_cache(fake_worker):
+    from Utils.deadline import DeadlineExceeded, deadline_scope
+
+    fake_worker()
+    assert invoke_llm.get_claude_response("覚えて", timeout=5, cache_ttl=60, tag="test")
+    for hedge in (False, True):
+        with deadline_scope(0.0), pytest.raises(DeadlineExceeded):
+            invoke_llm.get_claude_response("覚えて", timeout=5, cache_ttl=60, tag="test", hedge=hedge)
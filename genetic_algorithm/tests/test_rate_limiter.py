@@ -0,0 +1,29 @@
+from Utils import rate_limiter
+from Utils.rate_limiter import AdaptiveRateLimiter, get_limiter
+
+
+def test_slow_responses_shrink_concurrency():
+    limiter = AdaptiveRateLimiter("slow", max_concurrency=8, target_latency=0.5)
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(latency=2.0)
+    assert limiter.limit < 8
+    assert limiter.throttles == 0
+
+
+def test_fast_responses_keep_concurrency():
+    limiter = AdaptiveRateLimiter("fast", max_concurrency=8, target_latency=0.5)
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(latency=0.1)
+    assert limiter.limit == 8
+
+
+def test_get_limiter_reads_target_latency(monkeypatch):
+    monkeypatch.setenv("LLM_TARGET_LATENCY", "3.5")
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    assert get_limiter("env-test").target_latency == 3.5
+
+    monkeypatch.delenv("LLM_TARGET_LATENCY")
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    assert get_limiter("env-test").target_latency is None
@@ -15,7 +15,7 @@ def load_config():
 
 setup_info = load_config()
 
-API_URL = setup_info['API_URL']
+API_URL = os.getenv('LLM_API_URL', setup_info['API_URL'])  # スタンドインサーバに向ける時は環境変数で上書き
 
 if __name__ == "__main__":
     print(setup_info)
\ No newline at end of file
@@ -3,7 +3,11 @@ import conversation_orchestrator.boyfriend as bf
 from utils.get_llm_result import invoke_llm
 from utils.response_checker import resulf_judge
 
-def orchestrator(gf_system_prompt, conversation_num):
+def orchestrator(gf_system_prompt, conversation_num, full_conversation=False):
+    """
+    :param full_conversation: True なら conversation_num 往復してから返す。
+        False（既定）は従来どおり 1 往復目で返す（conversation_num 往復にすると会話の LLM 呼び出しが conversation_num 倍になる）
+    """
     if gf_system_prompt == "":
         return "Error: put target system prompt"
 
@@ -32,7 +36,10 @@ def orchestrator(gf_system_prompt, conversation_num):
                 try_num += 1
         print(f'final girlfriend response: {girlfriend_response}')
         conversation_history.append({"role": "user", "content": girlfriend_response})
-        return conversation_history
+        if not full_conversation:
+            return conversation_history
+
+    return conversation_history
 
     
 if __name__ == "__main__":
@@ -1,12 +1,70 @@
 import logging
+import math
+import os
 import time
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from conversation_orchestrator.orchestrator import orchestrator
-from utils.get_llm_result import invoke_llm
+from utils.get_llm_result import invoke_llm_structured
 from modul_types import Population, EvolutionUnit
+from utils.fitness_cache import fitness_key, get_fitness_cache
+from utils.generation_executor import get_generation_executor
 
 logger = logging.getLogger(__name__)
 
+RUBRIC_ITEMS = [
+    "感情の表出",
+    "感情の流動的表現",
+    "ユーモア・遊び心",
+    "愛や親しみ・可愛らしさ・ポジティブな感情の含意",
+    "共感と同意",
+    "問題を考え・提案する",
+    "関心と会話",
+]
+# 採点プロンプトや基準を変えたら上げる（適応度キャッシュのキーに入る）
+RUBRIC_VERSION = "1"
+RUBRIC_SCHEMA = {
+    "type": "object",
+    "required": RUBRIC_ITEMS,
+    "properties": {item: {"type": "number", "minimum": 0, "maximum": 10} for item in RUBRIC_ITEMS},
+}
+
+# レーシング評価（successive halving）: GA_RACING=1 または main.py --racing で有効
+#   全ユニットを短い会話（RACING_MIN_TURNS ターン）・採点 1 回で評価し、上位 1/RACING_ETA だけが
+#   RACING_ETA 倍の長さの会話と RACING_JUDGE_SAMPLES 回の採点に進む。最後の 1 体は num_evals ターン
+RACING_ETA = int(os.getenv("RACING_ETA", "2"))
+RACING_MIN_TURNS = int(os.getenv("RACING_MIN_TURNS", "1"))
+RACING_JUDGE_SAMPLES = int(os.getenv("RACING_JUDGE_SAMPLES", "2"))
+
+
+def racing_enabled() -> bool:
+    return os.getenv("GA_RACING", "0") == "1"
+
+
+def full_conversation_enabled() -> bool:
+    """ 会話を num_evals 往復まで続けて採点するか（GA_FULL_CONVERSATION=1 または main.py --full-conversation）。
+
+    既定では従来どおり 1 往復の会話を採点する。num_evals 往復にすると 1 ユニットの評価にかかる
+    会話の LLM 呼び出しが num_evals 倍になる。レーシング評価は段ごとに会話の長さを変えるので常に有効
+    """
+    return os.getenv("GA_FULL_CONVERSATION", "0") == "1" or racing_enabled()
+
+
+def racing_schedule(num_units: int, num_evals: int) -> List[Tuple[int, int, int]]:
+    """ Successive-halving rungs as (survivors, conversation turns, judge samples).
+
+    e.g. 4 units, num_evals=5 -> [(4, 1, 1), (2, 2, 2), (1, 5, 2)]
+    """
+    eta = max(2, RACING_ETA)
+    n, turns, samples = num_units, max(1, min(RACING_MIN_TURNS, num_evals)), 1
+    rungs = [(n, turns, samples)]
+    while n > 1 and turns < num_evals:
+        n = max(1, math.ceil(n / eta))
+        turns = num_evals if n == 1 else min(num_evals, turns * eta)
+        samples = RACING_JUDGE_SAMPLES
+        rungs.append((n, turns, samples))
+    return rungs
+
+
 def evaluate_population(population: Population, num_evals: int) -> Population:
     """ Evaluates the effectiveness of each system prompt by running a conversation test and scoring it.
 
@@ -25,31 +83,95 @@ def evaluate_population(population: Population, num_evals: int) -> Population:
     for unit in population.units:
         unit.fitness = 0 
 
+    if racing_enabled():
+        # 最後の段まで残ったユニットの中からエリートを選ぶ
+        candidates = evaluate_population_racing(population, num_evals)
+    else:
+        # ユニットごとの会話 + 採点を並列に実行（結果はユニット順）
+        fitnesses = get_generation_executor().map(
+            lambda unit: evaluate_unit(unit, num_evals), population.units, label="evaluate"
+        )
+        for unit, fitness in zip(population.units, fitnesses):
+            unit.fitness = fitness
+        candidates = population.units
+
+    for unit in candidates:
+        # エリート（最も適応度の高い個体）を更新
+        if unit.fitness > elite_fitness:
+            current_elite = unit.model_copy()
+            elite_fitness = unit.fitness
 
-        conversation_history = orchestrator(unit.P, num_evals)
 
+    population.elites.append(current_elite)
+    end_time = time.time()
+    logger.info(f"Done fitness evaluation. {end_time - start_time}s (fitness cache: {get_fitness_cache().stats()})")
 
-        evaluation_scores = evaluate_conversation(conversation_history)
+    return population
 
+def evaluate_population_racing(population: Population, num_evals: int) -> List[EvolutionUnit]:
+    """ Scores units with successive halving: cheap short conversations for everyone,
+    longer conversations and more judge samples only for the top fraction.
 
-        if not evaluation_scores or not isinstance(evaluation_scores, dict):
-            logger.error(f"Invalid evaluation scores: {evaluation_scores}, setting default values.")
-            evaluation_scores = {"親密度": 0, "一貫性": 0, "感情表現": 0}
+    Each unit keeps the fitness from the last rung it reached.
 
+    Returns:
+        List[EvolutionUnit]: The units that survived to the last rung.
+    """
+    survivors = list(population.units)
+    turns_used = 0
+    for n, turns, samples in racing_schedule(len(population.units), num_evals):
+        # 適応度の高い順に上位 n 体だけ次の段へ（同点はユニット順）
+        survivors = sorted(survivors, key=lambda unit: -unit.fitness)[:n]
+        fitnesses = get_generation_executor().map(
+            lambda unit: evaluate_unit(unit, turns, samples), survivors, label=f"race{turns}"
+        )
+        for unit, fitness in zip(survivors, fitnesses):
+            unit.fitness = fitness
+        turns_used += n * turns
+        logger.info(f"🏁 racing: {n} units x {turns} turns x {samples} judges")
+
+    logger.info(f"🏁 racing: {turns_used} turns (full evaluation: {len(population.units) * num_evals})")
+    return survivors
+
+def evaluate_unit(unit: EvolutionUnit, num_evals: int, judge_samples: int = 1) -> float:
+    """ Runs a conversation test for a single unit and returns its fitness.
+
+    Units whose P was already scored under the same evaluation config reuse the
+    cached fitness (see utils/fitness_cache.py).
 
-        unit.fitness = sum(evaluation_scores.values())
+    Args:
+        unit (EvolutionUnit): The unit to evaluate. It is not modified.
+        num_evals (int): Number of evaluation examples.
+        judge_samples (int): Number of rubric judgements averaged over the same conversation.
 
-        # エリート（最も適応度の高い個体）を更新
-        if unit.fitness > elite_fitness:
-            current_elite = unit.model_copy()
-            elite_fitness = unit.fitness
+    Returns:
+        float: Sum of the rubric scores.
+    """
+    # P が前回から変わっていなければ採点を使い回す（1 往復と num_evals 往復の採点は混ぜない）
+    full_conversation = full_conversation_enabled()
+    cache = get_fitness_cache()
+    rubric = f"{RUBRIC_VERSION}x{judge_samples}" + ("-full" if full_conversation else "")
+    key = fitness_key(unit.P, num_evals, rubric)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    conversation_history = orchestrator(unit.P, num_evals, full_conversation=full_conversation)
+
+    fitnesses = []
+    for _ in range(judge_samples):
+        evaluation_scores = evaluate_conversation(conversation_history)
 
+        # 採点に失敗したとき（既定値の 0 点）は平均にもキャッシュにも入れない
+        if not evaluation_scores or not isinstance(evaluation_scores, dict) or set(evaluation_scores) != set(RUBRIC_ITEMS):
+            logger.error(f"Invalid evaluation scores: {evaluation_scores}, setting default values.")
+            continue
 
-    population.elites.append(current_elite)
-    end_time = time.time()
-    logger.info(f"Done fitness evaluation. {end_time - start_time}s")
+        fitnesses.append(sum(evaluation_scores.values()))
 
-    return population
+    if not fitnesses:
+        return 0
+    return cache.add(key, sum(fitnesses) / len(fitnesses))
 
 def evaluate_conversation(conversation_history: List[Dict[str, str]]) -> Dict[str, float]:
     """ Evaluates the generated conversation using LLM based on predefined criteria.
@@ -116,11 +238,10 @@ def evaluate_conversation(conversation_history: List[Dict[str, str]]) -> Dict[st
     }}
     """
     
-    llm_response = invoke_llm(evaluation_prompt)
-    
     try:
-        evaluation_scores = eval(llm_response)  # 例: {"親密度": 8, "一貫性": 9, "感情表現": 7}
+        # 採点は小さいモデルで。読めなければローカルで修復し、それでもだめなら大きいモデルで 1 度だけ聞き直す
+        evaluation_scores = invoke_llm_structured(evaluation_prompt, RUBRIC_SCHEMA, route="rubric", instruct=False)  # 例: {"感情の表出": 8, "共感と同意": 9, ...}
         return evaluation_scores
     except Exception as e:
-        logger.error(f"Failed to parse LLM evaluation response: {llm_response}. Error: {e}")
+        logger.error(f"Failed to parse LLM evaluation response. Error: {e}")
         return {"親密度": 0, "一貫性": 0, "感情表現": 0}  
@@ -0,0 +1,190 @@
+"""
+アイランドモデル（複数プロセスで別々の集団を進化させ、定期的にエリートを交換する）
+
+- 各島は別プロセスで、自分の乱数シードで mutation_prompts から mutator_set を選んで進化する
+- migrate_every 世代ごとに、上位 migrants 体を共有ディレクトリに書き出し（リング状に右隣へ送る）、
+  左隣の島が書いたものを読んで自分の下位ユニットと入れ替える
+- LLM の送出枠（LLM_RPM / LLM_TPM / LLM_MAX_CONCURRENCY）は同じアカウントを使う全島で山分けし、
+  各島のプロセスには 1/K ずつ渡す（各島のリミッタが全量を使うと、合計で K 倍送ってしまう）
+- 移住の受け渡しはファイルだけなので、--migration-dir を NFS などの共有ディレクトリにすれば
+  複数のマシンで島を分担できる（各マシンで --island-ids に自分の担当を指定する）
+
+    python main.py --islands 8 --migrate-every 2 --migration-dir runs/islands
+    # 2 台で分担する場合
+    python main.py --islands 8 --island-ids 0-3 --migration-dir /shared/islands   # マシン A
+    python main.py --islands 8 --island-ids 4-7 --migration-dir /shared/islands   # マシン B
+
+単独の島は `python island.py --config <dir>/config.json --island-id 3` でも起動できる
+（この場合は LLM_RPM などを自分で 1/K にして渡す）。
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import List
+
+from rich import print
+from modul_types import EvolutionUnit, Population
+from mutation_prompts import mutation_prompts
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_TIMEOUT = float(os.getenv("MIGRATION_TIMEOUT", "600"))
+
+
+def parse_island_ids(spec: str | None, num_islands: int) -> List[int]:
+    """ "0-3,6" のような指定を島番号のリストにする（None なら全島）"""
+    if not spec:
+        return list(range(num_islands))
+    ids = []
+    for part in spec.split(","):
+        lo, _, hi = part.partition("-")
+        ids.extend(range(int(lo), int(hi or lo) + 1))
+    return [i for i in ids if 0 <= i < num_islands]
+
+
+def _write_json(path: str, data) -> None:
+    """読み手が書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える"""
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _migration_path(migration_dir: str, epoch: int, island_id: int) -> str:
+    return os.path.join(migration_dir, f"epoch{epoch:04d}-island{island_id:03d}.json")
+
+
+def migrate(population: Population, island_id: int, num_islands: int, epoch: int,
+            migration_dir: str, migrants: int = 1, timeout: float = MIGRATION_TIMEOUT) -> Population:
+    """ Sends the best units to the right-hand neighbour and replaces the worst units
+    with the ones sent by the left-hand neighbour.
+
+    If the neighbour has not written its migrants within `timeout` seconds, the island
+    carries on without immigrants.
+    """
+    best = sorted(population.units, key=lambda unit: -unit.fitness)[:migrants]
+    _write_json(_migration_path(migration_dir, epoch, island_id), [unit.model_dump() for unit in best])
+
+    source = (island_id - 1) % num_islands
+    path = _migration_path(migration_dir, epoch, source)
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() >= deadline:
+            logger.warning(f"Island {island_id}: no migrants from island {source} for epoch {epoch}, skipping.")
+            return population
+        time.sleep(1)
+
+    with open(path, "r", encoding="utf-8") as f:
+        immigrants = [EvolutionUnit(**d) for d in json.load(f)]
+
+    # 下位のユニットを移住者で置き換える
+    worst = sorted(range(len(population.units)), key=lambda i: population.units[i].fitness)
+    for i, unit in zip(worst, immigrants):
+        print(f"🛶 island {island_id}: unit {i} ({population.units[i].fitness}) <- island {source} ({unit.fitness})")
+        population.units[i] = unit
+    return population
+
+
+def run_island(config: dict, island_id: int) -> Population:
+    """ Evolves one island: its own mutator_set, `generations` generations,
+    migrating every `migrate_every` generations.
+
+    The final population is written to `<migration_dir>/island{id}-final.json`.
+    """
+    from population import create_population, init_run, run_for_n, run_steady_state
+
+    seed = config.get("seed")
+    random.seed(None if seed is None else seed * 1000 + island_id)
+
+    num_prompts = min(config["num_prompts"], len(mutation_prompts))
+    mutator_set = random.sample(mutation_prompts, num_prompts)
+    logger.info(f"Island {island_id}: mutator_set={mutator_set}")
+
+    p = create_population(mutator_set=mutator_set, problem_description=config["problem"])
+    init_run(p, config["num_evals"])
+    for gen in range(config["generations"]):
+        if config.get("steady_state"):
+            # 1 世代 = size // 2 ステップ（main.py と同じ換算）。移住は世代の区切りで行う
+            run_steady_state(steps=max(1, len(p.units) // 2), population=p,
+                             num_evals=config["num_evals"], workers=config.get("workers"))
+        else:
+            run_for_n(n=1, population=p, num_evals=config["num_evals"])
+        if config["num_islands"] > 1 and (gen + 1) % config["migrate_every"] == 0:
+            migrate(p, island_id, config["num_islands"], (gen + 1) // config["migrate_every"],
+                    config["migration_dir"], config["migrants"])
+
+    _write_json(os.path.join(config["migration_dir"], f"island{island_id:03d}-final.json"), p.model_dump())
+    return p
+
+
+def island_env(num_islands: int) -> dict:
+    """ 子プロセスの環境変数。LLM の送出枠を num_islands 等分する """
+    env = dict(os.environ)
+    for name, default in (("LLM_RPM", "50"), ("LLM_TPM", "200000"), ("LLM_MAX_CONCURRENCY", "8")):
+        env[name] = str(max(1, int(os.getenv(name, default)) // num_islands))
+    return env
+
+
+def run_islands(config: dict, island_ids: List[int]) -> List[EvolutionUnit]:
+    """ Starts one process per island in `island_ids` and waits for them.
+
+    Each island logs to `<migration_dir>/island{id}.log` and gets 1/num_islands of the
+    LLM rate budget (see `island_env`).
+
+    Returns:
+        List[EvolutionUnit]: The best unit of each finished island (including islands run elsewhere).
+    """
+    migration_dir = config["migration_dir"]
+    os.makedirs(migration_dir, exist_ok=True)
+    config_path = os.path.join(migration_dir, "config.json")
+    _write_json(config_path, config)
+
+    # 前回の実行で担当の島が書いた移住ファイルが残っていると、それを読んでしまう
+    for name in os.listdir(migration_dir):
+        if any(name.endswith(f"island{i:03d}.json") or name == f"island{i:03d}-final.json" for i in island_ids):
+            os.remove(os.path.join(migration_dir, name))
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = island_env(config["num_islands"])
+    logger.info(f"Rate budget per island: RPM={env['LLM_RPM']} TPM={env['LLM_TPM']} concurrency={env['LLM_MAX_CONCURRENCY']}")
+    procs = []
+    for island_id in island_ids:
+        log = open(os.path.join(migration_dir, f"island{island_id:03d}.log"), "w", encoding="utf-8")
+        cmd = [sys.executable, "-u", os.path.join(here, "island.py"), "--config", config_path, "--island-id", str(island_id)]
+        procs.append((island_id, subprocess.Popen(cmd, cwd=here, env=env, stdout=log, stderr=subprocess.STDOUT), log))
+        logger.info(f"Island {island_id} started (log: {log.name})")
+
+    for island_id, proc, log in procs:
+        code = proc.wait()
+        log.close()
+        if code != 0:
+            logger.error(f"Island {island_id} exited with code {code}")
+
+    best = []
+    for island_id in range(config["num_islands"]):
+        path = os.path.join(migration_dir, f"island{island_id:03d}-final.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                units = Population(**json.load(f)).units
+            best.append(max(units, key=lambda unit: unit.fitness))
+    return best
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Run one island of the island-model Girlfriend Breeder.')
+    parser.add_argument('--config', required=True)     #run_islands が書き出した config.json
+    parser.add_argument('--island-id', type=int, required=True)
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        run_island(json.load(f), args.island_id)
@@ -1,5 +1,6 @@
-from population import create_population, init_run, run_for_n
+from population import create_population, init_run, run_for_n, run_steady_state
 from mutation_prompts import mutation_prompts
+from island import parse_island_ids, run_islands
 import os
 import logging
 import argparse
@@ -19,6 +20,16 @@ parser = argparse.ArgumentParser(description='Run the Girlfriend Breeder Algorit
 parser.add_argument('-mp', '--num_mutation_prompts', default=4)     #進化させるセットの数
 parser.add_argument('-e', '--num_evals', default=5)     #会話する応答のラリー数
 parser.add_argument('-n', '--simulations', default=10)     #世代数
+parser.add_argument('--steady-state', action='store_true')     #世代の区切りなしで進化させる（1 世代 = mp // 2 ステップ）
+parser.add_argument('--workers', type=int, default=None)     #steady-state の同時実行数
+parser.add_argument('--racing', action='store_true')     #短い会話で足切りし、上位だけ長い会話で評価する（successive halving）
+parser.add_argument('--full-conversation', action='store_true')     #num_evals 往復の会話を採点する（既定は 1 往復。会話の LLM 呼び出しが num_evals 倍になる）
+parser.add_argument('--islands', type=int, default=1)     #アイランドモデルの島の数（2 以上で島ごとに別プロセス）
+parser.add_argument('--island-ids', default=None)     #このマシンで動かす島（例 0-3。省略時は全島）
+parser.add_argument('--migrate-every', type=int, default=2)     #何世代ごとにエリートを交換するか
+parser.add_argument('--migrants', type=int, default=1)     #1 回の移住で送るユニット数
+parser.add_argument('--migration-dir', default='data/islands')     #移住ファイルの置き場（複数マシンなら共有ディレクトリ）
+parser.add_argument('--seed', type=int, default=None)     #乱数シード（LLM_REPLAY_MODE で記録・再生するときは同じ値にする）
 parser.add_argument('-p', '--problem', default=
                     """
                         + "Assistant: 発話者と親密な女性として、次のルールで回答してください：\n"
@@ -38,6 +49,33 @@ parser.add_argument('-p', '--problem', default=
                         "(例) 浮かれてばっかりいないで、ちゃんと確認しなさいよね！\n"
                     """)       
 args = vars(parser.parse_args())
+if args['racing']:
+    os.environ['GA_RACING'] = '1'
+if args['full_conversation']:
+    os.environ['GA_FULL_CONVERSATION'] = '1'
+if args['seed'] is not None:
+    random.seed(args['seed'])
+
+if args['islands'] > 1:
+    # 島ごとに別プロセスで mutator_set を選んで進化させる（island.py）
+    config = {
+        'num_islands': args['islands'],
+        'num_prompts': int(args['num_mutation_prompts']),
+        'problem': args['problem'],
+        'num_evals': int(args['num_evals']),
+        'generations': int(args['simulations']),
+        'migrate_every': max(1, args['migrate_every']),
+        'migrants': args['migrants'],
+        'migration_dir': os.path.abspath(args['migration_dir']),
+        'seed': args['seed'],
+        'steady_state': args['steady_state'],
+        'workers': args['workers'],
+    }
+    best = run_islands(config, parse_island_ids(args['island_ids'], args['islands']))
+    print("%"*80)
+    print("done processing! best unit of each island:")
+    print(sorted(best, key=lambda unit: -unit.fitness))
+    raise SystemExit(0)
 
 # 変更: mutation_promptsからランダムに2つ選択
 num_prompts = int(args['num_mutation_prompts'])
@@ -55,7 +93,11 @@ p = create_population(mutator_set=mutator_set, problem_description=args['problem
 logger.info(f'Generating the initial prompts...')
 init_run(p, int(args['num_evals']))
 logger.info(f'Starting the genetic algorithm...')
-run_for_n(n=int(args['simulations']), population=p, num_evals=int(args['num_evals']))
+if args['steady_state']:
+    steps = int(args['simulations']) * max(1, len(p.units) // 2)
+    run_steady_state(steps=steps, population=p, num_evals=int(args['num_evals']), workers=args['workers'])
+else:
+    run_for_n(n=int(args['simulations']), population=p, num_evals=int(args['num_evals']))
 print("%"*80)
 print("done processing! final gen:")
 print(p.units)
\ No newline at end of file
@@ -1,9 +1,10 @@
 import random
 import json
 import logging
-from typing import List
+from typing import List, NamedTuple
 from modul_types import Population, EvolutionUnit
-from utils.get_llm_result import get_llm_resut, invoke_llm
+from utils.get_llm_result import get_llm_resut, invoke_llm_many, run_many
+from utils.generation_executor import get_generation_executor
 from utils.response_checker import resulf_judge
 
 logger = logging.getLogger(__name__)
@@ -27,35 +28,24 @@ def load_ideal_conversation_examples(filepath: str = "../data/ideal_conversation
 
 ideal_conversations = load_ideal_conversation_examples()
 
-# **0次超変異（Mutation Prompt のみを変異）**
-def zero_order_hypermutation(unit: EvolutionUnit, **kwargs) -> EvolutionUnit:
-    """ Mutates the existing mutation prompt (M) using LLM.
+MAX_RETRY = 5  # 判定で不適切とされたときの再生成回数
 
-    Returns:
-        EvolutionUnit: The evolution unit with a new mutation prompt.
-    """
-    mutation_prompt = f"""
+# **各変異オペレーターが LLM に渡す指示文**
+def _zero_order_prompt(unit: EvolutionUnit, **kwargs) -> str:
+    return f"""
     現在システムプロンプトに少し変化を加えるためのMutation Promptと言うものを作成しています。
     こちらにMutation Promptの例を提示するのでこれを参考にして改善してください: {unit.M}
     なお説明や理由などは一切不要です。新しいプロンプトのみを出力してください。
     """
-    unit.M = invoke_llm(mutation_prompt)
-    return unit
 
-# **理想の会話例を元にプロンプト (`P`) を改良**
-def working_out_task_prompt(unit: EvolutionUnit, **kwargs) -> EvolutionUnit:
-    """ Uses an ideal conversation example to refine the task prompt.
-
-    Returns:
-        EvolutionUnit: The evolution unit with an improved prompt.
-    """
+def _working_out_prompt(unit: EvolutionUnit, **kwargs) -> str | None:
     if not ideal_conversations:
         logger.warning("No ideal conversation examples available. Skipping mutation.")
-        return unit
+        return None
 
     example = random.choice(ideal_conversations)
 
-    refinement_prompt = f"""
+    return f"""
     以下の会話例を参考にして、このような会話を行うためのシステムプロンプトを生成してください。
 
     [理想の会話例]
@@ -63,21 +53,71 @@ def working_out_task_prompt(unit: EvolutionUnit, **kwargs) -> EvolutionUnit:
 
     なお説明や理由などは一切不要です。新しいプロンプトのみを出力してください。
     """
-    print(f"変異元プロンプト: {unit.P}")
-
-    try_num = 0
-    max_retry = 5
-    
-    while try_num <= max_retry:
-        unit.P = invoke_llm(refinement_prompt)
-        result = resulf_judge(unit.P)
-        if result and result == "True":
+
+def _first_order_prompt(unit: EvolutionUnit, **kwargs) -> str:
+    return unit.M + " " + unit.P + "なお説明や理由などは一切不要です。新しいプロンプトのみを出力してください。"
+
+def _lineage_prompt(unit: EvolutionUnit, elites: List[EvolutionUnit], **kwargs) -> str:
+    HEADING = """以下は品質の良い順に並んだシステムプロンプトです。これを参考にして新たなプロンプトを作成してください。 \n 
+    なお説明や理由などは一切不要です。新しいプロンプトのみを出力してください。"""
+    ITEMS = "\n".join(["{}. {}".format(i+1, x.P) for i, x in enumerate(elites)])
+    return HEADING + ITEMS
+
+
+class MutationJob(NamedTuple):
+    unit: EvolutionUnit
+    prompt: str
+    field: str      # 書き換える属性（"P" か "M"）
+    judged: bool    # resulf_judge が True を返すまで再生成するか
+
+
+def apply_mutations(jobs: List[MutationJob]) -> None:
+    """
+    変異の LLM 呼び出しをユニットをまたいでまとめて並列に投げる。
+    判定で不適切とされたものだけを、最大 MAX_RETRY 回まで次の回でまとめて再生成する。
+    """
+    for job in jobs:
+        if job.field == "P":
+            print(f"変異元プロンプト: {job.unit.P}")
+
+    pending = list(jobs)
+    for _ in range(MAX_RETRY + 1):
+        if not pending:
             break
-        else:
-            try_num += 1
+        for job, result in zip(pending, invoke_llm_many([job.prompt for job in pending])):
+            if result.error is not None:
+                logger.error(f"Mutation failed: {result.error}")
+            setattr(job.unit, job.field, result.text)
+
+        judged = [job for job in pending if job.judged]
+        verdicts = run_many(resulf_judge, [job.unit.P for job in judged])
+        pending = [job for job, verdict in zip(judged, verdicts) if verdict.text != "True"]
+
+    for job in jobs:
+        if job.field == "P":
+            print(f'変異後プロンプト: {job.unit.P}')
 
-    print(f'変異後プロンプト: {unit.P}')
 
+# **0次超変異（Mutation Prompt のみを変異）**
+def zero_order_hypermutation(unit: EvolutionUnit, **kwargs) -> EvolutionUnit:
+    """ Mutates the existing mutation prompt (M) using LLM.
+
+    Returns:
+        EvolutionUnit: The evolution unit with a new mutation prompt.
+    """
+    apply_mutations([MutationJob(unit, _zero_order_prompt(unit), "M", judged=False)])
+    return unit
+
+# **理想の会話例を元にプロンプト (`P`) を改良**
+def working_out_task_prompt(unit: EvolutionUnit, **kwargs) -> EvolutionUnit:
+    """ Uses an ideal conversation example to refine the task prompt.
+
+    Returns:
+        EvolutionUnit: The evolution unit with an improved prompt.
+    """
+    refinement_prompt = _working_out_prompt(unit)
+    if refinement_prompt is not None:
+        apply_mutations([MutationJob(unit, refinement_prompt, "P", judged=True)])
     return unit
 
 # **1次変異（Mutation Prompt を適用）**
@@ -87,20 +127,7 @@ def first_order_prompt_gen(unit: EvolutionUnit, **kwargs) -> EvolutionUnit:
     Returns:
         EvolutionUnit: the evolution unit to replace the loser unit.
     """
-    try_num = 0
-    max_retry = 5
-    print(f"変異元プロンプト: {unit.P}")
-    
-    while try_num <= max_retry:
-        unit.P = invoke_llm(unit.M + " " + unit.P + "なお説明や理由などは一切不要です。新しいプロンプトのみを出力してください。")
-        result = resulf_judge(unit.P)
-        if result and result == "True":
-            break
-        else:
-            try_num += 1
-
-    print(f'変異後プロンプト: {unit.P}')
-
+    apply_mutations([MutationJob(unit, _first_order_prompt(unit), "P", judged=True)])
     return unit
 
 # **系統変異（エリートの履歴を活用）**
@@ -110,24 +137,7 @@ def lineage_based_mutation(unit: EvolutionUnit, elites: List[EvolutionUnit], **k
     Returns:
         EvolutionUnit: the evolution unit to replace the loser unit.
     """
-    HEADING = """以下は品質の良い順に並んだシステムプロンプトです。これを参考にして新たなプロンプトを作成してください。 \n 
-    なお説明や理由などは一切不要です。新しいプロンプトのみを出力してください。"""
-    ITEMS = "\n".join(["{}. {}".format(i+1, x.P) for i, x in enumerate(elites)])
-
-
-    try_num = 0
-    max_retry = 5
-    print(f"変異元プロンプト: {unit.P}")
-    while try_num <= max_retry:
-        unit.P = invoke_llm(HEADING + ITEMS)
-        result = resulf_judge(unit.P)
-        if result and result == "True":
-            break
-        else:
-            try_num += 1
-
-    print(f'変異後プロンプト: {unit.P}')
-    
+    apply_mutations([MutationJob(unit, _lineage_prompt(unit, elites), "P", judged=True)])
     return unit
 
 def prompt_crossover(unit1: EvolutionUnit, unit2: EvolutionUnit) -> EvolutionUnit:
@@ -182,6 +192,14 @@ MUTATORS = [
     working_out_task_prompt
 ]
 
+# mutate でまとめて投げるときの (指示文, 書き換える属性, 判定するか)
+MUTATION_SPECS = {
+    first_order_prompt_gen: (_first_order_prompt, "P", True),
+    lineage_based_mutation: (_lineage_prompt, "P", True),
+    zero_order_hypermutation: (_zero_order_prompt, "M", False),
+    working_out_task_prompt: (_working_out_prompt, "P", True),
+}
+
 POST_MUTATORS = [
     prompt_crossover,
     context_shuffling
@@ -194,6 +212,7 @@ def mutate(population: Population) -> Population:
     indices = [i for i in range(len(population.units))]
     random.shuffle(indices)
     pairs = [indices[2*x:2*x+2] for x in range(len(indices) // 2)]
+    jobs = []
 
     for i in range(len(pairs)):
         first_unit = population.units[pairs[i][0]]
@@ -210,6 +229,12 @@ def mutate(population: Population) -> Population:
         random_mutator = random.sample(MUTATORS, 1)[0]
         print(f"MUTATING: {mutation_input} with {random_mutator.__name__}")
 
-        random_mutator(**data)
+        build_prompt, field, judged = MUTATION_SPECS[random_mutator]
+        prompt = build_prompt(**data)
+        if prompt is not None:
+            jobs.append(MutationJob(mutation_input, prompt, field, judged))
+
+    # ペアごとに生成 → 判定 → 再生成を並列に進める（待ち時間は一番遅いペアで決まる）
+    get_generation_executor().map(lambda job: apply_mutations([job]), jobs, label="mutate")
 
     return population
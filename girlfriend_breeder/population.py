@@ -1,14 +1,17 @@
 import logging
+import random
+import threading
 import time
 from typing import List
 
 from rich import print
 from conversation_orchestrator.orchestrator import orchestrator 
-from utils.get_llm_result import get_llm_resut, invoke_llm  
+from utils.get_llm_result import get_llm_resut, invoke_llm, invoke_llm_many
 from evaluation import evaluate_conversation  
 from modul_types import EvolutionUnit, Population  
-from mutation_operators import mutate 
-from evaluation import evaluate_population
+from mutation_operators import MUTATION_SPECS, MUTATORS, MutationJob, apply_mutations, mutate
+from evaluation import evaluate_population, evaluate_unit
+from utils.generation_executor import get_generation_executor
 
 logger = logging.getLogger(__name__)
 
@@ -40,27 +43,25 @@ def create_population(mutator_set: List[str], problem_description: str) -> Popul
 
 
 def init_run(population: Population, num_evals: int):
-    """AWS Bedrock API を使い、`invoke_llm()` で逐次的にプロンプトを生成"""
+    """AWS Bedrock API を使い、`invoke_llm_many()` で全ユニットのプロンプトを並列に生成"""
     start_time = time.time()
 
-    for i, unit in enumerate(population.units):    
+    templates = []
+    for i, unit in enumerate(population.units):
         # プロンプトのテンプレートを作成
         template = f"""現在システムプロンプトに少し変化を加えるためのMutation Promptと言うものを用意しました。次のMutation Promptに従ってシステムプロンプトを修正してください。なお説明や理由などは一切不要です。新しいプロンプトのみを出力してください。
         Mutation Prompt: {unit.M} 
         システムプロンプト: {population.problem_description}
         """
         logger.info(f"Processing {i+1}/{len(population.units)}: {template}")
+        templates.append(template)
 
-        # `invoke_llm()` を使ってプロンプトを生成
-        prompt_result = invoke_llm(template)
-
+    # 送出ペースは共有リミッタが調整するので、ユニット間の sleep は不要
+    for unit, result in zip(population.units, invoke_llm_many(templates)):
         # エラー発生時は空文字をセット
-        if prompt_result is None:
-            prompt_result = ""
-
-        unit.P = prompt_result
-
-        time.sleep(1)
+        if result.error is not None:
+            logger.error(f"Prompt initialization failed: {result.error}")
+        unit.P = result.text or ""
 
     end_time = time.time()
     logger.info(f"Prompt initialization done. {end_time - start_time}s")
@@ -122,3 +123,81 @@ def run_for_n(n: int, population: Population, num_evals: int):
 
     return p
 
+
+def run_steady_state(steps: int, population: Population, num_evals: int, workers: int = None):
+    """ Runs the genetic algorithm without generation barriers.
+
+    Each worker repeatedly picks a random pair from the units nobody is working on,
+    mutates a copy of the loser, evaluates it and puts it back in the loser's slot.
+    Elites are updated as soon as a child beats the best fitness so far.
+
+    Args:
+        steps (int): Total number of mutate + evaluate steps (one generation of
+            `run_for_n` corresponds to `population.size // 2` steps).
+        population (Population): The evolving population (already evaluated by `init_run`).
+        num_evals (int): Number of evaluations per step.
+        workers (int): Number of concurrent workers. At least two units must stay idle
+            so that a pair can always be drawn, so it is capped at `size - 2` (minimum 1).
+
+    Returns:
+        Population: The evolved population.
+    """
+    p = population
+    executor = get_generation_executor()
+    workers = max(1, min(workers or executor.max_workers, executor.max_workers, len(p.units) - 2))
+    if len(p.units) < 2:
+        return p
+    lock = threading.Lock()
+    busy = set()            # 変異・評価中のユニット（ペアに選ばない）
+    progress = {"issued": 0, "done": 0}
+    best = max((e.fitness for e in p.elites), default=-1)
+    start_time = time.time()
+
+    def take_job():
+        """空いているユニットからペアを選び、負けた方のコピーと変異ジョブを返す"""
+        with lock:
+            if progress["issued"] >= steps:
+                return None
+            progress["issued"] += 1
+            first, second = random.sample([i for i in range(len(p.units)) if i not in busy], 2)
+            FIRST_WON = p.units[first].fitness >= p.units[second].fitness
+            loser = second if FIRST_WON else first
+            busy.add(loser)
+
+            child = p.units[loser].model_copy(deep=True)
+            random_mutator = random.sample(MUTATORS, 1)[0]
+            print(f"MUTATING: unit {loser} with {random_mutator.__name__}")
+            build_prompt, field, judged = MUTATION_SPECS[random_mutator]
+            prompt = build_prompt(unit=child, elites=list(p.elites))
+            job = MutationJob(child, prompt, field, judged) if prompt is not None else None
+            return loser, child, job
+
+    def worker(_):
+        nonlocal best
+        while (taken := take_job()) is not None:
+            loser, child, job = taken
+            step_start = time.time()
+            try:
+                if job is not None:
+                    apply_mutations([job])
+                child.fitness = evaluate_unit(child, num_evals)
+            except Exception as e:
+                logger.error(f"Steady-state step failed for unit {loser}: {e}")
+                child = None
+            with lock:
+                if child is not None:
+                    old = p.units[loser].fitness
+                    p.units[loser] = child
+                    # エリートは世代の区切りを待たず、最高記録を更新したときに追加
+                    if child.fitness > best:
+                        best = child.fitness
+                        p.elites.append(child.model_copy())
+                    print(f"🔁 steady {progress['done'] + 1}/{steps}: unit {loser} {old} -> {child.fitness} ({time.time() - step_start:.1f}s)")
+                progress["done"] += 1
+                busy.discard(loser)
+
+    logger.info(f"Starting steady-state evolution: {steps} steps with {workers} workers")
+    executor.map(worker, range(workers), label="steady")
+    logger.info(f"Steady-state evolution done. {time.time() - start_time}s")
+
+    return p
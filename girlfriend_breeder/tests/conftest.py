@@ -0,0 +1,5 @@
+import os
+import sys
+
+# girlfriend_breeder/ 直下のモジュール（evaluation, utils, conversation_orchestrator ...）をトップレベルで import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
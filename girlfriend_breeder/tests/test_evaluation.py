@@ -0,0 +1,89 @@
+import pytest
+
+import evaluation
+from modul_types import EvolutionUnit, Population
+from utils import fitness_cache, llm_backend
+from utils.fitness_cache import FitnessCache
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """LLM_BACKEND=fake（シード固定・待ちなし）で会話し、採点は全項目 1 点、適応度キャッシュは空から"""
+    from Utils import rate_limiter
+
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("LLM_RPM", "100000")
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setattr(llm_backend, "_backend",
+                        llm_backend.FakeBackend({"seed": 0, "latency_median": 0.001, "latency_sigma": 0.0}))
+    monkeypatch.setattr(fitness_cache, "_cache", FitnessCache(max_samples=1))
+    monkeypatch.setattr(evaluation, "evaluate_conversation", lambda history: {item: 1 for item in evaluation.RUBRIC_ITEMS})
+
+    conversations = []
+
+    def orchestrator(prompt, num_evals, full_conversation=False):
+        history = real_orchestrator(prompt, num_evals, full_conversation=full_conversation)
+        conversations.append(len(history) // 2)
+        return history
+
+    real_orchestrator = evaluation.orchestrator
+    monkeypatch.setattr(evaluation, "orchestrator", orchestrator)
+    return conversations
+
+
+def _unit(prompt: str, fitness: float = 0) -> EvolutionUnit:
+    return EvolutionUnit(P=prompt, M="", fitness=fitness, history=[])
+
+
+# ---------- 適応度キャッシュのキー (user-013) ----------
+def test_fitness_cache_key_follows_rubric_version_and_judge_samples(fake_llm, monkeypatch):
+    unit = _unit("あなたは彼女役です。")
+    assert evaluation.evaluate_unit(unit, 2) == len(evaluation.RUBRIC_ITEMS)
+    evaluation.evaluate_unit(unit, 2)
+    assert len(fake_llm) == 1            # 同じ P・同じ条件は使い回す
+
+    evaluation.evaluate_unit(unit, 2, judge_samples=2)
+    assert len(fake_llm) == 2
+
+    monkeypatch.setattr(evaluation, "RUBRIC_VERSION", "test")
+    evaluation.evaluate_unit(unit, 2)
+    assert len(fake_llm) == 3
+
+
+# ---------- 会話の長さ・レーシング評価 (user-024) ----------
+def test_conversation_is_one_exchange_unless_full_conversation(fake_llm, monkeypatch):
+    unit = _unit("あなたは彼女役です。")
+    evaluation.evaluate_unit(unit, 3)
+    monkeypatch.setenv("GA_FULL_CONVERSATION", "1")
+    evaluation.evaluate_unit(unit, 3)     # 1 往復の採点は使い回さない
+    assert fake_llm == [1, 3]
+
+
+def test_racing_schedule():
+    assert evaluation.racing_schedule(4, 5) == [(4, 1, 1), (2, 2, 2), (1, 5, 2)]
+    assert evaluation.racing_schedule(1, 5) == [(1, 1, 1)]
+
+
+def test_racing_promotes_top_units_and_keeps_last_rung_fitness(fake_llm, monkeypatch):
+    monkeypatch.setenv("GA_RACING", "1")
+    # 段（会話の往復数）ごとに違う点数にして、どの段の点数が残ったかを見る
+    scores = {
+        1: {"p0": 0, "p1": 1, "p2": 2, "p3": 3},
+        2: {"p2": 20, "p3": 30},
+        4: {"p3": 40},
+    }
+    rungs = []
+
+    def evaluate_unit(unit, turns, judge_samples=1):
+        rungs.append((unit.P, turns, judge_samples))
+        return scores[turns][unit.P]
+
+    monkeypatch.setattr(evaluation, "evaluate_unit", evaluate_unit)
+    population = Population(size=4, age=0, problem_description="", elites=[],
+                            units=[_unit(f"p{i}") for i in range(4)])
+    evaluation.evaluate_population(population, 4)
+
+    assert sorted(rungs) == sorted([("p0", 1, 1), ("p1", 1, 1), ("p2", 1, 1), ("p3", 1, 1),
+                                    ("p2", 2, 2), ("p3", 2, 2), ("p3", 4, 2)])
+    assert [unit.fitness for unit in population.units] == [0, 1, 20, 40]
+    assert population.elites[-1].P == "p3"
@@ -0,0 +1,79 @@
+"""
+適応度キャッシュ
+
+mutate() で書き換わるのは各ペアの負けた方だけなので、勝った方（P が変わっていないユニット）は
+前の世代の採点を使い回す。キーは P の中身 + 評価条件（num_evals・採点基準のバージョン）のハッシュ。
+
+会話はサンプリングなので同じ P でも点数がぶれる。FITNESS_MAX_SAMPLES を 2 以上にすると、
+同じ P が再評価されるたびにその回数まで採点を足し、平均を適応度にする（ノイズを減らす）。
+    FITNESS_MAX_SAMPLES=1 : 1 度採点したら使い回す（既定）
+    FITNESS_MAX_SAMPLES=0 : キャッシュしない（毎回採点し直す）
+"""
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_MAX_SAMPLES = int(os.getenv("FITNESS_MAX_SAMPLES", "1"))
+
+
+def fitness_key(prompt: str, num_evals: int, rubric_version: str) -> str:
+    payload = json.dumps({"P": prompt, "num_evals": num_evals, "rubric": rubric_version}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class FitnessCache:
+    def __init__(self, max_samples: int = DEFAULT_MAX_SAMPLES):
+        """
+        :param max_samples: 1 つの P について採点を平均する最大回数（0 ならキャッシュしない）
+        """
+        self.max_samples = max_samples
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[float, int]] = {}   # key → (平均, 採点回数)
+
+    def get(self, key: str) -> float | None:
+        """
+        使い回せる適応度。まだ採点が max_samples 回に達していなければ None（採点し直して add する）
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < self.max_samples:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def add(self, key: str, score: float) -> float:
+        """採点を 1 回分足し、これまでの平均を返す"""
+        if self.max_samples <= 0:
+            return score
+        with self._lock:
+            mean, n = self._entries.get(key, (0.0, 0))
+            mean = (mean * n + score) / (n + 1)
+            self._entries[key] = (mean, n + 1)
+            return mean
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_fitness_cache() -> FitnessCache:
+    """プロセスで共有する FitnessCache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FitnessCache()
+        return _cache
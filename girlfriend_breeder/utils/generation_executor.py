@@ -0,0 +1,87 @@
+"""
+世代内の並列実行（ユニットの評価・ペアの変異）
+
+1 ユニットの評価（会話 + 採点）や 1 ペアの変異は LLM 待ちがほとんどなので、スレッドで並べる。
+実際の送出ペースは共有レートリミッタ（genetic_algorithm/Utils/rate_limiter.py、utils/shared.py 経由）が全スレッドまとめて調整するので、
+ワーカー数は接続プールの大きさ（LLM_MAX_CONCURRENCY）までで十分。
+結果は必ず入力順で返し、ユニットごとの所要時間を記録する。
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = int(os.getenv("GA_MAX_WORKERS", os.getenv("LLM_MAX_CONCURRENCY", "8")))
+
+
+class UnitTiming(NamedTuple):
+    index: int
+    seconds: float
+    ok: bool
+
+
+class GenerationExecutor:
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self.last_timings: list[UnitTiming] = []
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="generation")
+
+    def map(self, func, items, label: str = "unit") -> list:
+        """
+        func(item) を並列に実行し、入力順の結果リストを返す。
+        例外は全件の完了を待ってから、最初に失敗した要素のものを投げ直す
+        :param label: ログに出す処理名（evaluate / mutate など）
+        """
+        items = list(items)
+        timings: list[UnitTiming | None] = [None] * len(items)
+
+        def timed(i, item):
+            start = time.monotonic()
+            ok = False
+            try:
+                result = func(item)
+                ok = True
+                return result
+            finally:
+                timings[i] = UnitTiming(i, time.monotonic() - start, ok)
+
+        start = time.monotonic()
+        futures = [self._pool.submit(timed, i, item) for i, item in enumerate(items)]
+        errors = [f.exception() for f in futures]
+        wall = time.monotonic() - start
+
+        self.last_timings = timings
+        self._report(label, wall)
+        for e in errors:
+            if e is not None:
+                raise e
+        return [f.result() for f in futures]
+
+    def _report(self, label: str, wall: float) -> None:
+        if not self.last_timings:
+            return
+        for t in self.last_timings:
+            logger.info(f"⏱️ {label}[{t.index}]: {t.seconds:.1f}s{'' if t.ok else ' (failed)'}")
+        total = sum(t.seconds for t in self.last_timings)
+        slowest = max(t.seconds for t in self.last_timings)
+        logger.info(f"⏱️ {label}: {len(self.last_timings)} 件 wall {wall:.1f}s（最遅 {slowest:.1f}s / 合計 {total:.1f}s）")
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_generation_executor() -> GenerationExecutor:
+    """プロセスで共有する GenerationExecutor"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = GenerationExecutor()
+        return _executor
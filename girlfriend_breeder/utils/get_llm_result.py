@@ -4,18 +4,41 @@ import json
 import boto3
 import json
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 from dotenv import load_dotenv
 import botocore.exceptions
 import logging
+from utils.llm_backend import MAX_POOL_CONNECTIONS, get_backend, get_fake_backend, get_http_session, http_timeout, use_fake
+from utils.llm_replay import replayable
+from utils.shared import estimate_tokens, get_limiter, is_throttle, parse_structured, reask_prompt, schema_instruction
 
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+LARGE_MODEL_ID = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
+FAST_MODEL_ID = os.getenv('LLM_FAST_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
 
-def get_llm_resut(pre_prompt, conversation_history):
+# 呼び出し種別ごとのモデル・出力上限・停止文字列
+#   judge   : resulf_judge の True/False 判定
+#   rubric  : evaluate_conversation の採点 JSON
+#   generate: プロンプト生成・変異（従来どおり）。パース失敗時のフォールバック先
+ROUTES = {
+    "judge":    {"model": FAST_MODEL_ID,  "max_tokens": 8,    "temperature": 0, "stop": ["理由"]},
+    "rubric":   {"model": FAST_MODEL_ID,  "max_tokens": 300,  "temperature": 0, "stop": []},
+    "generate": {"model": LARGE_MODEL_ID, "max_tokens": 1000, "temperature": 0, "stop": []},
+}
+# LLM_ROUTES='{"judge": {"model": "..."}}' のように JSON で部分的に上書きできる
+for _name, _override in json.loads(os.getenv('LLM_ROUTES', '{}')).items():
+    ROUTES[_name] = {**ROUTES.get(_name, ROUTES["generate"]), **_override}
+FALLBACK_ROUTE = "generate"
+
+
+def get_llm_resut(pre_prompt, conversation_history, max_retries=3):
     # messages = [{"role": "user", "content": conversation_history}]
     messages = conversation_history
     """LLM へリクエストを送り、エラーハンドリングを強化。"""
@@ -25,17 +48,36 @@ def get_llm_resut(pre_prompt, conversation_history):
         "conversation_history": messages
     }
 
+    est = estimate_tokens(pre_prompt + json.dumps(messages, ensure_ascii=False)) + 250
+
+    def post():
+        with get_limiter("api_url").slot(est):
+            if use_fake():
+                # LLM_BACKEND=fake: API_URL と同じ形で返す（スロットリング等は ClientError で飛んでくる）
+                return {"response": [{"text": get_fake_backend().chat(pre_prompt, messages)}]}
+            # 共有セッションで keep-alive。タイムアウトは requests.exceptions.Timeout（下で "" を返す）
+            response = get_http_session().post(API_URL, data=json.dumps(payload), timeout=http_timeout())
+            response.raise_for_status()  # HTTPエラーを自動で検出
+            return response.json()
+
     try:
-        response = requests.post(API_URL, data=json.dumps(payload))
-        response.raise_for_status()  # HTTPエラーを自動で検出
+        for attempt in range(max_retries + 1):
+            try:
+                # LLM_REPLAY_MODE=replay なら記録から返す
+                result = replayable("api_url", payload, post)
+                break
+            except (requests.exceptions.HTTPError, botocore.exceptions.ClientError) as e:
+                # 429（fake なら ThrottlingException）はリミッタが上限を下げて待たせるので、そのまま再送する
+                if not (is_throttle(e) and attempt < max_retries):
+                    raise
+                print(f"⚠️ Throttling: API_URL が 429 を返しました。再試行（{attempt + 1}/{max_retries}）...")
         
-        result = response.json()
         if "response" in result and len(result["response"]) > 0:
             return result["response"][0]["text"]
         else:
             raise ValueError("LLMの応答が不正です")
 
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, botocore.exceptions.ClientError) as e:
         logger.error(f"LLM API request failed: {e}")
         return ""
 
@@ -45,76 +87,177 @@ def get_llm_resut(pre_prompt, conversation_history):
 
 
 
-def invoke_llm(prompt: str, max_retries=5, base_delay=1.0) -> str:
-    """
-    AWS Bedrock にリクエストを送り、Exponential Backoff を用いて ThrottlingException に対応
+class LLMCallError(RuntimeError):
+    """スロットリングが続いて最大リトライ回数を超えた"""
 
-    :param prompt: LLM に渡すプロンプト
-    :param max_retries: 最大リトライ回数（デフォルト 5 回）
-    :param base_delay: 初回リトライまでの待機時間（デフォルト 1 秒）
-    :return: Claude からのレスポンス（失敗時は None）
-    """
-    # # Bedrock クライアントの初期化
-    # bedrock = boto3.client(
-    #     service_name='bedrock-runtime',
-    #     region_name=os.getenv('AWS_REGION', 'us-east-1'),
-    #     aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    #     aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
-    # )
-
-        # セッションを統一
-    session = boto3.Session()
-
-    # Bedrock クライアントの初期化
-    bedrock = session.client(
-        service_name='bedrock-runtime',
-        region_name=session.region_name or 'us-east-1'  # 確実にリージョンを指定
-    )
+
+def _invoke(prompt: str, max_retries=5, route="generate") -> str:
+    """invoke_llm の本体。失敗は例外（LLMCallError / ClientError 等）で返す"""
+    # Bedrock（または LLM_BACKEND=fake ならスタンドイン）。どちらもプロセスで共有
+    bedrock = get_backend()
     # リクエストボディの構築
-    body = json.dumps({
+    r = ROUTES[route]
+    request = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 1000,
+        "max_tokens": r["max_tokens"],
         "messages": [
             {
                 "role": "user",
                 "content": prompt
             }
         ],
-        "temperature": 0,
-    })
+        "temperature": r["temperature"],
+    }
+    if r["stop"]:
+        request["stop_sequences"] = r["stop"]
+    body = json.dumps(request)
 
-    retries = 0
-    while retries < max_retries:
+    limiter = get_limiter("bedrock")
+    est = estimate_tokens(prompt) + r["max_tokens"] // 4
+    for retries in range(max_retries):
         try:
-            # Claude 3.5 Sonnet モデルを呼び出し
-            response = bedrock.invoke_model(
-                modelId='anthropic.claude-3-5-sonnet-20240620-v1:0',
-                body=body
-            )
-
-            # レスポンスの解析
-            response_body = json.loads(response['body'].read())
+            with limiter.slot(est) as slot:
+                # route のモデルを呼び出し（応答 JSON は解析済みで返る）
+                # LLM_REPLAY_MODE=replay なら記録から返す（Bedrock にはつながない）
+                response_body = replayable("invoke", body, lambda: bedrock.invoke(r["model"], body))
+                usage = response_body.get('usage') or {}
+                slot.tokens = usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
             return response_body['content'][0]['text']
-        
+
         except botocore.exceptions.ClientError as e:
             # ThrottlingException（リクエスト制限）に対応
-            if e.response['Error']['Code'] == 'ThrottlingException':
-                wait_time = base_delay * (2 ** retries)  # Exponential Backoff
-                print(f"⚠️ Throttling: リクエストが制限されました。{wait_time:.2f} 秒後に再試行（{retries + 1}/{max_retries}）...")
-                time.sleep(wait_time)
-                retries += 1
-            else:
-                print(f"❌ AWS ClientError: {str(e)}")
-                return None
-        
-        except Exception as e:
-            print(f"❌ その他のエラー: {str(e)}")
-            return None
+            if not is_throttle(e):
+                raise
+            print(f"⚠️ Throttling: リクエストが制限されました。リミッタの枠を待って再試行（{retries + 1}/{max_retries}）...")
+
+    raise LLMCallError("最大リトライ回数を超えました。しばらく待ってから再試行してください。")
 
-    print("❌ 最大リトライ回数を超えました。しばらく待ってから再試行してください。")
+
+def invoke_llm(prompt: str, max_retries=5, route="generate") -> str:
+    """
+    AWS Bedrock にリクエストを送る。
+    ThrottlingException は共有レートリミッタが検知して全スレッドの送出ペースを落とすので、
+    呼び出しごとのバックオフはせず、リミッタの枠が空いたら再送する。
+
+    :param prompt: LLM に渡すプロンプト
+    :param max_retries: 最大リトライ回数（デフォルト 5 回）
+    :param route: ROUTES のキー。判定・採点は小さく速いモデルに回す
+    :return: Claude からのレスポンス（失敗時は None）
+    """
+    try:
+        return _invoke(prompt, max_retries, route)
+    except LLMCallError as e:
+        print(f"❌ {e}")
+    except botocore.exceptions.ClientError as e:
+        print(f"❌ AWS ClientError: {str(e)}")
+    except Exception as e:
+        print(f"❌ その他のエラー: {str(e)}")
     return None
 
 
+class LLMResult(NamedTuple):
+    text: str | None
+    error: Exception | None = None
+
+
+def run_many(func, items, concurrency=None) -> list:
+    """
+    func(item) を最大 concurrency 並列で実行し、入力順の LLMResult のリストを返す。
+    1 件の失敗は他を止めず、その要素の error に入る。
+    実際の送出ペースは共有リミッタが決めるので、concurrency は接続プールの大きさまでで十分
+    """
+    items = list(items)
+    if not items:
+        return []
+    workers = max(1, min(concurrency or MAX_POOL_CONNECTIONS, len(items)))
+
+    def call(item):
+        try:
+            return LLMResult(func(item))
+        except Exception as e:
+            return LLMResult(None, e)
+
+    if workers == 1:
+        return [call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm") as pool:
+        return list(pool.map(call, items))
+
+
+def invoke_llm_many(prompts, concurrency=None, route="generate", max_retries=5) -> list:
+    """
+    複数のプロンプトを並列に投げ、入力順の LLMResult(text, error) のリストを返す。
+    全体の待ち時間は合計ではなく一番遅い呼び出しで決まる。
+    """
+    start = time.monotonic()
+    results = run_many(lambda prompt: _invoke(prompt, max_retries, route), prompts, concurrency)
+    failed = sum(r.error is not None for r in results)
+    print(f"📦 invoke_llm_many: {len(results)} 件（失敗 {failed}）{time.monotonic() - start:.1f}s")
+    return results
+
+
+# route ごとの構造化出力の読み取り結果（get_parse_stats）
+_parse_counts = {}
+_parse_lock = threading.Lock()
+
+
+def _count_parse(route, outcome):
+    with _parse_lock:
+        per_route = _parse_counts.setdefault(route, {"parsed": 0, "failed": 0, "repaired": 0, "reasks": 0})
+        per_route[outcome] += 1
+
+
+def invoke_llm_parsed(prompt: str, parse, route: str, schema=None):
+    """
+    route のモデルで聞いて parse(応答) を返す。
+    パースできなければ（ValueError 等、応答なしを含む）前回の出力と理由を添えて、
+    FALLBACK_ROUTE の大きいモデルで 1 度だけ聞き直す。
+    :param schema: 聞き直しのときに出力形式として示す JSON Schema
+    """
+    response = invoke_llm(prompt, route=route)
+    try:
+        value = parse(response)
+        _count_parse(route, "parsed")
+        return value
+    except (ValueError, TypeError, AttributeError) as e:
+        _count_parse(route, "failed")
+        print(f"↪️ {route} の応答をパースできないため {FALLBACK_ROUTE} で聞き直し: {e}")
+        _count_parse(route, "reasks")
+        retry = reask_prompt(prompt, response, e, schema)
+    try:
+        value = parse(invoke_llm(retry, route=FALLBACK_ROUTE))
+    except (ValueError, TypeError, AttributeError):
+        _count_parse(route, "failed")
+        raise
+    _count_parse(route, "parsed")
+    return value
+
+
+def invoke_llm_structured(prompt: str, schema: dict, route: str, instruct: bool = True):
+    """
+    schema に沿った値を返す。JSON としてそのまま読めなければローカルで修復し、
+    それでも読めなければ 1 度だけ聞き直す（invoke_llm_parsed）。
+    :param instruct: True なら schema_instruction をプロンプト末尾に足す（プロンプトに形式を書いてあれば False）
+    """
+    def parse(response):
+        value, repaired = parse_structured(response, schema)
+        if repaired:
+            _count_parse(route, "repaired")
+        return value
+
+    if instruct:
+        prompt = f"{prompt}\n{schema_instruction(schema)}"
+    return invoke_llm_parsed(prompt, parse, route, schema)
+
+
+def get_parse_stats() -> dict:
+    """route ごとの読み取り結果と failure_rate（読めなかった割合）"""
+    with _parse_lock:
+        return {
+            route: {**c, "failure_rate": c["failed"] / max(1, c["parsed"] + c["failed"])}
+            for route, c in _parse_counts.items()
+        }
+
+
 if __name__ == "__main__":
     test = [{"role": "user", "content": "test"}]
     print(get_llm_resut("これはテストです。", test))
@@ -0,0 +1,201 @@
+"""
+オフライン用のスタンドイン LLM
+
+環境変数 LLM_BACKEND=fake のとき、invoke_llm / get_llm_resut は本物の
+Bedrock / API_URL の代わりにこのプロセス内フェイクを使う。
+設定は LLM_FAKE_CONFIG に YAML/JSON ファイルのパスを渡す（キーは FAKE_DEFAULTS 参照）。
+
+別プロセスのスタンドインサーバを使う場合は genetic_algorithm/Utils/stand_in_server.py を起動し、
+LLM_API_URL と BEDROCK_ENDPOINT_URL をそこに向ける。
+
+本番の Bedrock クライアントと API_URL 用の requests.Session はプロセスで 1 つずつ作って使い回す
+（keep-alive で接続を再利用し、呼び出しごとのクライアント生成と TLS ハンドシェイクを省く）。
+接続数の上限は LLM_MAX_POOL_CONNECTIONS（既定は LLM_MAX_CONCURRENCY と同じ）。
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import boto3
+import requests
+import yaml
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
+
+# 共有リミッタの同時実行上限と揃えておけば、接続待ちで詰まることはない
+MAX_POOL_CONNECTIONS = int(os.getenv("LLM_MAX_POOL_CONNECTIONS", os.getenv("LLM_MAX_CONCURRENCY", "8")))
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+
+FAKE_DEFAULTS = {
+    "seed": None,
+    "latency_median": 0.8,    # 秒（対数正規分布の中央値）
+    "latency_sigma": 0.4,     # 対数正規分布の σ（大きいほど裾が重い）
+    "error_rate": 0.0,        # ServiceUnavailable を返す確率
+    "throttle_rate": 0.0,     # ThrottlingException を返す確率
+    "max_rpm": None,          # 直近 60 秒のリクエスト数がこれを超えたらスロットリング
+    "rules": [],              # [{"match": 正規表現, "response": 文字列 or 文字列リスト（順に返す）}]
+}
+
+UTTERANCES = [
+    "え、そうなんだ！もっと聞かせて？",
+    "ふふ、今日はなんだか機嫌いいね。",
+    "ねえ、週末どこか行かない？",
+    "うん、わかるよ。私もそういう時あるもん。",
+]
+
+
+def use_fake() -> bool:
+    return os.getenv("LLM_BACKEND", "bedrock") == "fake"
+
+
+class BedrockBackend:
+    """本番の Bedrock。invoke は FakeBackend と同じ形の dict を返す"""
+
+    def __init__(self):
+        # セッションを統一（boto3 のクライアントはスレッドセーフなので全スレッドで共有する）
+        session = boto3.Session()
+        self.client = session.client(
+            service_name='bedrock-runtime',
+            region_name=session.region_name or 'us-east-1',  # 確実にリージョンを指定
+            endpoint_url=os.getenv('BEDROCK_ENDPOINT_URL'),  # スタンドインサーバに向ける時だけ指定
+            config=Config(
+                max_pool_connections=MAX_POOL_CONNECTIONS,
+                connect_timeout=CONNECT_TIMEOUT,
+                read_timeout=READ_TIMEOUT,
+                tcp_keepalive=True,
+            ),
+        )
+
+    def invoke(self, model_id: str, body: str) -> dict:
+        response = self.client.invoke_model(modelId=model_id, body=body)
+        return json.loads(response['body'].read())
+
+
+class FakeBackend:
+    def __init__(self, config: dict | None = None):
+        cfg = {**FAKE_DEFAULTS, **(config or {})}
+        self.cfg = cfg
+        self._rng = random.Random(cfg["seed"])
+        self._rules = [
+            {"match": re.compile(r["match"], re.S), "responses": r["response"] if isinstance(r["response"], list) else [r["response"]], "i": 0}
+            for r in cfg["rules"]
+        ]
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def respond(self, prompt: str, conversational: bool = False) -> str:
+        with self._lock:
+            for rule in self._rules:
+                if rule["match"].search(prompt):
+                    text = rule["responses"][rule["i"] % len(rule["responses"])]
+                    rule["i"] += 1
+                    return text
+            if conversational:
+                return self._rng.choice(UTTERANCES)
+            return self._default_response(prompt)
+
+    def _default_response(self, prompt: str) -> str:
+        """プロンプトの出力形式指定を見て、それらしい応答を作る"""
+        rng = self._rng
+        if "True, False" in prompt:
+            return "True"
+        if "JSON形式" in prompt:
+            keys = re.findall(r'"([^"]+)": X', prompt)
+            return json.dumps({k: rng.randint(4, 9) for k in keys}, ensure_ascii=False)
+        if "プロンプト" in prompt:
+            return "あなたは親しい恋人です。敬語を使わず、短く優しく、相手の気持ちに寄り添って話してください。"
+        return rng.choice(UTTERANCES)
+
+    def _wait_and_maybe_fail(self) -> None:
+        with self._lock:
+            latency = self._rng.lognormvariate(0, self.cfg["latency_sigma"]) * self.cfg["latency_median"]
+            now = time.monotonic()
+            self._recent.append(now)
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            over_rpm = self.cfg["max_rpm"] is not None and len(self._recent) > self.cfg["max_rpm"]
+            r = self._rng.random()
+        time.sleep(latency)
+        if over_rpm or r < self.cfg["throttle_rate"]:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests (fake)"}}, "InvokeModel")
+        if r < self.cfg["throttle_rate"] + self.cfg["error_rate"]:
+            raise ClientError({"Error": {"Code": "ServiceUnavailableException", "Message": "Service unavailable (fake)"}}, "InvokeModel")
+
+    def invoke(self, model_id: str, body: str) -> dict:
+        """Bedrock invoke_model と同じ形の応答 dict を返す"""
+        data = json.loads(body)
+        prompt = data["messages"][-1]["content"]
+        if not isinstance(prompt, str):
+            prompt = "".join(b.get("text", "") for b in prompt)
+        self._wait_and_maybe_fail()
+        text = self.respond(prompt)
+        for stop in data.get("stop_sequences") or []:   # 本物と同じく停止文字列の手前で打ち切る
+            if (i := text.find(stop)) >= 0:
+                text = text[:i]
+        return {
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": max(1, len(prompt) // 2), "output_tokens": max(1, len(text) // 2)},
+        }
+
+    def chat(self, pre_prompt: str, conversation_history: list) -> str:
+        """API_URL 形式（pre_prompt + 会話履歴）の応答テキスト"""
+        self._wait_and_maybe_fail()
+        last = conversation_history[-1]["content"] if conversation_history else ""
+        return self.respond(f"{pre_prompt}\n{last}", conversational=True)
+
+
+_backend: FakeBackend | None = None
+_bedrock: BedrockBackend | None = None
+_http: requests.Session | None = None
+_backend_lock = threading.Lock()
+
+
+def get_fake_backend() -> FakeBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            path = os.getenv("LLM_FAKE_CONFIG")
+            config = {}
+            if path:
+                with open(path, "r", encoding="utf-8") as f:
+                    config = yaml.safe_load(f) or {}
+            print("🧪 FakeBackend を使用します（オフライン）")
+            _backend = FakeBackend(config)
+        return _backend
+
+
+def get_backend():
+    """LLM_BACKEND に応じて FakeBackend か BedrockBackend を返す（どちらもプロセスで 1 つ）"""
+    global _bedrock
+    if use_fake():
+        return get_fake_backend()
+    with _backend_lock:
+        if _bedrock is None:
+            print(f"🔌 Bedrock クライアント初期化（最大 {MAX_POOL_CONNECTIONS} 接続）")
+            _bedrock = BedrockBackend()
+        return _bedrock
+
+
+def get_http_session() -> requests.Session:
+    """API_URL 用の共有 requests.Session（keep-alive、接続数は MAX_POOL_CONNECTIONS まで）"""
+    global _http
+    with _backend_lock:
+        if _http is None:
+            _http = requests.Session()
+            # 上限を超えた分は接続が空くまで待つ（捨て接続を作らない）
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_POOL_CONNECTIONS, pool_block=True)
+            _http.mount("http://", adapter)
+            _http.mount("https://", adapter)
+        return _http
+
+
+def http_timeout() -> tuple:
+    """requests に渡す (接続, 読み取り) タイムアウト"""
+    return (CONNECT_TIMEOUT, READ_TIMEOUT)
@@ -0,0 +1,66 @@
+"""
+LLM 通信の記録・再生（記録ファイルの形式と照合は genetic_algorithm/Utils/llm_replay.py の ReplayLog）
+
+LLM_REPLAY_MODE=record : invoke_llm（Bedrock）と get_llm_resut（API_URL）のやり取りを追記する
+LLM_REPLAY_MODE=replay : 記録から応答を返す。Bedrock にも API_URL にもつながない
+LLM_REPLAY_PATH  : 記録ファイル（既定 data/llm_replay.jsonl）
+LLM_REPLAY_SPEED : 1 = 記録どおりの待ち時間、10 = 10 倍速、0 = 待たない
+LLM_REPLAY_STRICT: 1 なら指紋が一致しない呼び出しをエラーにする
+
+genetic_algorithm はバックエンドごと包むが、こちらは API_URL もあるので呼び出し単位（replayable）で包む。
+GA の乱数も揃えたいときは main.py の --seed を記録時と同じ値で指定する。
+"""
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from utils.shared import ReplayLog
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_replay_log():
+    """LLM_REPLAY_MODE が record / replay ならプロセス共有の ReplayLog、それ以外は None"""
+    global _log
+    mode = os.getenv("LLM_REPLAY_MODE", "").lower()
+    if mode not in ("record", "replay"):
+        return None
+    with _log_lock:
+        if _log is None:
+            _log = ReplayLog(
+                os.getenv("LLM_REPLAY_PATH", "data/llm_replay.jsonl"),
+                mode=mode,
+                speed=float(os.getenv("LLM_REPLAY_SPEED", "1")),
+                strict=os.getenv("LLM_REPLAY_STRICT", "0") == "1",
+            )
+            if mode == "record":
+                print(f"📼 LLM 記録モード: {_log.path}")
+        return _log
+
+
+def replayable(channel: str, request, call):
+    """
+    call() の結果（JSON にできる値）を記録・再生する。
+    記録するのは成功と ClientError（スロットリング等）だけで、それ以外の例外は素通し
+    """
+    log = get_replay_log()
+    if log is None:
+        return call()
+    if log.mode == "replay":
+        rec = log.lookup(channel, request)
+        time.sleep(log.delay(rec["dt"]))
+        log.raise_if_error(rec)
+        return rec["response"]
+    start = time.monotonic()
+    try:
+        result = call()
+    except ClientError as e:
+        err = e.response.get("Error", {})
+        log.record(channel, request, time.monotonic() - start,
+                   error={"code": err.get("Code", "Unknown"), "message": err.get("Message", str(e))})
+        raise
+    log.record(channel, request, time.monotonic() - start, response=result)
+    return result
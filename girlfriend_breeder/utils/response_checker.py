@@ -1,4 +1,6 @@
-from utils.get_llm_result import invoke_llm
+from utils.get_llm_result import invoke_llm_structured
+
+VERDICT_SCHEMA = {"type": "string", "enum": ["True", "False"]}
 
 
 def resulf_judge(answer):
@@ -26,6 +28,7 @@ def resulf_judge(answer):
     False
     """
     
-    result = invoke_llm(prompt)
-    
-    return result
\ No newline at end of file
+    try:
+        return invoke_llm_structured(prompt, VERDICT_SCHEMA, route="judge", instruct=False)
+    except ValueError:
+        return None
\ No newline at end of file
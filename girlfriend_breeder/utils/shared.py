@@ -0,0 +1,19 @@
+"""
+genetic_algorithm/Utils と共通の部品
+
+共有レートリミッタ・構造化出力の読み取り・LLM 通信の記録形式は genetic_algorithm/Utils に
+1 つだけ実装があり、girlfriend_breeder はここ経由でそれを import して使う（コピーは持たない）。
+genetic_algorithm は sys.path の末尾に足すので、girlfriend_breeder 側のモジュール（utils など）が優先される。
+"""
+import os
+import sys
+
+GENETIC_ALGORITHM_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "genetic_algorithm")
+)
+if GENETIC_ALGORITHM_DIR not in sys.path:
+    sys.path.append(GENETIC_ALGORITHM_DIR)
+
+from Utils.llm_replay import ReplayLog  # noqa: E402
+from Utils.rate_limiter import estimate_tokens, get_limiter, is_throttle  # noqa: E402
+from Utils.structured_output import parse_structured, reask_prompt, schema_instruction  # noqa: E402